@@ -0,0 +1,44 @@
+"""On-air duration of the frames of the protocol, computed from the Config alone"""
+import math
+from demodulator import header_fields
+from fec import FrameCoder
+
+
+def data_modulation(config, rate : int = None) -> tuple:
+    """Returns the symbol duration and number of subcarrier groups of the data symbols at a rate"""
+    if config.rate_adaptation:
+        return config.rate_table[rate or 0]
+    return config.Symbol_duration, config.subcarrier_groups if config.modulation == "multitone" else 1
+
+
+def preamble_airtime(config) -> float:
+    """Returns the duration of a preamble in seconds"""
+    return config.Preamble_length * config.Preamble_tone_duration
+
+
+def control_airtime(config) -> float:
+    """Returns the duration of an RTS or CTS frame (preamble, addresses and duration field) in seconds"""
+    return preamble_airtime(config) + (1 + config.nav_symbols) * config.Symbol_duration
+
+
+def subframe_airtime(config, bits : int, rate : int = None) -> float:
+    """Returns the duration in seconds of the header, data and trailer of a data frame or subframe of bits data bits"""
+    duration, groups = data_modulation(config, rate)
+    fixed_symbols = len(header_fields(config)) + FrameCoder(config).trailer_symbols
+    return fixed_symbols * config.Symbol_duration + math.ceil(bits / (4 * groups)) * duration
+
+
+def data_airtime(config, lengths : list, rate : int = None) -> float:
+    """
+    Returns the duration in seconds of a data frame, or aggregate if there are several, whose subframes hold the
+    given numbers of data bits
+    """
+    seconds = preamble_airtime(config) + (config.Symbol_duration if len(lengths) > 1 else 0)
+    return seconds + sum(subframe_airtime(config, bits, rate) for bits in lengths)
+
+
+def ack_airtime(config) -> float:
+    """Returns the duration of the acknowledgement of a unicast data frame (ending tone or block acknowledgement)"""
+    if config.arq == "selective_repeat":
+        return preamble_airtime(config) + config.Symbol_duration
+    return config.Ending_duration
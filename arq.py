@@ -0,0 +1,133 @@
+"""Selective-repeat ARQ: bounded per-peer sequence windows and the block acknowledgement that reports them"""
+
+
+# Sequence numbers are sent as one 4-bit symbol
+SEQUENCE_MODULUS = 16
+# A block acknowledgement is one multitone symbol of 4 subcarrier groups (16 bits):
+# sender (2 bits), receiver (2 bits), start sequence number (4 bits) and the bitmap (up to 8 bits, zero padded)
+BLOCK_ACK_GROUPS = 4
+
+
+def encode_block_ack(sender : str, receiver : str, start : int, bitmap : str) -> str:
+    """Returns the 16 bits of a block acknowledgement"""
+    return (sender + receiver + bin(start)[2:].zfill(4) + bitmap).ljust(4 * BLOCK_ACK_GROUPS, "0")
+
+
+def decode_block_ack(bits : str, window : int, address_bits : int = 2) -> dict:
+    """Returns the fields of the 16 bits of a block acknowledgement (more with addresses wider than 2 bits)"""
+    start = 2 * address_bits
+    return {"sender": bits[0:address_bits], "receiver": bits[address_bits:start], "start": int(bits[start:start + 4], 2),
+            "bitmap": bits[start + 4:start + 4 + window]}
+
+
+class SendWindow:
+    """
+    A class used to represent the sending side of the window towards one destination
+
+
+    Attributes
+    ----------
+    window : int
+        Maximum number of sequence numbers in flight
+    base : int
+        Oldest sequence number not acknowledged yet
+    """
+
+    def __init__(self, window : int) -> None:
+        """Initialises the member variables of the class"""
+        self.window : int = window
+        self.base : int = 0
+
+    def sendable(self, sequence : int) -> bool:
+        """Returns whether a sequence number is inside the window"""
+        return (sequence - self.base) % SEQUENCE_MODULUS < self.window
+
+    def acknowledge(self, start : int, bitmap : str, sequences : list) -> list:
+        """
+        Applies a block acknowledgement (the receiver's next expected sequence number and whether each of the window
+        sequence numbers from there was received) and returns, for every sent sequence number, whether it was received
+        """
+        received = []
+        for sequence in sequences:
+            behind = (start - sequence) % SEQUENCE_MODULUS
+            ahead = (sequence - start) % SEQUENCE_MODULUS
+            received.append(0 < behind <= self.window or (ahead < len(bitmap) and bitmap[ahead] == "1"))
+        self.base = start
+        return received
+
+
+class ReceiveWindow:
+    """
+    A class used to represent the receiving side of the window from one sender.
+    Frames received out of order are held (at most window of them) until the ones before them arrive, so messages are
+    released in order and each one only once.
+
+
+    Attributes
+    ----------
+    window : int
+        Number of sequence numbers accepted from base on
+    base : int
+        Next sequence number to release
+    buffer : dict[int -> object]
+        Frames received ahead of base
+    """
+
+    def __init__(self, window : int) -> None:
+        """Initialises the member variables of the class"""
+        self.window : int = window
+        self.base : int = 0
+        self.buffer = {}
+
+    def receive(self, sequence : int, item) -> list:
+        """Stores a received frame and returns the items it releases, in order (none for a duplicate)"""
+        if (sequence - self.base) % SEQUENCE_MODULUS >= self.window:
+            # Already released (a retransmission whose acknowledgement was lost) or outside the window
+            return []
+        self.buffer.setdefault(sequence, item)
+        released = []
+        while self.base in self.buffer:
+            released.append(self.buffer.pop(self.base))
+            self.base = (self.base + 1) % SEQUENCE_MODULUS
+        return released
+
+    def bitmap(self) -> str:
+        """Returns one bit per sequence number of the window from base: whether it has been received"""
+        return "".join("1" if (self.base + i) % SEQUENCE_MODULUS in self.buffer else "0" for i in range(self.window))
+
+
+class SelectiveRepeat:
+    """
+    A class used to represent the ARQ state of a node: one send window per destination and one receive window per
+    sender, created on first use.
+
+
+    Attributes
+    ----------
+    window : int
+        Window size in frames (at most SEQUENCE_MODULUS // 2, and at most 8 to fit the block acknowledgement)
+    send_windows : dict[str -> SendWindow]
+        Send window of every destination
+    receive_windows : dict[int -> ReceiveWindow]
+        Receive window of every sender
+    """
+
+    def __init__(self, window : int) -> None:
+        """Initialises the member variables of the class"""
+        if not 1 <= window <= min(SEQUENCE_MODULUS // 2, 8):
+            raise ValueError("The ARQ window must be between 1 and 8 frames, not %d" % window)
+        self.window : int = window
+        self.send_windows = {}
+        self.receive_windows = {}
+
+    def send_window(self, peer : str) -> SendWindow:
+        """Returns the send window towards a destination"""
+        if peer not in self.send_windows:
+            self.send_windows[peer] = SendWindow(self.window)
+        return self.send_windows[peer]
+
+    def receive_window(self, peer : int) -> ReceiveWindow:
+        """Returns the receive window from a sender"""
+        if peer not in self.receive_windows:
+            self.receive_windows[peer] = ReceiveWindow(self.window)
+        return self.receive_windows[peer]
@@ -0,0 +1,170 @@
+"""asyncio interface to a node: send messages, await their acknowledgement and iterate over received messages"""
+import asyncio
+import threading
+from collections import namedtuple
+from config import Config
+from main import Main
+
+
+# A message delivered to this node: its bits, the sender's node number, its 2-bit message id and the node's clock
+Received = namedtuple("Received", ["message", "sender", "message_id", "time"])
+
+
+class AsyncNode:
+    """
+    A class used to represent a node driven from an asyncio event loop.
+    The node's main loop (blocking audio I/O, signal processing and the MAC) runs in a thread of its own, so any
+    number of nodes can run at once; messages are handed to it without going through a .buffer file, and its events
+    are passed back to the event loop. start() returns at once and ready() waits for the audio to be open and
+    calibrated. Several nodes can share one event loop, e.g. on the nodes of a SimulatedChannel, whose calibration
+    waits for every node of the channel: start them all, then wait for them to be ready.
+
+        nodes = [AsyncNode(channel.node(i), i + 1) for i in range(3)]
+        for node in nodes:
+            await node.start()
+        await asyncio.gather(*(node.ready() for node in nodes))
+        delivered = await nodes[0].send(2, "1011")
+        async for received in nodes[1]:
+            ...
+
+
+    Attributes
+    ----------
+    main : Main
+        The node, created without a .buffer file and without printing
+    loop : asyncio.AbstractEventLoop
+        Event loop the node was started from
+    pending : dict[int -> (asyncio.Future, int)]
+        Future and number of frames still unacknowledged of every message being sent, by ticket
+    received : asyncio.Queue
+        Messages received and not iterated over yet
+    thread : threading.Thread
+        Thread opening the audio and running the main loop (None before start() and after close())
+    opened : asyncio.Future
+        Resolved once the audio is open and calibrated (with the error if opening it failed)
+    stopped : asyncio.Future
+        Resolved once the main loop has returned and released the audio (with the error it raised, if any)
+    """
+
+    def __init__(self, audio = None, node_id : int = 1, config : Config = None, buffer_file : str = None) -> None:
+        """Initialises the member variables of the class"""
+        self.main = Main(audio=audio, node_id=str(node_id), buffer_file=buffer_file, config=config, verbose=False)
+        self.main.listeners.append(self.on_event)
+        self.loop = None
+        self.pending = {}
+        self.received = asyncio.Queue()
+        self.thread = None
+        self.opened = self.stopped = None
+
+    async def start(self) -> None:
+        """Starts the node's thread, which opens the audio, calibrates it and runs the main loop (see ready())"""
+        self.loop = asyncio.get_running_loop()
+        self.opened = self.loop.create_future()
+        self.stopped = self.loop.create_future()
+        self.thread = threading.Thread(target=self.serve, name="node-%s" % self.main.node_id, daemon=True)
+        self.thread.start()
+
+    async def ready(self) -> None:
+        """Waits until the audio is open and calibrated (raises the error opening it raised)"""
+        await asyncio.shield(self.opened)
+
+    def serve(self) -> None:
+        """Node thread: opens the audio, then runs the main loop until close()"""
+        try:
+            stream = self.main.open()
+        except Exception as error:
+            self.loop.call_soon_threadsafe(self.settle, self.opened, error)
+            self.loop.call_soon_threadsafe(self.settle, self.stopped, None)
+            return
+        self.loop.call_soon_threadsafe(self.settle, self.opened, None)
+        try:
+            self.main.run(stream)
+        except Exception as error:
+            self.loop.call_soon_threadsafe(self.settle, self.stopped, error)
+            return
+        self.loop.call_soon_threadsafe(self.settle, self.stopped, None)
+
+    @staticmethod
+    def settle(future : asyncio.Future, error : Exception = None) -> None:
+        """Resolves a future of the node's thread on the event loop (with error, if any)"""
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(None)
+
+    async def close(self) -> None:
+        """Stops the main loop, waits for it to release the audio and fails the messages still being sent"""
+        self.main.stop()
+        if self.thread is not None:
+            self.thread = None
+            await self.stopped
+        for future, _ in self.pending.values():
+            if not future.done():
+                future.set_result(False)
+        self.pending.clear()
+
+    async def __aenter__(self) -> "AsyncNode":
+        """Starts the node and waits for it to be ready"""
+        await self.start()
+        await self.ready()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        """Closes the node"""
+        await self.close()
+
+    async def send(self, dest : int, payload : str, timeout : float = None) -> bool:
+        """
+        Sends a message (a bit string) to a node (0 broadcasts it) and returns True once every frame of it was
+        acknowledged, or False if the node gave up on it (too long, retry limit).
+        After timeout seconds, or if the caller is cancelled, the frames not sent yet are dropped (unless selective
+        repeat numbered them, see Node.fail) and asyncio.TimeoutError (or CancelledError) is raised.
+        """
+        future = self.loop.create_future()
+        ticket = self.main.submit(payload, str(dest))
+        self.pending[ticket] = (future, None)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            self.pending.pop(ticket, None)
+            self.main.cancel(ticket)
+            raise
+
+    async def receive(self, timeout : float = None) -> Received:
+        """Returns the next message received (asyncio.TimeoutError after timeout seconds)"""
+        return await asyncio.wait_for(self.received.get(), timeout)
+
+    def __aiter__(self) -> "AsyncNode":
+        """Iterates over the messages received, forever"""
+        return self
+
+    async def __anext__(self) -> Received:
+        """Returns the next message received"""
+        return await self.received.get()
+
+    def on_event(self, kind : str, time : float, data : dict) -> None:
+        """Main listener, called from the main loop's thread: hands the event over to the event loop"""
+        if kind in ("queued", "delivered", "failed", "received"):
+            self.loop.call_soon_threadsafe(self.handle, kind, time, data)
+
+    def handle(self, kind : str, time : float, data : dict) -> None:
+        """Resolves the sends and queues the messages an event of the main loop completes"""
+        if kind == "received":
+            self.received.put_nowait(Received(data["message"], data["sender"], data["message_id"], float(time)))
+            return
+        entry = self.pending.get(data["ticket"])
+        if entry is None:
+            return
+        future, frames = entry
+        if kind == "queued":
+            self.pending[data["ticket"]] = (future, data["frames"])
+            return
+        if kind == "delivered" and frames is not None and frames > 1:
+            # A fragment of the message: it is delivered with its last one
+            self.pending[data["ticket"]] = (future, frames - 1)
+            return
+        del self.pending[data["ticket"]]
+        if not future.done():
+            future.set_result(kind == "delivered")
@@ -0,0 +1,305 @@
+"""A persistent full-duplex audio engine shared by the sender and the receiver"""
+import threading
+from collections import deque
+import numpy as np
+from audio_formats import paContinue, paInputOverflow, paInt16, paFloat32, paOutputUnderflow, get_sample_size, open_pyaudio
+from config import Config
+
+
+class RingBuffer:
+    """
+    A class used to represent a fixed size single-producer single-consumer ring buffer of int16 samples.
+    The producer only moves write_index and the consumer only moves read_index, so no lock is needed.
+
+
+    Attributes
+    ----------
+    capacity : int
+        Number of samples the buffer can hold
+    buffer : np.ndarray
+        Preallocated storage for the samples
+    write_index : int
+        Total number of samples ever written (only advanced by the producer)
+    read_index : int
+        Total number of samples ever consumed (only advanced by the consumer)
+    overrun_samples : int
+        Number of samples that were overwritten before the consumer read them
+    """
+
+    def __init__(self, capacity : int) -> None:
+        """Initialises the member variables of the class"""
+        self.capacity : int = capacity
+        self.buffer = np.zeros(capacity, dtype=np.int16)
+        self.write_index : int = 0
+        self.read_index : int = 0
+        self.overrun_samples : int = 0
+
+    def available(self) -> int:
+        """Returns the number of unread samples (capped at the capacity)"""
+        return min(self.write_index - self.read_index, self.capacity)
+
+    def write(self, samples : np.ndarray) -> None:
+        """Appends samples, overwriting the oldest ones when the buffer is full"""
+        n = len(samples)
+        if n > self.capacity:
+            samples = samples[-self.capacity:]
+            self.write_index += n - self.capacity
+            n = self.capacity
+        start = self.write_index % self.capacity
+        first = min(n, self.capacity - start)
+        self.buffer[start:start + first] = samples[:first]
+        self.buffer[:n - first] = samples[first:]
+        # Publishing the new index last makes the samples visible to the consumer only once they are in place
+        self.write_index += n
+
+    def skip_overrun(self) -> None:
+        """Moves the read index past samples that have already been overwritten"""
+        oldest = self.write_index - self.capacity
+        if self.read_index < oldest:
+            self.overrun_samples += oldest - self.read_index
+            self.read_index = oldest
+
+    def read(self, n : int, out : np.ndarray = None) -> np.ndarray:
+        """Copies the oldest n unread samples (the caller must check available() first)"""
+        if out is None:
+            out = np.empty(n, dtype=np.int16)
+        while True:
+            self.skip_overrun()
+            start = self.read_index % self.capacity
+            first = min(n, self.capacity - start)
+            out[:first] = self.buffer[start:start + first]
+            out[first:n] = self.buffer[:n - first]
+            # If the producer lapped us while copying, the copy is torn, so retry from the new oldest sample
+            if self.write_index - self.read_index <= self.capacity:
+                self.read_index += n
+                return out
+
+    def discard_until(self, index : int) -> None:
+        """Drops every unread sample written before the given absolute index"""
+        self.read_index = max(self.read_index, min(index, self.write_index))
+
+
+class InputView:
+    """
+    A stream-like view over the capture ring buffer, returned by AudioEngine.open for input streams.
+    Frames of any size can be read and closing it does not stop the capture.
+    """
+
+    def __init__(self, engine, frames_per_buffer : int) -> None:
+        """Initialises the member variables of the class"""
+        self.engine = engine
+        self.frames_per_buffer = frames_per_buffer
+
+    def read(self, num_frames : int, exception_on_overflow : bool = True) -> bytes:
+        """Blocks until num_frames samples have been captured and returns them as int16 bytes"""
+        return self.engine.read(num_frames).tobytes()
+
+    def get_read_available(self) -> int:
+        """Returns the number of samples that can be read without blocking"""
+        return self.engine.capture.available()
+
+    def stop_stream(self) -> None:
+        """Kept for compatibility with pyaudio streams, the capture keeps running"""
+
+    def close(self) -> None:
+        """Kept for compatibility with pyaudio streams, the capture keeps running"""
+
+
+class OutputView:
+    """
+    A stream-like view over the playback queue, returned by AudioEngine.open for output streams.
+    It follows pyaudio's Stream.write semantics so that the Sender does not need to change.
+    """
+
+    def __init__(self, engine, format : int) -> None:
+        """Initialises the member variables of the class"""
+        self.engine = engine
+        self.format = format
+        self.sample_width = get_sample_size(format)
+
+    def write(self, frames, num_frames : int = None, exception_on_underflow : bool = False) -> None:
+        """Queues num_frames samples for playback (pyaudio plays len(frames) / sample_width frames by default)"""
+        if num_frames is None:
+            num_frames = int(len(frames) / self.sample_width)
+        if self.format == paFloat32:
+            samples = np.frombuffer(memoryview(frames).cast("B"), dtype=np.float32, count=num_frames)
+        else:
+            samples = np.frombuffer(memoryview(frames).cast("B"), dtype=np.int16, count=num_frames)
+        self.engine.write(samples)
+
+    def stop_stream(self) -> None:
+        """Kept for compatibility with pyaudio streams, queued samples are still played"""
+
+    def close(self) -> None:
+        """Kept for compatibility with pyaudio streams, queued samples are still played"""
+
+
+class AudioEngine:
+    """
+    A class used to represent a long-lived, callback-driven, full-duplex audio stream.
+    Capture runs all the time into a ring buffer and playback is queued, so nothing is ever reopened.
+    Backends without callback support (supports_callback = False, e.g. the simulated channel) get one blocking
+    duplex stream instead, which reads and writes go straight to.
+
+
+    Attributes
+    ----------
+    config : Config
+        The configuration object that contains the sample rate
+    p : pyaudio.PyAudio
+        The audio backend used to open the duplex stream
+    capture : RingBuffer
+        Ring buffer holding the captured int16 samples
+    playback : deque[np.ndarray]
+        Queue of int16 sample blocks waiting to be played
+    dropped_samples : int
+        Number of input samples lost by the device (input overflow)
+    underrun_samples : int
+        Number of output samples the device had to make up (output underflow)
+    callback_mode : bool
+        Whether the stream is callback-driven (otherwise it is a blocking duplex stream)
+    recorder : CaptureRecorder
+        Gets a copy of every captured block (None when the capture is not recorded)
+    """
+
+    def __init__(self, config : Config = None, audio = None, buffer_seconds : float = 10.0, frames_per_buffer : int = None) -> None:
+        """Initialises the member variables of the class and starts the stream"""
+        self.config = config if config is not None else Config()
+        self.p = audio if audio is not None else open_pyaudio()
+        self.Sample_rate : int = self.config.Sample_rate
+        if frames_per_buffer is None:
+            frames_per_buffer = int(self.Sample_rate * self.config.Preamble_duration)
+        self.frames_per_buffer : int = frames_per_buffer
+        self.capture = RingBuffer(int(self.Sample_rate * buffer_seconds))
+        self.playback = deque()
+        self.playback_offset : int = 0
+        self.queued_samples : int = 0
+        self.played_samples : int = 0
+        self.tx_end_index : int = 0
+        self.dropped_samples : int = 0
+        self.underrun_samples : int = 0
+        self.data_ready = threading.Event()
+        self.tx_done = threading.Event()
+        self.tx_done.set()
+        self.silence = np.zeros(frames_per_buffer, dtype=np.int16)
+        self.callback_mode : bool = getattr(self.p, "supports_callback", True)
+        self.recorder = None
+        if not self.callback_mode:
+            self.stream = self.p.open(format=paInt16,
+                                      channels=1,
+                                      rate=self.Sample_rate,
+                                      input=True,
+                                      output=True,
+                                      frames_per_buffer=frames_per_buffer)
+            return
+        self.stream = self.p.open(format=paInt16,
+                                  channels=1,
+                                  rate=self.Sample_rate,
+                                  input=True,
+                                  output=True,
+                                  frames_per_buffer=frames_per_buffer,
+                                  stream_callback=self.callback)
+        self.stream.start_stream()
+
+    def callback(self, in_data, frame_count, time_info, status):
+        """PortAudio callback: stores the captured samples and plays the next queued ones"""
+        if status & paInputOverflow:
+            self.dropped_samples += frame_count
+        if status & paOutputUnderflow:
+            self.underrun_samples += frame_count
+        if in_data is not None:
+            samples = np.frombuffer(in_data, dtype=np.int16)
+            self.capture.write(samples)
+            if self.recorder is not None:
+                self.recorder.write(samples)
+            self.data_ready.set()
+
+        if not self.playback:
+            return (self.silence[:frame_count].tobytes(), paContinue)
+        out = np.zeros(frame_count, dtype=np.int16)
+        filled = 0
+        while filled < frame_count and self.playback:
+            block = self.playback[0]
+            n = min(frame_count - filled, len(block) - self.playback_offset)
+            out[filled:filled + n] = block[self.playback_offset:self.playback_offset + n]
+            filled += n
+            self.playback_offset += n
+            if self.playback_offset == len(block):
+                self.playback.popleft()
+                self.playback_offset = 0
+        self.played_samples += filled
+        if not self.playback:
+            # Everything captured up to here overlaps our own transmission
+            self.tx_end_index = self.capture.write_index
+            self.tx_done.set()
+        return (out.tobytes(), paContinue)
+
+    def open(self, format : int = paInt16, channels : int = 1, rate : int = None, input : bool = False, output : bool = False, frames_per_buffer : int = None, **kwargs):
+        """Drop-in replacement for PyAudio.open that returns a view on the running duplex stream"""
+        if output:
+            return OutputView(self, format)
+        # Like a freshly opened pyaudio input stream, never return what was captured while we were transmitting
+        self.wait_for_playback()
+        self.capture.discard_until(self.tx_end_index)
+        return InputView(self, frames_per_buffer or self.frames_per_buffer)
+
+    def read(self, n : int) -> np.ndarray:
+        """Blocks until n captured samples are available and returns them"""
+        if not self.callback_mode:
+            samples = np.frombuffer(self.stream.read(n), dtype=np.int16)
+            self.capture.write_index += n
+            self.capture.read_index += n
+            if self.recorder is not None:
+                self.recorder.write(samples)
+            return samples
+        while self.capture.available() < n:
+            self.data_ready.wait(0.05)
+            self.data_ready.clear()
+        return self.capture.read(n)
+
+    def write(self, samples : np.ndarray) -> None:
+        """Queues float (-1..1) or int16 samples for playback without blocking"""
+        if samples.dtype != np.int16:
+            samples = (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+        else:
+            samples = samples.copy()
+        if not self.callback_mode:
+            self.stream.write(samples.tobytes(), len(samples))
+            self.played_samples += len(samples)
+            if self.recorder is not None:
+                # A blocking stream captures nothing while it plays, recorded as silence to keep the recording's timeline
+                self.recorder.write(np.zeros(len(samples), dtype=np.int16))
+            return
+        self.tx_done.clear()
+        self.queued_samples += len(samples)
+        self.playback.append(samples)
+
+    def wait_for_playback(self) -> None:
+        """Blocks until every queued sample has been played"""
+        while self.playback:
+            self.tx_done.wait(0.05)
+
+    def transmitting(self) -> bool:
+        """Returns whether queued samples are still being played"""
+        return bool(self.playback)
+
+    def discard_transmission(self) -> None:
+        """Drops every captured sample that overlaps our own last transmission"""
+        self.capture.discard_until(self.tx_end_index)
+
+    def stats(self) -> dict:
+        """Returns the counters of lost samples"""
+        self.capture.skip_overrun()
+        return {
+            "dropped_samples": self.dropped_samples,
+            "overrun_samples": self.capture.overrun_samples,
+            "underrun_samples": self.underrun_samples,
+            "played_samples": self.played_samples,
+            "captured_samples": self.capture.write_index,
+        }
+
+    def close(self) -> None:
+        """Stops the duplex stream and releases the audio backend"""
+        self.stream.stop_stream()
+        self.stream.close()
+        self.p.terminate()
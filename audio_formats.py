@@ -0,0 +1,33 @@
+"""pyaudio's sample formats and stream flags, which stay usable without pyaudio (e.g. on the simulated channel)"""
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+
+
+if pyaudio is not None:
+    paFloat32 = pyaudio.paFloat32
+    paInt16 = pyaudio.paInt16
+    paInputOverflow = pyaudio.paInputOverflow
+    paOutputUnderflow = pyaudio.paOutputUnderflow
+    paContinue = pyaudio.paContinue
+else:
+    # Same values as pyaudio's, so code written against pyaudio works unchanged
+    paFloat32 = 1
+    paInt16 = 8
+    paInputOverflow = 2
+    paOutputUnderflow = 4
+    paContinue = 0
+SAMPLE_SIZES = {paFloat32: 4, paInt16: 2}
+
+
+def get_sample_size(format : int) -> int:
+    """Returns the size in bytes of one sample of the format"""
+    return SAMPLE_SIZES[format]
+
+
+def open_pyaudio():
+    """Returns a pyaudio.PyAudio for the sound card, the only thing that needs pyaudio to be installed"""
+    if pyaudio is None:
+        raise ModuleNotFoundError("pyaudio is needed to use the sound card (pass another audio backend, e.g. a SimulatedChannel node, to run without it)")
+    return pyaudio.PyAudio()
@@ -0,0 +1,137 @@
+"""Backoff policies: how many idle slots a node waits before it sends again after a failed attempt"""
+import random
+
+
+class BackoffPolicy:
+    """
+    A class used to represent a contention window policy.
+    A backoff is a number of slots drawn after a collision; the MAC counts them down only while the channel is idle.
+
+
+    Attributes
+    ----------
+    collisions : int
+        Number of failed attempts since the last success
+    rng : random.Random
+        Source of the random draws
+    """
+
+    def __init__(self, rng = random) -> None:
+        """Initialises the member variables of the class"""
+        self.collisions : int = 0
+        self.rng = rng
+
+    def on_collision(self) -> None:
+        """Counts a failed attempt"""
+        self.collisions += 1
+
+    def on_success(self) -> None:
+        """Forgets the failed attempts once the channel was won"""
+        self.collisions = 0
+
+    def backoff_slots(self) -> int:
+        """Returns the number of idle slots to wait after a collision"""
+        raise NotImplementedError
+
+    def access_slots(self) -> int:
+        """Returns the number of idle slots to wait before sending a new message (none by default)"""
+        return 0
+
+
+class ExponentialBackoff(BackoffPolicy):
+    """
+    A class used to represent truncated binary exponential backoff: the contention window starts at cw_min slots and
+    doubles with every collision up to cw_max
+
+
+    Attributes
+    ----------
+    cw_min : int
+        Contention window after the first collision
+    cw_max : int
+        Largest contention window
+    """
+
+    def __init__(self, cw_min : int, cw_max : int, rng = random) -> None:
+        """Initialises the member variables of the class"""
+        super().__init__(rng)
+        self.cw_min : int = cw_min
+        self.cw_max : int = cw_max
+
+    def window(self) -> int:
+        """Returns the current contention window"""
+        # Past the truncation point the window stops growing, so the exponent is capped too
+        doublings = min(max(self.collisions - 1, 0), self.cw_max.bit_length())
+        return min(self.cw_min << doublings, self.cw_max)
+
+    def backoff_slots(self) -> int:
+        """Returns a number of slots drawn uniformly from the contention window"""
+        return self.rng.randint(1, self.window())
+
+
+class FixedBackoff(BackoffPolicy):
+    """
+    A class used to represent a backoff drawn from the same contention window after every collision
+
+
+    Attributes
+    ----------
+    cw : int
+        Contention window
+    """
+
+    def __init__(self, cw : int, rng = random) -> None:
+        """Initialises the member variables of the class"""
+        super().__init__(rng)
+        self.cw : int = cw
+
+    def backoff_slots(self) -> int:
+        """Returns a number of slots drawn uniformly from the contention window"""
+        return self.rng.randint(1, self.cw)
+
+
+class PersistentBackoff(BackoffPolicy):
+    """
+    A class used to represent p-persistent access: in every idle slot the node sends with probability persistence,
+    before a new message as well as after a collision
+
+
+    Attributes
+    ----------
+    persistence : float
+        Probability of sending in an idle slot
+    """
+
+    def __init__(self, persistence : float, rng = random) -> None:
+        """Initialises the member variables of the class"""
+        super().__init__(rng)
+        self.persistence : float = persistence
+
+    def deferred_slots(self) -> int:
+        """Returns the number of idle slots that go by before the node decides to send"""
+        slots = 0
+        while self.rng.random() >= self.persistence:
+            slots += 1
+        return slots
+
+    def backoff_slots(self) -> int:
+        """Returns the slot of the collision plus the deferred slots after it"""
+        return 1 + self.deferred_slots()
+
+    def access_slots(self) -> int:
+        """Returns the deferred slots before a new message"""
+        return self.deferred_slots()
+
+
+BACKOFF_POLICIES = ("exponential", "fixed", "persistent")
+
+
+def make_backoff(config, rng = random) -> BackoffPolicy:
+    """Returns the backoff policy named by config.backoff"""
+    if config.backoff == "exponential":
+        return ExponentialBackoff(config.cw_min, config.cw_max, rng)
+    if config.backoff == "fixed":
+        return FixedBackoff(config.cw_fixed, rng)
+    if config.backoff == "persistent":
+        return PersistentBackoff(config.persistence, rng)
+    raise ValueError("unknown backoff policy %r (expected one of %s)" % (config.backoff, ", ".join(BACKOFF_POLICIES)))
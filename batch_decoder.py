@@ -0,0 +1,176 @@
+"""Decoder of whole recordings: strided framing, batched real FFTs and vectorized classification of every frame"""
+import numpy as np
+from scipy.fft import rfft
+from demodulator import StreamingDemodulator
+
+
+# Hunting frames analysed together (about 80 s of audio with the default 10 ms frames)
+BLOCK_FRAMES = 8192
+# Symbol frames analysed together once a preamble has been found
+SYMBOL_WINDOW = 64
+
+
+def frame_view(samples : np.ndarray, start : int, length : int, count : int) -> np.ndarray:
+    """Returns count consecutive frames of length samples from start, as the rows of a read-only view of samples"""
+    step = samples.strides[0]
+    return np.lib.stride_tricks.as_strided(samples[start:], shape=(count, length), strides=(step * length, step), writeable=False)
+
+
+def frame_table(events, demodulator : StreamingDemodulator) -> list:
+    """
+    Returns one row per frame (every subframe of an aggregate, every ending tone) of a sequence of frame events: its
+    start and end in seconds, its type, its status ("ok", "error", "timeout" or "unreadable") and its decoded fields
+    """
+    sample_rate = demodulator.receiver.Sample_rate
+    rows = []
+    start = frame_type = None
+    for kind, data, sample in events:
+        if kind in ("symbol", "header"):
+            continue
+        if kind == "preamble":
+            start, frame_type = sample - demodulator.preamble_length * demodulator.hunt_length, data["type"]
+            continue
+        if kind == "ending":
+            row = {"start": sample - demodulator.ending_frames * demodulator.hunt_length, "type": "ending", "status": "ok", "label": data["label"]}
+        elif start is None:
+            # The first events of a recording that starts in the middle of a frame
+            continue
+        elif kind in ("error", "timeout"):
+            row = {"start": start, "type": frame_type, "status": kind}
+            if "symbols" in data:
+                row["symbols"] = " ".join(data["symbols"])
+        else:
+            row = {"start": start, **data, "type": frame_type, "status": "unreadable" if "?" in data.get("message", "") else "ok"}
+        row["end"] = sample
+        rows.append(row)
+        if kind != "ending":
+            # The next subframe of an aggregate starts where this one ended
+            start = sample if kind == "payload" and data.get("subframe", 0) + 1 < data.get("subframes", 0) else None
+    for row in rows:
+        row["start"] = round(row["start"] / sample_rate, 3)
+        row["end"] = round(row["end"] / sample_rate, 3)
+    return rows
+
+
+class BatchDecoder(StreamingDemodulator):
+    """
+    A class used to represent a demodulator for whole recordings, with the same events as feeding them to a
+    StreamingDemodulator (whose frame parsing it reuses) but none of its per-frame signal processing.
+    The hunting frames are strided views over the samples, analysed BLOCK_FRAMES at a time: one batched real FFT gives
+    the clear channel assessment's band energy and the preamble and ending tones of every frame, and the energies are
+    one batched dot product, so only the noise floor tracking and the frame state machine run frame by frame. After a
+    preamble the next SYMBOL_WINDOW symbol frames are classified the same way.
+    Frames off the hunting grid (when a symbol frame is not a whole number of hunting frames) and symbols in another
+    modulation than 4-bit FSK (multitone data, block acknowledgements) are classified one frame at a time.
+
+
+    Attributes
+    ----------
+    origin : int
+        Sample the hunting grid starts at
+    block : int
+        Index on the hunting grid of the first frame of the analysed block (None before the first one)
+    energies : np.ndarray
+        Mean energy per sample of the last clear channel assessment window of every hunting frame of the block
+    in_band : np.ndarray
+        Whether most of the energy of every hunting frame of the block lies in the protocol's band
+    labels : np.ndarray
+        Preamble or ending tone of every hunting frame of the block ("?" if none)
+    window : int
+        First sample of the analysed symbol frames (None if there are none)
+    window_labels : np.ndarray
+        Symbol carried by every analysed symbol frame ("?" if none)
+    """
+
+    def __init__(self, receiver) -> None:
+        """Initialises the member variables of the class"""
+        super().__init__(receiver)
+        self.origin : int = 0
+        self.block = None
+        self.energies = self.in_band = self.labels = None
+        self.window = None
+        self.window_labels = None
+
+    def classify_frames(self, front_end, frames : np.ndarray, power : np.ndarray) -> np.ndarray:
+        """Returns the label of every row of frames (power holds their power spectra), like Receiver.classify_frame"""
+        if self.receiver.config.detector_backend == "goertzel":
+            bank = self.receiver.goertzel_bank(frames.shape[1])
+            energies = bank.energies(frames)
+            best = np.argmax(energies, axis=1)
+            freqs = np.where(energies[np.arange(len(best)), best] < bank.min_ratio, 0.0, bank.freqs[best])
+            bins = np.rint(freqs * front_end.frame_length / front_end.sample_rate).astype(np.int64)
+            index = np.where((bins >= 0) & (bins < len(front_end.lut)), front_end.lut[np.clip(bins, 0, len(front_end.lut) - 1)], -1)
+        else:
+            index = front_end.lut[front_end.first_bin + np.argmax(power[:, front_end.first_bin:], axis=1)]
+        return np.array(front_end.labels, dtype=object)[index]
+
+    def analyse_block(self, samples : np.ndarray, block : int) -> None:
+        """Computes the energy, band share and tone of up to BLOCK_FRAMES hunting frames from the given grid index"""
+        length = self.hunt_length
+        start = self.origin + block * length
+        count = min(BLOCK_FRAMES, (len(samples) - start) // length)
+        frames = frame_view(samples, start, length, count).astype(np.float64)
+        spectrum = rfft(frames, axis=1)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        cca = self.receiver.cca
+        total = np.sum(power[:, 1:], axis=1)
+        band = np.sum(power[:, cca.band_mask(length)], axis=1)
+        share = np.divide(band, total, out=np.zeros(count), where=total > 0)
+        self.block = block
+        window = frames[:, -cca.window_length:]
+        self.energies = np.einsum("ij,ij->i", window, window) / window.shape[1]
+        self.in_band = (total > 0) & (share >= cca.band_ratio)
+        self.labels = self.classify_frames(self.receiver.hunt_front_end(length), frames, power)
+
+    def analyse_window(self, samples : np.ndarray, start : int) -> None:
+        """Computes the FSK symbol of up to SYMBOL_WINDOW symbol frames from the given sample"""
+        length = self.symbol_length
+        count = min(SYMBOL_WINDOW, (len(samples) - start) // length)
+        frames = frame_view(samples, start, length, count).astype(np.float64)
+        spectrum = rfft(frames, axis=1)
+        self.window = start
+        self.window_labels = self.classify_frames(self.receiver.front_end(length), frames, spectrum.real ** 2 + spectrum.imag ** 2)
+
+    def decode(self, samples : np.ndarray, start : int = 0):
+        """
+        Yields the events decoded from samples (e.g. a memory-mapped recording) from start on, with the index in samples
+        of the sample right after the frame that produced each of them
+        """
+        self.clear()
+        self.origin = start
+        self.block = self.window = None
+        cca = self.receiver.cca
+        hunt_length, symbol_length = self.hunt_length, self.symbol_length
+        position = start
+        while True:
+            if self.frame_type is None:
+                if position + hunt_length > len(samples):
+                    return
+                index, offset = divmod(position - start, hunt_length)
+                if offset:
+                    events = self.hunt(samples[position:position + hunt_length])
+                else:
+                    if self.block is None or not self.block <= index < self.block + len(self.energies):
+                        self.analyse_block(samples, index)
+                    index -= self.block
+                    self.busy = cca.above_floor(self.energies[index]) and bool(self.in_band[index])
+                    events = self.hunt_label(self.labels[index] if self.busy else "?")
+                position += hunt_length
+            else:
+                if position + symbol_length > len(samples):
+                    return
+                if self.classify == self.receiver.classify_symbol:
+                    index = (position - self.window) // symbol_length if self.window is not None else -1
+                    if not 0 <= index < len(self.window_labels) or self.window + index * symbol_length != position:
+                        self.analyse_window(samples, position)
+                        index = 0
+                    events = self.read_label(self.window_labels[index])
+                else:
+                    events = self.read_symbol(samples[position:position + symbol_length])
+                position += symbol_length
+            self.sample = position
+            yield from events
+
+    def frames(self, samples : np.ndarray, start : int = 0) -> list:
+        """Returns the table of the frames decoded from samples (see frame_table)"""
+        return frame_table(self.decode(samples, start), self)
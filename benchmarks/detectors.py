@@ -0,0 +1,98 @@
+"""
+Compares the CPU time per frame of the FFT and Goertzel detector backends of the Receiver,
+and of symbol classification through the spectral front-end against the old per-frame FFT + dict scan
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+from scipy.fft import fft
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from config import Config
+from receiver import Receiver
+
+
+def make_frames(config : Config, frame_length : int, count : int, seed : int = 0) -> list:
+    """Returns normalised frames holding a random symbol tone plus noise"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(frame_length) / config.Sample_rate
+    frames = []
+    for _ in range(count):
+        freq = config.bit_start_freq + rng.integers(16) * config.bit_freq_gap
+        frame = np.sin(2 * np.pi * freq * t) + 0.3 * rng.standard_normal(frame_length)
+        frames.append(frame / np.max(np.abs(frame)))
+    return frames
+
+
+def time_backend(receiver : Receiver, backend : str, frames : list, filtered : bool) -> float:
+    """Returns the mean time in microseconds spent detecting the peak of one frame"""
+    receiver.config.detector_backend = backend
+    receiver.detect_frequency(frames[0], filtered=filtered)
+    start = time.perf_counter()
+    for frame in frames:
+        receiver.detect_frequency(frame, filtered=filtered)
+    return (time.perf_counter() - start) / len(frames) * 1e6
+
+
+def legacy_classify(receiver : Receiver, frame : np.ndarray) -> str:
+    """The per-frame classification the receive loops used before the spectral front-end"""
+    frame = frame / np.max(np.abs(frame))
+    spectrum = np.abs(fft(frame))
+    freqs = np.fft.fftfreq(len(spectrum), 1 / receiver.Sample_rate)
+    valid_indices = freqs > receiver.Frequency_filter
+    peak_freq = freqs[valid_indices][np.argmax(spectrum[valid_indices])]
+    for freq in receiver.freq_bin_string:
+        if abs(peak_freq - freq) <= receiver.Threshold:
+            return receiver.freq_bin_string[freq]
+    return "?"
+
+
+def time_classify(receiver : Receiver, classify, frames : list) -> float:
+    """Returns the mean time in microseconds spent classifying one frame"""
+    classify(frames[0])
+    start = time.perf_counter()
+    for frame in frames:
+        classify(frame)
+    return (time.perf_counter() - start) / len(frames) * 1e6
+
+
+def main() -> None:
+    """Runs the benchmark for the preamble and symbol frame lengths"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--frames", type=int, default=2000, help="frames per measurement")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    config = Config()
+    receiver = Receiver(config)
+    results = []
+    for name, duration, filtered in (("preamble", receiver.Preamble_duration, False), ("symbol", receiver.Bit_duration, True)):
+        frame_length = int(config.Sample_rate * duration)
+        frames = make_frames(config, frame_length, args.frames)
+        for backend in ("fft", "goertzel"):
+            us = time_backend(receiver, backend, frames, filtered)
+            results.append({"frame": name, "frame_length": frame_length, "backend": backend,
+                            "us_per_frame": round(us, 2), "real_time_factor": round(us * 1e-6 / duration, 5)})
+
+    # Symbol classification at the Ratio_of_Sender_Receiver oversampling rate used by the receive loops
+    receiver.config.detector_backend = "fft"
+    duration = receiver.Bit_duration
+    frames = [(frame * 32767).astype(np.int16) for frame in make_frames(config, int(config.Sample_rate * duration), args.frames)]
+    for backend, classify in (("legacy", lambda frame: legacy_classify(receiver, frame)), ("front-end", receiver.classify_symbol)):
+        us = time_classify(receiver, classify, frames)
+        results.append({"frame": "classify", "frame_length": len(frames[0]), "backend": backend,
+                        "us_per_frame": round(us, 2), "real_time_factor": round(us * 1e-6 / duration, 5)})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'frame':<10}{'samples':>8}{'backend':>10}{'us/frame':>12}{'RTF':>10}")
+    for r in results:
+        print(f"{r['frame']:<10}{r['frame_length']:>8}{r['backend']:>10}{r['us_per_frame']:>12}{r['real_time_factor']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Microbenchmarks of the Receiver's per-frame DSP hot path.
+Synthetic captures (tones from Sender.generate_sine_wave plus noise) are fed through Receiver.return_freq,
+detect_preamble, receive_message and wait_for_ending_signal. For every path the benchmark reports the CPU time per
+frame, the memory allocated per frame (tracemalloc) and the real-time factor at the configured Sample_rate.
+
+A path whose real-time factor reaches --max-rtf (1.0 by default, i.e. a frame takes longer to process than to
+capture) is flagged, and so is a path that got slower than the stored baseline by more than --tolerance.
+The exit status is 1 when anything is flagged, so the benchmark can gate changes.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from config import Config
+from receiver import Receiver
+from sender import Sender
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "dsp_hotpath.json")
+
+
+class CaptureStream:
+    """
+    A class used to represent a pyaudio-like input stream that loops over a prepared int16 capture.
+    It keeps a virtual clock so that the Receiver's timeouts run on captured rather than wall-clock time.
+
+
+    Attributes
+    ----------
+    samples : np.ndarray
+        The int16 capture, read over and over
+    sample_rate : int
+        Sample rate in Hz
+    position : int
+        Index of the next sample to read in the capture
+    samples_read : int
+        Total number of samples read
+    """
+
+    def __init__(self, samples : np.ndarray, sample_rate : int) -> None:
+        """Initialises the member variables of the class"""
+        self.samples = samples
+        self.sample_rate : int = sample_rate
+        self.position : int = 0
+        self.samples_read : int = 0
+
+    def read(self, num_frames : int, exception_on_overflow : bool = True) -> bytes:
+        """Returns the next num_frames samples as int16 bytes, like pyaudio"""
+        if self.position + num_frames > len(self.samples):
+            self.position = 0
+        data = self.samples[self.position:self.position + num_frames].tobytes()
+        self.position += num_frames
+        self.samples_read += num_frames
+        return data
+
+    def time(self) -> float:
+        """Returns the duration of the samples read so far in seconds"""
+        return self.samples_read / self.sample_rate
+
+
+def capture(sender : Sender, tones : list, noise : float, rng) -> np.ndarray:
+    """Returns the int16 capture of consecutive (frequency, duration) tones (frequency None is silence) plus noise"""
+    config = sender.config
+    parts = []
+    for freq, duration in tones:
+        if freq is None:
+            parts.append(np.zeros(int(config.Sample_rate * duration)))
+        else:
+            parts.append(sender.generate_sine_wave(freq, duration, config.Amplitude, config.Sample_rate))
+    wave = np.concatenate(parts)
+    wave = wave + rng.normal(0.0, noise, len(wave))
+    return (np.clip(wave, -1.0, 1.0) * 32767).astype(np.int16)
+
+
+def make_captures(config : Config, noise : float, seed : int) -> dict:
+    """Returns the synthetic capture used for every benchmarked path"""
+    rng = np.random.default_rng(seed)
+    sender = Sender(config)
+    symbol = config.Symbol_duration
+    symbol_tones = [config.bit_start_freq + i * config.bit_freq_gap for i in range(16)]
+    preambles = [config.rts_preamble_freq, config.cts_preamble_freq, config.message_preamble_freq, config.broadcast_preamble_freq]
+
+    # Preamble tones, as seen by the idle path
+    hunt = [(int(rng.choice(preambles)), config.Preamble_tone_duration) for _ in range(400)]
+    # Data symbols and silence: no preamble and no ending tone, so detect_preamble and
+    # wait_for_ending_signal run until they time out, which is their longest path
+    busy = [(int(rng.choice(symbol_tones)), symbol) if i % 4 else (None, symbol) for i in range(40)]
+    # Data frames with a 15 bit payload (header, length and 4 data symbols) separated by two symbols of silence
+    frames = []
+    for _ in range(10):
+        bits = "".join(rng.choice(["0", "1"], size=15))
+        symbols = ["0100", sender.convert_to_binary(15)] + [bits[i:i + 4].ljust(4, "0") for i in range(0, 15, 4)]
+        frames += [(sender.map_freq(s), symbol) for s in symbols] + [(None, 2 * symbol)]
+    return {
+        "hunt": capture(sender, hunt, noise, rng),
+        "busy": capture(sender, busy, noise, rng),
+        "message": capture(sender, frames, noise, rng),
+    }
+
+
+def hot_paths(receiver : Receiver) -> list:
+    """Returns the (name, capture, frame length, call) of every benchmarked path"""
+    config = receiver.config
+    hunt_length = int(receiver.Sample_rate * receiver.Preamble_duration)
+    symbol_length = int(receiver.Sample_rate * receiver.Bit_duration)
+    return [
+        ("return_freq", "hunt", hunt_length,
+         lambda stream: receiver.return_freq(stream)),
+        ("detect_preamble", "busy", hunt_length,
+         lambda stream: receiver.detect_preamble(config.rts_preamble_freq, receiver.Sample_rate, receiver.Threshold, stream, receiver.clock())),
+        ("receive_message", "message", symbol_length,
+         lambda stream: receiver.receive_message(stream)),
+        ("wait_for_ending_signal", "busy", symbol_length,
+         lambda stream: receiver.wait_for_ending_signal(stream)),
+    ]
+
+
+def measure(call, stream : CaptureStream, frame_length : int, frames : int) -> dict:
+    """Runs call on the stream until at least frames frames were read and returns the per-frame costs"""
+    call(stream)
+    start_samples = stream.samples_read
+    start = time.process_time_ns()
+    while stream.samples_read - start_samples < frames * frame_length:
+        call(stream)
+    elapsed = time.process_time_ns() - start
+    timed_frames = (stream.samples_read - start_samples) / frame_length
+
+    # A separate pass under tracemalloc, which slows every allocation down
+    tracemalloc.start()
+    start_samples = stream.samples_read
+    base, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    blocks = sys.getallocatedblocks()
+    while stream.samples_read - start_samples < max(1, frames // 10) * frame_length:
+        call(stream)
+    current, peak = tracemalloc.get_traced_memory()
+    blocks = sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+    traced_frames = (stream.samples_read - start_samples) / frame_length
+
+    ns_per_frame = elapsed / timed_frames
+    frame_ns = frame_length / stream.sample_rate * 1e9
+    return {
+        "frame_length": frame_length,
+        "frames": int(timed_frames),
+        "ns_per_frame": int(ns_per_frame),
+        "peak_alloc_bytes_per_frame": int(peak - base),
+        "retained_blocks_per_frame": round(max(blocks, 0) / traced_frames, 3),
+        "real_time_factor": round(ns_per_frame / frame_ns, 5),
+    }
+
+
+def check(results : dict, max_rtf : float, baseline : dict = None, tolerance : float = 0.5) -> list:
+    """Returns the problems found in the results: paths not fast enough for real time and regressions"""
+    problems = []
+    for name, result in results.items():
+        if result["real_time_factor"] >= max_rtf:
+            problems.append("%s: real-time factor %.3f at %d Hz is not below %.2f" % (name, result["real_time_factor"], result["sample_rate"], max_rtf))
+        old = (baseline or {}).get(name)
+        if old is not None and result["ns_per_frame"] > old["ns_per_frame"] * (1 + tolerance):
+            problems.append("%s: %d ns/frame is more than %d%% slower than the baseline (%d ns/frame)" % (name, result["ns_per_frame"], tolerance * 100, old["ns_per_frame"]))
+    return problems
+
+
+def main() -> None:
+    """Runs every hot-path benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frames", type=int, default=2000, help="frames per measurement")
+    parser.add_argument("--noise", type=float, default=0.05, help="noise standard deviation (1.0 is full scale)")
+    parser.add_argument("--backend", default=None, help="detector backend (fft or goertzel, default from Config)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-rtf", type=float, default=1.0, help="flag paths whose real-time factor reaches this value")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="flag paths this much slower than the baseline (0.5 is 50%%)")
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    parser.add_argument("--baseline", nargs="?", const=BASELINE, help="compare against a stored baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    args = parser.parse_args()
+
+    config = Config()
+    if args.backend is not None:
+        config.detector_backend = args.backend
+    receiver = Receiver(config)
+    captures = make_captures(config, args.noise, args.seed)
+    results = {}
+    for name, kind, frame_length, call in hot_paths(receiver):
+        stream = CaptureStream(captures[kind], receiver.Sample_rate)
+        receiver.clock = stream.time
+        results[name] = measure(call, stream, frame_length, args.frames)
+        results[name]["sample_rate"] = receiver.Sample_rate
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["results"]
+    problems = check(results, args.max_rtf, baseline, args.tolerance)
+
+    if args.json:
+        print(json.dumps({"results": results, "problems": problems}, indent=2))
+    else:
+        print(f"{'path':<24}{'samples':>8}{'ns/frame':>12}{'peak B/frame':>14}{'blocks/frame':>14}{'RTF':>10}{'baseline':>12}")
+        for name, r in results.items():
+            old = baseline.get(name, {}).get("ns_per_frame", "-") if baseline else "-"
+            print(f"{name:<24}{r['frame_length']:>8}{r['ns_per_frame']:>12}{r['peak_alloc_bytes_per_frame']:>14}{r['retained_blocks_per_frame']:>14}{r['real_time_factor']:>10}{old:>12}")
+        for problem in problems:
+            print("FLAGGED " + problem)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(BASELINE), exist_ok=True)
+        with open(BASELINE, "w") as file:
+            json.dump({"backend": config.detector_backend, "noise": args.noise, "seed": args.seed, "results": results}, file, indent=2)
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
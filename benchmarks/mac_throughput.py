@@ -0,0 +1,216 @@
+"""
+End-to-end MAC throughput and latency benchmark.
+Runs several Main nodes on the simulated channel, feeds unicast and broadcast ".buffer" lines at a given offered load
+and reports goodput, per-message latency, RTS/CTS/ACK overhead, collisions and retransmissions for every combination
+of the swept parameters. Results can be written as JSON and compared against a stored baseline.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from backoff import BACKOFF_POLICIES
+from config import Config
+from main import Main
+from mac_simulator import make_traffic
+from sim_channel import SimulatedChannel, ChannelClosed
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines", "mac_throughput.json")
+PARAMETERS = ("nodes", "load", "broadcast", "symbol_duration", "preamble_length", "collision_wait_time", "backoff")
+
+
+def make_config(params : dict, overrides : dict = None) -> Config:
+    """Returns the configuration of one node for the given scenario (overrides maps Config attributes to their values)"""
+    config = Config()
+    for name, value in (overrides or {}).items():
+        setattr(config, name, value)
+    # The receiver frame keeps its length, so a longer symbol spans more of them
+    frame_duration = config.Symbol_duration / config.Ratio_of_Sender_Receiver
+    config.num_nodes = params["nodes"]
+    config.Symbol_duration = params["symbol_duration"]
+    config.Ratio_of_Sender_Receiver = max(1, int(round(params["symbol_duration"] / frame_duration)))
+    config.Preamble_length = params["preamble_length"]
+    config.collision_wait_time = params["collision_wait_time"]
+    config.backoff = params["backoff"]
+    return config
+
+
+def recorder(events : list, lock : threading.Lock, index : int):
+    """Returns a Main listener that appends (node index, kind, time, data) to events"""
+    def record(kind, at, data):
+        with lock:
+            events.append((index, kind, at, data))
+    return record
+
+
+def run_node(node : Main) -> None:
+    """Runs a node until its channel is closed"""
+    try:
+        node()
+    except ChannelClosed:
+        pass
+    finally:
+        # A node that died must not keep the others waiting for it
+        node.engine.p.terminate()
+
+
+def run_scenario(params : dict, duration : float, noise : float, seed : int, wall_limit : float, overrides : dict = None,
+                 message_bits : int = 15) -> dict:
+    """Runs one scenario and returns its metrics"""
+    rng = np.random.default_rng(seed)
+    channel = SimulatedChannel(params["nodes"], attenuation=0.5, delay=0.001, noise=noise, seed=seed)
+    workdir = tempfile.TemporaryDirectory(prefix="mac_bench_")
+    directory = workdir.name
+    nodes = []
+    events = []
+    lock = threading.Lock()
+    for i in range(params["nodes"]):
+        buffer_file = os.path.join(directory, "node%d.buffer" % (i + 1))
+        open(buffer_file, "w").close()
+        node = Main(audio=channel.node(i), node_id=str(i + 1), buffer_file=buffer_file, config=make_config(params, overrides), verbose=False)
+        node.listeners.append(recorder(events, lock, i))
+        nodes.append(node)
+    threads = [threading.Thread(target=run_node, args=(node,), daemon=True) for node in nodes]
+    for thread in threads:
+        thread.start()
+
+    traffic = make_traffic(params, duration, rng, message_bits)
+    offered_bits = sum(len(payload) for arrivals in traffic for _, payload, _ in arrivals)
+    next_message = [0] * len(nodes)
+    start = time.perf_counter()
+    while min(node.clock() for node in nodes) < duration and time.perf_counter() - start < wall_limit:
+        for i, node in enumerate(nodes):
+            lines = []
+            while next_message[i] < len(traffic[i]) and traffic[i][next_message[i]][0] <= node.clock():
+                _, payload, dest = traffic[i][next_message[i]]
+                lines.append("%s %d\n" % (payload, dest))
+                next_message[i] += 1
+            if lines:
+                with open(node.buffer_file, "a") as file:
+                    file.writelines(lines)
+        time.sleep(0.002)
+    wall = time.perf_counter() - start
+    simulated = min(node.clock() for node in nodes)
+    channel.close()
+    for thread in threads:
+        thread.join(timeout=5)
+    workdir.cleanup()
+
+    delivered = [data for _, kind, _, data in events if kind == "delivered"]
+    latencies = [data["latency"] for data in delivered if data["latency"] is not None]
+    airtime = {}
+    for node in nodes:
+        for kind, seconds in node.sender.airtime.items():
+            airtime[kind] = airtime.get(kind, 0.0) + seconds
+    total_airtime = sum(airtime.values())
+    delivered_bits = sum(len(data["message"]) for data in delivered)
+    rates = Counter(data["rate"] for _, kind, _, data in events if kind == "sent" and data["rate"] is not None)
+    return {
+        "simulated_seconds": round(simulated, 2),
+        "wall_seconds": round(wall, 2),
+        "speedup": round(simulated / wall, 1) if wall > 0 else None,
+        "offered_messages": sum(next_message),
+        "offered_bits_per_s": round(offered_bits / duration, 4),
+        "delivered_messages": len(delivered),
+        "goodput_bits_per_s": round(delivered_bits / simulated, 4) if simulated > 0 else 0.0,
+        "latency_mean": round(float(np.mean(latencies)), 3) if latencies else None,
+        "latency_p50": round(float(np.percentile(latencies, 50)), 3) if latencies else None,
+        "latency_p95": round(float(np.percentile(latencies, 95)), 3) if latencies else None,
+        "overhead_fraction": round(1 - airtime.get("payload", 0.0) / total_airtime, 4) if total_airtime > 0 else None,
+        "airtime": {kind: round(seconds, 3) for kind, seconds in sorted(airtime.items())},
+        "collisions": sum(node.stats["collision"] for node in nodes),
+        "retransmissions": sum(node.stats["retransmission"] for node in nodes),
+        "data_frames_per_rate": {str(rate): count for rate, count in sorted(rates.items())},
+    }
+
+
+def scenario_key(params : dict) -> str:
+    """Returns the key used to match a scenario with the baseline"""
+    return ",".join("%s=%s" % (name, params.get(name)) for name in PARAMETERS)
+
+
+def compare(results : list, baseline_path : str) -> None:
+    """Prints the change of goodput and latency against the baseline"""
+    with open(baseline_path) as file:
+        baseline = {scenario_key(r["params"]): r["metrics"] for r in json.load(file)["scenarios"]}
+    print("\nAgainst baseline %s:" % baseline_path)
+    for result in results:
+        old = baseline.get(scenario_key(result["params"]))
+        if old is None:
+            print("  %s: not in baseline" % scenario_key(result["params"]))
+            continue
+        new = result["metrics"]
+        print("  %s: goodput %s -> %s bits/s, mean latency %s -> %s s" % (
+            scenario_key(result["params"]), old["goodput_bits_per_s"], new["goodput_bits_per_s"], old["latency_mean"], new["latency_mean"]))
+
+
+def parse_list(kind):
+    """Returns an argparse type that parses a comma separated list"""
+    return lambda text: [kind(value) for value in text.split(",")]
+
+
+def main() -> None:
+    """Runs every combination of the swept parameters"""
+    config = Config()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=parse_list(int), default=[2, 3], help="node counts (2 or 3, addresses are 2 bits)")
+    parser.add_argument("--load", type=parse_list(float), default=[0.02, 0.05], help="offered messages per second per node")
+    parser.add_argument("--broadcast", type=parse_list(float), default=[0.0], help="fraction of broadcast messages")
+    parser.add_argument("--symbol-duration", type=parse_list(float), default=[config.Symbol_duration], help="on-air symbol durations in seconds")
+    parser.add_argument("--preamble-length", type=parse_list(int), default=[config.Preamble_length], help="preamble lengths")
+    parser.add_argument("--collision-wait-time", type=parse_list(float), default=[config.collision_wait_time], help="backoff slot lengths in seconds")
+    parser.add_argument("--backoff", type=parse_list(str), default=[config.backoff], help="backoff policies (%s)" % ", ".join(BACKOFF_POLICIES))
+    parser.add_argument("--cw-min", type=int, default=config.cw_min, help="contention window in slots after the first collision (exponential)")
+    parser.add_argument("--cw-max", type=int, default=config.cw_max, help="largest contention window in slots (exponential)")
+    parser.add_argument("--cw-fixed", type=int, default=config.cw_fixed, help="contention window in slots (fixed)")
+    parser.add_argument("--persistence", type=float, default=config.persistence, help="probability of sending in an idle slot (persistent)")
+    parser.add_argument("--rate-adaptation", action="store_true", help="pick the rate of unicast data frames per destination")
+    parser.add_argument("--max-aggregate", type=int, default=config.max_aggregate, help="messages sent per RTS/CTS exchange (1 disables aggregation)")
+    parser.add_argument("--arq", choices=["stop_and_wait", "selective_repeat"], default=config.arq, help="retransmission scheme of unicast messages")
+    parser.add_argument("--nav-symbols", type=int, default=config.nav_symbols, help="symbols of the RTS/CTS duration field (0 disables virtual carrier sense)")
+    parser.add_argument("--max-frame-bits", type=int, default=config.max_frame_bits, help="largest data frame in bits (above 15 the length takes more symbols)")
+    parser.add_argument("--fragmentation", action="store_true", help="split messages longer than a data frame into fragments")
+    parser.add_argument("--burst", action="store_true", help="send the fragments after the first without a new RTS/CTS")
+    parser.add_argument("--message-bits", type=int, default=15, help="largest offered message in bits")
+    parser.add_argument("--duration", type=float, default=300.0, help="simulated seconds per scenario")
+    parser.add_argument("--noise", type=float, default=0.01, help="channel noise standard deviation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--wall-limit", type=float, default=600.0, help="wall-clock seconds after which a scenario is cut short")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", nargs="?", const=BASELINE, help="compare against a stored baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    args = parser.parse_args()
+
+    overrides = {"rate_adaptation": args.rate_adaptation, "max_aggregate": args.max_aggregate, "arq": args.arq,
+                 "nav_symbols": args.nav_symbols, "max_frame_bits": args.max_frame_bits, "fragmentation": args.fragmentation, "burst": args.burst,
+                 "cw_min": args.cw_min, "cw_max": args.cw_max, "cw_fixed": args.cw_fixed, "persistence": args.persistence}
+    results = []
+    for values in itertools.product(args.nodes, args.load, args.broadcast, args.symbol_duration, args.preamble_length, args.collision_wait_time, args.backoff):
+        params = dict(zip(PARAMETERS, values))
+        metrics = run_scenario(params, args.duration, args.noise, args.seed, args.wall_limit, overrides, args.message_bits)
+        results.append({"params": params, "metrics": metrics})
+        print("%s: goodput %s bits/s, latency %s s, overhead %s, collisions %d, retransmissions %d (%sx real time)" % (
+            scenario_key(params), metrics["goodput_bits_per_s"], metrics["latency_mean"], metrics["overhead_fraction"],
+            metrics["collisions"], metrics["retransmissions"], metrics["speedup"]), flush=True)
+
+    report = {"duration": args.duration, "noise": args.noise, "seed": args.seed, **overrides, "message_bits": args.message_bits, "scenarios": results}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(BASELINE), exist_ok=True)
+        with open(BASELINE, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
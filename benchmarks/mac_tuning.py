@@ -0,0 +1,137 @@
+"""
+Frame-level MAC tuning sweep.
+Runs the MAC of any number of nodes in the discrete-event simulator (no audio, hours of protocol per second) and
+prints a throughput/latency curve over the offered load for every combination of the swept MAC parameters (backoff
+policy, slot length, acknowledgement and preamble timeouts). Results can be written as JSON.
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from backoff import BACKOFF_POLICIES
+from config import Config
+from mac_simulator import MacSimulator, make_traffic
+
+# Parameters of a curve; every curve is swept over the offered load
+PARAMETERS = ("nodes", "broadcast", "backoff", "collision_wait_time", "end_wait_time", "preamble_wait_time")
+
+
+def config_factory(params : dict, overrides : dict):
+    """Returns a function making the configuration of one node of the scenario"""
+    def make_config() -> Config:
+        config = Config()
+        for name, value in overrides.items():
+            setattr(config, name, value)
+        for name in PARAMETERS[2:]:
+            setattr(config, name, params[name])
+        return config
+    return make_config
+
+
+def run_scenario(params : dict, load : float, duration : float, seed : int, overrides : dict, frame_error_rate : float,
+                 hidden : list, message_bits : int) -> dict:
+    """Runs one point of a curve and returns its metrics"""
+    simulator = MacSimulator(params["nodes"], config_factory(params, overrides), seed, frame_error_rate, hidden)
+    delivered = []
+    for node in simulator.nodes:
+        node.listeners.append(lambda kind, at, data: delivered.append(data) if kind == "delivered" else None)
+    traffic = make_traffic({"nodes": params["nodes"], "load": load, "broadcast": params["broadcast"]}, duration,
+                           np.random.default_rng(seed), message_bits)
+    simulator.add_traffic(traffic)
+    start = time.perf_counter()
+    simulator.run(duration)
+    wall = time.perf_counter() - start
+
+    latencies = [data["latency"] for data in delivered if data["latency"] is not None]
+    airtime = sum(sum(node.airtime[kind] for kind in node.airtime if kind != "payload") for node in simulator.nodes)
+    payload = sum(node.airtime["payload"] for node in simulator.nodes)
+    return {
+        "offered_bits_per_s": round(sum(len(bits) for arrivals in traffic for _, bits, _ in arrivals) / duration, 4),
+        "goodput_bits_per_s": round(sum(len(data["message"]) for data in delivered) / duration, 4),
+        "delivered_fraction": round(len(delivered) / max(1, sum(len(arrivals) for arrivals in traffic)), 4),
+        "latency_mean": round(float(np.mean(latencies)), 3) if latencies else None,
+        "latency_p95": round(float(np.percentile(latencies, 95)), 3) if latencies else None,
+        "channel_utilization": round(airtime / duration, 4),
+        "overhead_fraction": round(1 - payload / airtime, 4) if airtime > 0 else None,
+        "collisions": sum(node.stats["collision"] for node in simulator.nodes),
+        "failed": sum(node.stats["failed"] for node in simulator.nodes),
+        "speedup": round(duration / wall) if wall > 0 else None,
+    }
+
+
+def average(points : list) -> dict:
+    """Returns the mean of every metric over the runs of one point (None where a run had no value)"""
+    return {name: (round(float(np.mean([point[name] for point in points])), 4) if all(point[name] is not None for point in points) else None)
+            for name in points[0]}
+
+
+def parse_list(kind):
+    """Returns an argparse type that parses a comma separated list"""
+    return lambda text: [kind(value) for value in text.split(",")]
+
+
+def parse_pair(text : str) -> tuple:
+    """Parses a pair of node numbers written a-b"""
+    first, second = text.split("-")
+    return int(first), int(second)
+
+
+def main() -> None:
+    """Prints a throughput/latency curve for every combination of the swept parameters"""
+    config = Config()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=parse_list(int), default=[3, 8], help="node counts (addresses widen past 3 nodes)")
+    parser.add_argument("--load", type=parse_list(float), default=[0.005, 0.01, 0.02, 0.05, 0.1], help="offered messages per second per node")
+    parser.add_argument("--broadcast", type=parse_list(float), default=[0.0], help="fraction of broadcast messages")
+    parser.add_argument("--backoff", type=parse_list(str), default=list(BACKOFF_POLICIES), help="backoff policies (%s)" % ", ".join(BACKOFF_POLICIES))
+    parser.add_argument("--collision-wait-time", type=parse_list(float), default=[config.collision_wait_time], help="backoff slot lengths in seconds")
+    parser.add_argument("--end-wait-time", type=parse_list(float), default=[config.end_wait_time], help="acknowledgement timeouts in seconds")
+    parser.add_argument("--preamble-wait-time", type=parse_list(float), default=[config.preamble_wait_time], help="CTS and data frame timeouts in seconds")
+    parser.add_argument("--cw-min", type=int, default=config.cw_min, help="contention window in slots after the first collision (exponential)")
+    parser.add_argument("--cw-max", type=int, default=config.cw_max, help="largest contention window in slots (exponential)")
+    parser.add_argument("--cw-fixed", type=int, default=config.cw_fixed, help="contention window in slots (fixed)")
+    parser.add_argument("--persistence", type=float, default=config.persistence, help="probability of sending in an idle slot (persistent)")
+    parser.add_argument("--max-aggregate", type=int, default=config.max_aggregate, help="messages sent per RTS/CTS exchange (1 disables aggregation)")
+    parser.add_argument("--arq", choices=["stop_and_wait", "selective_repeat"], default=config.arq, help="retransmission scheme of unicast messages")
+    parser.add_argument("--nav-symbols", type=int, default=config.nav_symbols, help="symbols of the RTS/CTS duration field (0 disables virtual carrier sense)")
+    parser.add_argument("--retry-limit", type=int, default=config.retry_limit, help="failed attempts after which a message is dropped (0 never)")
+    parser.add_argument("--frame-error-rate", type=float, default=0.0, help="probability that a part of a frame heard without collision is lost")
+    parser.add_argument("--hidden", type=parse_list(parse_pair), default=[], help="pairs of nodes that cannot hear each other, e.g. 1-3,2-4")
+    parser.add_argument("--message-bits", type=int, default=15, help="largest offered message in bits")
+    parser.add_argument("--duration", type=float, default=3600.0, help="simulated seconds per point")
+    parser.add_argument("--seeds", type=int, default=3, help="runs averaged per point")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first run")
+    parser.add_argument("--output", help="write the curves as JSON to this file")
+    args = parser.parse_args()
+
+    overrides = {"cw_min": args.cw_min, "cw_max": args.cw_max, "cw_fixed": args.cw_fixed, "persistence": args.persistence,
+                 "max_aggregate": args.max_aggregate, "arq": args.arq, "nav_symbols": args.nav_symbols, "retry_limit": args.retry_limit}
+    curves = []
+    for values in itertools.product(args.nodes, args.broadcast, args.backoff, args.collision_wait_time, args.end_wait_time, args.preamble_wait_time):
+        params = dict(zip(PARAMETERS, values))
+        print(", ".join("%s=%s" % item for item in params.items()))
+        print("  %8s %10s %10s %9s %9s %9s %10s" % ("load", "offered", "goodput", "delivered", "latency", "p95", "collisions"))
+        points = []
+        for load in args.load:
+            runs = [run_scenario(params, load, args.duration, args.seed + run, overrides, args.frame_error_rate, args.hidden, args.message_bits)
+                    for run in range(args.seeds)]
+            metrics = average(runs)
+            points.append({"load": load, "metrics": metrics})
+            print("  %8s %10s %10s %9s %9s %9s %10s" % (load, metrics["offered_bits_per_s"], metrics["goodput_bits_per_s"], metrics["delivered_fraction"],
+                                                      metrics["latency_mean"], metrics["latency_p95"], metrics["collisions"]), flush=True)
+        curves.append({"params": params, "points": points})
+
+    if args.output:
+        report = {"duration": args.duration, "seeds": args.seeds, "seed": args.seed, "frame_error_rate": args.frame_error_rate,
+                  "hidden": args.hidden, "message_bits": args.message_bits, **overrides, "curves": curves}
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
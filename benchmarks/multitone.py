@@ -0,0 +1,138 @@
+"""
+Compares the data rate of 4-bit FSK with the multitone mode and with every entry of the rate table (symbol duration,
+tones per symbol) used by rate adaptation, on the simulated channel.
+Random bits are sent as data symbols from one node to another through attenuation, delay and noise, decoded with the
+Receiver's symbol reader, and the goodput (correctly decoded bits per second of airtime) of every mode is reported
+along with its bit error rate and its gain over FSK.
+"""
+import argparse
+import json
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from config import Config
+from receiver import Receiver
+from sender import Sender
+from sim_channel import SimulatedChannel, paFloat32, paInt16
+
+
+def make_config(groups : int) -> Config:
+    """Returns the configuration of FSK (groups == 0) or of the multitone mode with the given number of groups"""
+    config = Config()
+    if groups:
+        config.modulation = "multitone"
+        config.subcarrier_groups = groups
+    return config
+
+
+class CaptureStream:
+    """
+    A class used to represent a finite pyaudio-like input stream over a recorded capture (EOFError once it is used up)
+    """
+
+    def __init__(self, samples : bytes) -> None:
+        """Initialises the member variables of the class"""
+        self.samples = samples
+        self.position : int = 0
+
+    def read(self, num_frames : int, exception_on_overflow : bool = True) -> bytes:
+        """Returns the next num_frames int16 samples"""
+        if self.position + 2 * num_frames > len(self.samples):
+            raise EOFError()
+        data = self.samples[self.position:self.position + 2 * num_frames]
+        self.position += 2 * num_frames
+        return data
+
+
+def transmit(config : Config, bits : str, noise : float, seed : int, rate : int = None):
+    """
+    Sends bits as data symbols (at a rate of the rate table, if given) over a two-node simulated channel and returns
+    the decoded bits and the airtime
+    """
+    channel = SimulatedChannel(2, attenuation=0.5, delay=0.001, noise=noise, seed=seed)
+    tx, rx = channel.node(0), channel.node(1)
+    output = tx.open(format=paFloat32, output=True)
+    capture = rx.open(format=paInt16, input=True)
+    sender = Sender(config)
+    receiver = Receiver(config)
+    silence = np.zeros(int(0.3 * config.Sample_rate), dtype=np.float32)
+    output.write(silence, len(silence))
+    if rate is not None:
+        duration, groups = config.rate_table[rate]
+        if groups > 1:
+            sender.send_multitone_symbols(output, bits, "payload", duration, groups)
+        else:
+            sender.send_symbols(output, bits, "payload", duration)
+    elif config.modulation == "multitone":
+        sender.send_multitone_symbols(output, bits, "payload")
+    else:
+        sender.send_symbols(output, bits, "payload")
+    output.write(silence, len(silence))
+    # Nothing else will be sent, so the receiver can read past the end of the transmission
+    tx.terminate()
+    recording = CaptureStream(capture.read(int(channel.positions[0])))
+    channel.close()
+    classify, width, ratio, ratio_threshold = receiver.data_symbol_decoding(rate)
+    symbols = receiver.read_symbols(recording, classify, ratio, ratio_threshold)
+    decoded = []
+    try:
+        while len(decoded) < len(bits) // width:
+            decoded.append(next(symbols))
+    except EOFError:
+        pass
+    # Symbols that were never decoded count as errors
+    decoded += ["?"] * (len(bits) // width - len(decoded))
+    return "".join(symbol if symbol != "?" else "?" * width for symbol in decoded), sender.airtime["payload"]
+
+
+def main() -> None:
+    """Runs every mode at every noise level"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bits", type=int, default=240, help="bits per run (a multiple of 4 * every group count)")
+    parser.add_argument("--groups", type=lambda text: [int(v) for v in text.split(",")], default=[2, 3, 4], help="multitone group counts")
+    parser.add_argument("--rates", type=lambda text: [int(v) for v in text.split(",")], default=list(range(len(Config().rate_table))), help="indices of the rate table")
+    parser.add_argument("--noise", type=lambda text: [float(v) for v in text.split(",")], default=[0.05, 0.3, 0.6], help="noise standard deviations")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print machine-readable results")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    bits = "".join(rng.choice(["0", "1"], size=args.bits))
+    results = []
+    for noise in args.noise:
+        fsk_goodput = None
+        modes = [("fsk", make_config(0), None)] + [("multitone x%d" % groups, make_config(groups), None) for groups in args.groups]
+        modes += [("rate %d" % rate, make_config(0), rate) for rate in args.rates]
+        for mode, config, rate in modes:
+            decoded, airtime = transmit(config, bits, noise, args.seed, rate)
+            correct = sum(a == b for a, b in zip(bits, decoded))
+            goodput = correct / airtime
+            if fsk_goodput is None:
+                fsk_goodput = goodput
+            if rate is not None:
+                duration, groups = config.rate_table[rate]
+                width = 4 * groups
+            else:
+                duration, width = config.Symbol_duration, Receiver(config).data_symbol_width()
+            results.append({
+                "mode": mode,
+                "noise": noise,
+                "bits_per_symbol": width,
+                "raw_bits_per_s": round(width / duration, 2),
+                "bit_error_rate": round(1 - correct / len(bits), 4),
+                "goodput_bits_per_s": round(goodput, 2),
+                "gain_over_fsk": round(goodput / fsk_goodput, 2) if fsk_goodput else None,
+            })
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':<14}{'noise':>7}{'bits/sym':>10}{'raw b/s':>10}{'BER':>9}{'goodput':>10}{'gain':>7}")
+    for r in results:
+        print(f"{r['mode']:<14}{r['noise']:>7}{r['bits_per_symbol']:>10}{r['raw_bits_per_s']:>10}{r['bit_error_rate']:>9}{r['goodput_bits_per_s']:>10}{str(r['gain_over_fsk']):>7}")
+
+
+if __name__ == "__main__":
+    main()
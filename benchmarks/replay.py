@@ -0,0 +1,164 @@
+"""
+Offline replay of a capture recorded with Config.capture_file.
+The recording is memory-mapped and fed as fast as possible either straight through the Receiver's streaming
+demodulator (--mode demodulator), through the batch decoder that analyses all its frames in bulk (--mode batch) or
+through a whole Main node whose audio backend plays the recording back as its capture (--mode node). The benchmark
+reports the frame events decoded, the real-time factor and, with --profile, the functions the time went to; --table
+prints the decoded frames with their times.
+
+The events can be written with --output and compared against a previous run with --expect, so that a change to the
+demodulator can be checked on real field audio. The exit status is 1 when the events differ.
+"""
+import argparse
+import cProfile
+import csv
+import io
+import json
+import os
+import pstats
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from batch_decoder import frame_table
+from capture import ReplayAudio, ReplayFinished, open_recording, read_annotations
+from config import Config
+from receiver import Receiver
+
+
+def replay_demodulator(path : str, config : Config) -> list:
+    """Returns the frame events the demodulator decodes from the recording, calibrated on its start like Main.open"""
+    samples, _ = open_recording(path)
+    receiver = Receiver(config)
+    calibration = int(receiver.Sample_rate * config.cca_calibration_time)
+    receiver.cca.calibrate(samples[:calibration])
+    demodulator = receiver.demodulator()
+    events = []
+    # A chunk of many hunting frames keeps the per-call overhead low; the events do not depend on the chunk size
+    chunk = demodulator.hunt_length * 64
+    for start in range(calibration, len(samples), chunk):
+        for event in demodulator.feed(samples[start:start + chunk]):
+            events.append((event.kind, event.data, calibration + event.sample))
+    return events
+
+
+def replay_batch(path : str, config : Config) -> list:
+    """Returns the frame events the batch decoder decodes from the recording, calibrated like replay_demodulator"""
+    samples, _ = open_recording(path)
+    receiver = Receiver(config)
+    calibration = int(receiver.Sample_rate * config.cca_calibration_time)
+    receiver.cca.calibrate(samples[:calibration])
+    return [tuple(event) for event in receiver.batch_decoder().decode(samples, calibration)]
+
+
+def print_table(rows : list) -> None:
+    """Prints the decoded frames, one per line"""
+    print("  %9s %9s %-10s %-10s %s" % ("start", "end", "type", "status", "fields"))
+    for row in rows:
+        fields = " ".join("%s=%s" % (name, value) for name, value in row.items()
+                          if name not in ("start", "end", "type", "status") and value is not None)
+        print("  %9.3f %9.3f %-10s %-10s %s" % (row["start"], row["end"], row["type"], row["status"], fields))
+
+
+def replay_node(path : str, config : Config, node_id : str) -> list:
+    """Returns the frame events a Main node decodes from the recording (its own transmissions are skipped)"""
+    from main import Main
+    node = Main(audio=ReplayAudio(path), node_id=node_id, buffer_file=None, config=config, verbose=False)
+    events = []
+    node.listeners.append(lambda kind, at, data: events.append((data["frame"], data["data"], int(round(at * node.engine.Sample_rate))))
+                          if kind == "frame" else None)
+    try:
+        node()
+    except ReplayFinished:
+        pass
+    return events
+
+
+def event_record(event : tuple) -> dict:
+    """Returns a frame event as a JSON-serialisable dict"""
+    kind, data, sample = event
+    return json.loads(json.dumps({"sample": int(sample), "kind": kind, "data": data}, default=str))
+
+
+def main() -> None:
+    """Replays a recording and prints what was decoded and how fast"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", help="the .wav or .npy file recorded by a node")
+    parser.add_argument("--mode", choices=["demodulator", "batch", "node"], default="demodulator", help="what the recording is fed through")
+    parser.add_argument("--node-id", help="node id of the replaying node (the recording node's by default)")
+    parser.add_argument("--symbols", action="store_true", help="keep the symbol and header events in the output")
+    parser.add_argument("--profile", type=int, default=0, help="print the N functions with the most cumulative time")
+    parser.add_argument("--table", action="store_true", help="print the decoded frames with their start and end times")
+    parser.add_argument("--table-output", help="write the decoded frames as CSV to this file")
+    parser.add_argument("--output", help="write the frame events as JSON lines to this file")
+    parser.add_argument("--expect", help="JSON lines of frame events to compare against (e.g. an earlier --output)")
+    args = parser.parse_args()
+
+    samples, sample_rate = open_recording(args.recording)
+    config = Config()
+    if sample_rate is not None and sample_rate != config.Sample_rate:
+        sys.exit("%s was recorded at %d Hz, the configuration uses %d Hz" % (args.recording, sample_rate, config.Sample_rate))
+    start_note = next((note for note in read_annotations(args.recording) if note["kind"] == "start"), {})
+    node_id = args.node_id or start_note.get("node") or "1"
+
+    profiler = cProfile.Profile() if args.profile else None
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    if args.mode == "demodulator":
+        events = replay_demodulator(args.recording, config)
+    elif args.mode == "batch":
+        events = replay_batch(args.recording, config)
+    else:
+        events = replay_node(args.recording, config, node_id)
+    if profiler is not None:
+        profiler.disable()
+    wall = time.perf_counter() - wall
+    cpu = time.process_time() - cpu
+
+    records = [event_record(event) for event in events if args.symbols or event[0] not in ("symbol", "header")]
+    duration = len(samples) / config.Sample_rate
+    print("%s: %.1f s of audio, %d frame events, %.2f s wall, %.2f s CPU, real-time factor %.4f"
+          % (args.recording, duration, len(records), wall, cpu, wall / duration if duration else 0.0))
+    for kind, count in sorted(Counter(record["kind"] for record in records).items()):
+        print("  %-10s %d" % (kind, count))
+    if profiler is not None:
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(args.profile)
+        print(output.getvalue())
+    if args.table or args.table_output:
+        rows = frame_table(events, Receiver(config).demodulator())
+        if args.table:
+            print_table(rows)
+        if args.table_output:
+            columns = ["start", "end", "type", "status"] + sorted({name for row in rows for name in row} - {"start", "end", "type", "status"})
+            with open(args.table_output, "w", newline="") as file:
+                writer = csv.DictWriter(file, fieldnames=columns)
+                writer.writeheader()
+                writer.writerows(rows)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            for record in records:
+                file.write(json.dumps(record) + "\n")
+    if args.expect:
+        with open(args.expect) as file:
+            expected = [json.loads(line) for line in file if line.strip()]
+        if not args.symbols:
+            expected = [record for record in expected if record["kind"] not in ("symbol", "header")]
+        first = next((index for index, (got, want) in enumerate(zip(records, expected)) if got != want), None)
+        if first is None and len(records) == len(expected):
+            print("Same frame events as %s" % args.expect)
+            return
+        if first is None:
+            first = min(len(records), len(expected))
+        print("Frame events differ from %s at event %d:" % (args.expect, first))
+        print("  expected %s" % (json.dumps(expected[first]) if first < len(expected) else "nothing"))
+        print("  got      %s" % (json.dumps(records[first]) if first < len(records) else "nothing"))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
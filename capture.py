@@ -0,0 +1,279 @@
+"""Recording of the captured audio to WAV/NPY files and a pyaudio-like backend that replays such recordings"""
+import json
+import os
+import struct
+import threading
+import time
+import wave
+from queue import SimpleQueue
+import numpy as np
+from audio_formats import paFloat32, paInt16, SAMPLE_SIZES
+
+
+# Seconds of recorded samples between two timestamp annotations
+TIMESTAMP_INTERVAL = 1.0
+# Size of the .npy header written before the samples, rewritten with the final length when the recording is closed
+NPY_HEADER_SIZE = 128
+
+
+class ReplayFinished(Exception):
+    """Raised by reads once every sample of the recording has been replayed"""
+
+
+def annotations_path(path : str) -> str:
+    """Returns the file holding the annotations of a recording"""
+    return path + ".jsonl"
+
+
+def npy_header(count : int) -> bytes:
+    """Returns the .npy (version 1.0) header of count little-endian int16 samples, padded to NPY_HEADER_SIZE bytes"""
+    header = "{'descr': '<i2', 'fortran_order': False, 'shape': (%d,), }" % count
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+def open_recording(path : str) -> tuple:
+    """
+    Returns the samples of a recording, memory-mapped so that they are only read from disk as they are used, and its
+    sample rate (taken from the annotations for .npy files)
+    """
+    if path.endswith(".npy"):
+        with open(path, "rb") as file:
+            np.lib.format.read_magic(file)
+            shape, _, dtype = np.lib.format.read_array_header_1_0(file)
+            offset = file.tell()
+        if dtype != np.dtype("<i2") or len(shape) != 1:
+            raise ValueError("%s is not a recording of int16 samples" % path)
+        sample_rate = next((note["sample_rate"] for note in read_annotations(path) if note["kind"] == "start"), None)
+    else:
+        offset, sample_rate = wav_data(path)
+    # A recording cut short (e.g. the node was killed) still has the length of an empty one, so the file length is trusted
+    count = (os.path.getsize(path) - offset) // 2
+    return np.memmap(path, dtype="<i2", mode="r", offset=offset, shape=(count,)), sample_rate
+
+
+def wav_data(path : str) -> tuple:
+    """Returns the offset of the samples of a mono 16-bit WAV file and its sample rate"""
+    with open(path, "rb") as file:
+        riff, _, kind = struct.unpack("<4sI4s", file.read(12))
+        if riff != b"RIFF" or kind != b"WAVE":
+            raise ValueError("%s is not a WAV file" % path)
+        sample_rate = None
+        while True:
+            chunk = file.read(8)
+            if len(chunk) < 8:
+                raise ValueError("%s has no data chunk" % path)
+            name, size = struct.unpack("<4sI", chunk)
+            if name == b"fmt ":
+                fmt = file.read(size)
+                channels, sample_rate, _, _, bits = struct.unpack("<HIIHH", fmt[2:16])
+                if channels != 1 or bits != 16:
+                    raise ValueError("%s is not a mono 16-bit recording" % path)
+                file.seek(size % 2, os.SEEK_CUR)
+            elif name == b"data":
+                return file.tell(), sample_rate
+            else:
+                file.seek(size + size % 2, os.SEEK_CUR)
+
+
+def read_annotations(path : str) -> list:
+    """Returns the annotations of a recording (an empty list if it has none)"""
+    if not os.path.exists(annotations_path(path)):
+        return []
+    with open(annotations_path(path)) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+class CaptureRecorder:
+    """
+    A class used to represent the recording of everything a node captures, as mono int16 samples in a .wav or .npy
+    file, with a JSON lines file of annotations next to it (<file>.jsonl): a timestamp every TIMESTAMP_INTERVAL seconds of
+    samples, and the MAC states and transmissions of the node, each at the index of the sample captured when it happened.
+    The audio callback only queues the captured blocks; a writer thread writes them, so recording never delays the capture.
+
+
+    Attributes
+    ----------
+    path : str
+        File the samples are written to (.wav or .npy)
+    sample_rate : int
+        Sample rate in Hz
+    clock : function
+        Clock of the node, recorded with every annotation
+    samples : int
+        Number of samples recorded so far (the index annotations refer to)
+    pending : queue.SimpleQueue
+        Blocks of samples and annotations waiting for the writer thread (None stops it)
+    """
+
+    def __init__(self, path : str, sample_rate : int, clock = time.monotonic, **info) -> None:
+        """Initialises the member variables of the class, opens the files and starts the writer thread"""
+        if not path.endswith((".wav", ".npy")):
+            raise ValueError("Recordings are .wav or .npy files, not %s" % path)
+        self.path : str = path
+        self.sample_rate : int = sample_rate
+        self.clock = clock
+        self.samples : int = 0
+        self.next_timestamp : int = 0
+        self.pending = SimpleQueue()
+        if path.endswith(".wav"):
+            self.file = wave.open(path, "wb")
+            self.file.setnchannels(1)
+            self.file.setsampwidth(2)
+            self.file.setframerate(sample_rate)
+        else:
+            self.file = open(path, "wb")
+            self.file.write(npy_header(0))
+        self.annotations = open(annotations_path(path), "w")
+        self.annotate("start", sample_rate=sample_rate, **info)
+        self.thread = threading.Thread(target=self.run, name="recorder", daemon=True)
+        self.thread.start()
+
+    def write(self, samples : np.ndarray) -> None:
+        """Queues a block of captured samples (called from the capture, does no I/O)"""
+        if self.samples >= self.next_timestamp:
+            self.annotate("timestamp")
+            self.next_timestamp += int(TIMESTAMP_INTERVAL * self.sample_rate)
+        self.pending.put(samples)
+        self.samples += len(samples)
+
+    def annotate(self, kind : str, **data) -> None:
+        """Queues an annotation at the current sample"""
+        self.pending.put({"sample": self.samples, "time": round(time.time(), 6), "clock": round(self.clock(), 6), "kind": kind, **data})
+
+    def on_event(self, kind : str, at : float, data : dict) -> None:
+        """Node listener: annotates the MAC states and the start and end of every transmission"""
+        if kind == "state":
+            self.annotate("state", state=data["state"])
+        elif kind == "transmit":
+            self.annotate("transmit", frame=data["frame"])
+        elif kind == "transmitted":
+            self.annotate("transmitted")
+
+    def run(self) -> None:
+        """Writes the queued blocks and annotations until close()"""
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            if isinstance(item, dict):
+                self.annotations.write(json.dumps(item) + "\n")
+            elif self.path.endswith(".wav"):
+                self.file.writeframesraw(np.asarray(item, dtype="<i2").tobytes())
+            else:
+                self.file.write(np.asarray(item, dtype="<i2").tobytes())
+
+    def close(self) -> None:
+        """Writes what is still queued and closes the files (the .npy header then gets its final length)"""
+        self.annotate("end")
+        self.pending.put(None)
+        self.thread.join()
+        if self.path.endswith(".npy"):
+            self.file.seek(0)
+            self.file.write(npy_header(self.samples))
+        self.file.close()
+        self.annotations.close()
+
+
+class ReplayStream:
+    """
+    A class used to represent a stream opened on a ReplayAudio, with the blocking pyaudio Stream interface
+    """
+
+    def __init__(self, audio : "ReplayAudio", format : int) -> None:
+        """Initialises the member variables of the class"""
+        self.audio = audio
+        self.format : int = format
+
+    def read(self, num_frames : int, exception_on_overflow : bool = True) -> bytes:
+        """Returns the next num_frames recorded samples in the stream's format"""
+        samples = self.audio.read(num_frames)
+        if self.format == paFloat32:
+            return (samples / 32767).astype(np.float32).tobytes()
+        return np.asarray(samples, dtype=np.int16).tobytes()
+
+    def write(self, frames, num_frames : int = None, exception_on_underflow : bool = False) -> None:
+        """Plays nothing: the recording moves on by the length of the frames, as the capture did while we transmitted"""
+        if num_frames is None:
+            num_frames = int(len(frames) / SAMPLE_SIZES[self.format])
+        self.audio.skip(num_frames)
+
+    def get_read_available(self) -> int:
+        """Returns the number of samples left in the recording"""
+        return len(self.audio.samples) - self.audio.position
+
+    def start_stream(self) -> None:
+        """Kept for compatibility with pyaudio streams"""
+
+    def stop_stream(self) -> None:
+        """Kept for compatibility with pyaudio streams"""
+
+    def close(self) -> None:
+        """Kept for compatibility with pyaudio streams"""
+
+    def is_active(self) -> bool:
+        """Kept for compatibility with pyaudio streams"""
+        return True
+
+
+class ReplayAudio:
+    """
+    A class used to represent a drop-in replacement for pyaudio.PyAudio that plays a recording back as the capture,
+    as fast as it is read. Only blocking streams are supported. time() and sleep() follow the position in the
+    recording, so the node's timeouts see the recorded time rather than the wall clock.
+
+
+    Attributes
+    ----------
+    path : str
+        The recording replayed (.wav or .npy)
+    samples : np.ndarray
+        Its samples, memory-mapped
+    sample_rate : int
+        Its sample rate in Hz
+    position : int
+        Index of the next sample to be read
+    """
+
+    supports_callback = False
+
+    def __init__(self, path : str, start : int = 0) -> None:
+        """Initialises the member variables of the class"""
+        self.path : str = path
+        self.samples, self.sample_rate = open_recording(path)
+        self.position : int = start
+
+    def open(self, format : int = paInt16, channels : int = 1, rate : int = None, input : bool = False, output : bool = False, frames_per_buffer : int = None, stream_callback = None, **kwargs) -> ReplayStream:
+        """Opens a blocking stream on the recording"""
+        if stream_callback is not None:
+            raise ValueError("Recordings are only replayed on blocking streams")
+        if rate is not None and self.sample_rate is not None and rate != self.sample_rate:
+            raise ValueError("%s was recorded at %d Hz, not %d Hz" % (self.path, self.sample_rate, rate))
+        return ReplayStream(self, format)
+
+    def read(self, n : int) -> np.ndarray:
+        """Returns the next n samples of the recording"""
+        if self.position + n > len(self.samples):
+            raise ReplayFinished()
+        samples = self.samples[self.position:self.position + n]
+        self.position += n
+        return samples
+
+    def skip(self, n : int) -> None:
+        """Moves on by n samples"""
+        self.position += n
+
+    def get_sample_size(self, format : int) -> int:
+        """Returns the size in bytes of one sample of the format"""
+        return SAMPLE_SIZES[format]
+
+    def time(self) -> float:
+        """Returns the time in seconds of the next sample of the recording"""
+        return self.position / (self.sample_rate or 1)
+
+    def sleep(self, seconds : float) -> None:
+        """Lets seconds of the recording pass (whatever was captured meanwhile is skipped)"""
+        self.skip(int(seconds * (self.sample_rate or 1)))
+
+    def terminate(self) -> None:
+        """Kept for compatibility with pyaudio"""
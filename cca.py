@@ -0,0 +1,96 @@
+"""Clear channel assessment (CCA) using energy and band-energy gating over short windows"""
+import numpy as np
+from config import Config
+
+
+class ClearChannelAssessor:
+    """
+    A class used to represent a clear channel assessor.
+    A window is busy when its energy is well above the calibrated noise floor and most of that energy lies in the
+    band used by the protocol's tones, so idle/busy is decided without a full spectral analysis of a whole frame.
+
+
+    Attributes
+    ----------
+    sample_rate : int
+        Sample rate in Hz
+    window_length : int
+        Number of samples in each CCA window
+    energy_factor : float
+        How many times the noise floor the energy must exceed for the window to be busy
+    band : tuple[float, float]
+        Lowest and highest frequency (Hz) of the protocol's tones
+    band_ratio : float
+        Minimum share of the window energy that must lie inside the band for the window to be busy
+    floor_alpha : float
+        Smoothing factor used to track the noise floor on idle windows
+    calibration_windows : int
+        Number of windows used to calibrate the noise floor
+    noise_floor : float
+        Mean energy per sample of an idle channel (None until calibrated)
+    """
+
+    def __init__(self, config : Config, sample_rate : int) -> None:
+        """Initialises the member variables of the class"""
+        self.sample_rate : int = sample_rate
+        self.window_length : int = max(16, int(sample_rate * config.cca_window))
+        self.energy_factor : float = config.cca_energy_factor
+        self.band = config.cca_band
+        self.band_ratio : float = config.cca_band_ratio
+        self.floor_alpha : float = config.cca_floor_alpha
+        self.calibration_windows : int = max(1, int(config.cca_calibration_time / config.cca_window))
+        self.calibration = []
+        self.noise_floor = None
+        self.band_masks = {}
+
+    def band_mask(self, length : int) -> np.ndarray:
+        """Returns the mask of the real-FFT bins that are inside the band, for windows of the given length"""
+        mask = self.band_masks.get(length)
+        if mask is None:
+            freqs = np.fft.rfftfreq(length, 1 / self.sample_rate)
+            mask = (freqs >= self.band[0]) & (freqs <= self.band[1])
+            self.band_masks[length] = mask
+        return mask
+
+    def calibrate(self, samples : np.ndarray) -> None:
+        """Sets the noise floor from samples of an idle channel"""
+        n = len(samples) // self.window_length
+        windows = np.asarray(samples[:n * self.window_length], dtype=np.float64).reshape(n, self.window_length)
+        self.noise_floor = max(float(np.median(np.mean(windows * windows, axis=1))), 1.0)
+
+    def above_floor(self, energy : float) -> bool:
+        """
+        Tracks the noise floor with the mean energy per sample of a window and returns whether the window is loud
+        enough to hold a signal (always True until the floor is calibrated)
+        """
+        if self.noise_floor is None:
+            # Until the floor is calibrated, report busy so that the caller always runs the full analysis
+            self.calibration.append(energy)
+            if len(self.calibration) >= self.calibration_windows:
+                self.noise_floor = max(float(np.median(self.calibration)), 1.0)
+                self.calibration = []
+            return True
+        if energy < self.noise_floor * self.energy_factor:
+            self.noise_floor += self.floor_alpha * (max(energy, 1.0) - self.noise_floor)
+            return False
+        return True
+
+    def window_energy(self, frame : np.ndarray) -> float:
+        """Returns the mean energy per sample of the last window of a frame (the whole frame if it is shorter)"""
+        window = np.asarray(frame[-self.window_length:], dtype=np.float64)
+        return float(np.dot(window, window)) / len(window)
+
+    def in_band(self, power : np.ndarray, length : int) -> bool:
+        """Returns whether most of the energy of a frame of the given length, from its power spectrum, is in the band"""
+        total = np.sum(power[1:])
+        if total <= 0:
+            return False
+        return np.sum(power[self.band_mask(length)]) / total >= self.band_ratio
+
+    def is_busy(self, frame : np.ndarray) -> bool:
+        """Returns whether the last window of a frame holds a signal"""
+        if not self.above_floor(self.window_energy(frame)):
+            return False
+        # Loud enough: only busy if the energy is in the protocol's band (ignores speech, knocks, hum, ...)
+        spectrum = np.fft.rfft(np.asarray(frame, dtype=np.float64))
+        return self.in_band(spectrum.real ** 2 + spectrum.imag ** 2, len(frame))
@@ -35,6 +35,125 @@ class Config:
         Frequency for '0' bit in Hz
     Freq_bin_string : dict[int -> str]
         Mapping frequencies to their respective binary strings
+    Symbol_duration : float
+        On-air duration of one 4-bit symbol sent by the Sender (Ratio_of_Sender_Receiver receiver frames)
+    Preamble_tone_duration : float
+        On-air duration of each of the Preamble_length preamble tones
+    Ending_duration : float
+        On-air duration of the ending (acknowledgement) tone
+    tone_bank_size : int
+        Maximum number of precomputed tones kept by the Sender's tone bank (raised to the number of tones the Sender
+        plays at the configured rate when that is more)
+    detector_backend : str
+        "fft" for full-FFT peak picking or "goertzel" to evaluate only the protocol's tones
+    ending_detection_duration : float
+        How long an ending tone must be heard by the streaming demodulator before it is reported
+    cca_window : float
+        Duration of each clear channel assessment window in seconds
+    cca_energy_factor : float
+        How many times the noise floor a window's energy must exceed to be busy
+    cca_band : tuple[float, float]
+        Frequency band (Hz) holding the protocol's tones
+    cca_band_ratio : float
+        Minimum share of a window's energy inside cca_band for it to be busy
+    cca_floor_alpha : float
+        Smoothing factor used to track the noise floor on idle windows
+    cca_calibration_time : float
+        Seconds of idle channel used to calibrate the noise floor
+    goertzel_min_ratio : float
+        Minimum share of the frame energy the strongest tone needs for the Goertzel backend to report it
+    turnaround_time : float
+        Seconds a node waits after receiving a frame before answering it (CTS, data or acknowledgement)
+    decode_thread : bool
+        Whether frames are decoded in their own thread (only with a callback-driven audio backend), so that the MAC
+        loop just takes their events from a queue
+    event_queue_size : int
+        Number of decoded frames the decode thread may queue ahead of the MAC loop
+    outbox_poll_interval : float
+        Seconds between two checks of the .buffer file for new messages
+    modulation : str
+        "fsk" sends one of 16 tones (4 bits) per data symbol, "multitone" keys one tone in every subcarrier group at once
+    subcarrier_groups : int
+        Number of subcarrier groups keyed together in multitone mode (each group carries 4 bits per symbol)
+    subcarrier_start_freq : int
+        Lowest subcarrier frequency in Hz
+    subcarrier_gap : int
+        Spacing between neighbouring subcarriers in Hz (tones of the groups are interleaved)
+    multitone_min_ratio : float
+        Minimum share of a group's subcarrier power its strongest tone needs for a multitone symbol to be decoded
+    outbox_watch : bool
+        Whether to use inotify (Linux) to only read the .buffer file after it changed, instead of checking its size
+    metrics : str
+        "off", or the format the node's runtime metrics are exported in: "jsonl" (one JSON object appended per export)
+        or "prometheus" (the text exposition format, written over the file)
+    metrics_file : str
+        File the metrics are exported to ({node} is replaced by the node id; empty to only serve them on metrics_port)
+    metrics_interval : float
+        Seconds between two exports of the metrics
+    metrics_port : int
+        Local port serving the metrics in the Prometheus format on /metrics (0 disables it)
+    capture_file : str
+        .wav or .npy file every captured sample is recorded to, with timestamps and MAC states in <file>.jsonl
+        ({node} is replaced by the node id; empty disables recording)
+    aggregate_preamble_freq : int
+        Preamble frequency of an aggregate (several data subframes for one destination)
+    max_aggregate : int
+        Maximum number of queued messages for the same destination sent in one RTS/CTS exchange (1 to 15)
+    arq : str
+        "stop_and_wait" acknowledges every data frame or aggregate as a whole with an ending tone; "selective_repeat"
+        numbers the data frames per destination and acknowledges them with a block acknowledgement bitmap
+    arq_window : int
+        Selective repeat window in frames (1 to 8), which bounds the frames in flight and held by a receiver
+    block_ack_preamble_freq : int
+        Preamble frequency of a block acknowledgement
+    nav_symbols : int
+        Number of 4-bit symbols of the duration field after the addresses of RTS and CTS frames (0 disables virtual
+        carrier sense: third parties then defer until the acknowledgement or end_wait_time). Its largest value stands
+        for an exchange too long to advertise, which is deferred on the same way
+    nav_unit : float
+        Seconds per unit of the duration field
+    max_frame_bits : int
+        Most data bits in one data frame or subframe; above 15 the length field takes two symbols (extended length)
+    fragmentation : bool
+        Whether data frames carry a fragment symbol (more-fragments bit and 3-bit fragment number), so that .buffer
+        messages longer than max_frame_bits are sent as up to 8 frames and reassembled by the receiver
+    burst : bool
+        Whether the next fragments of a message follow the acknowledgement of the previous ones after a turnaround,
+        without a new RTS/CTS exchange
+    reassembly_timeout : float
+        Seconds after its first fragment by which a fragmented message must be complete, or it is dropped
+    max_reassemblies : int
+        Maximum number of fragmented messages a receiver collects at once
+    crc : bool
+        Whether every data frame or subframe ends with the CRC_polynomial checksum of its header and data bits
+    fec_parity_symbols : int
+        Number of Reed-Solomon (GF(16)) parity symbols sent after the data (and CRC) of every data frame or subframe:
+        they correct as many unreadable symbols, or half as many wrong ones (0 disables forward error correction)
+    collision_wait_time : float
+        Length of one backoff slot in seconds
+    retry_limit : int
+        Failed attempts after which a message is given up on (0 retries forever; ignored with selective repeat, whose
+        receiver waits for every sequence number)
+    backoff : str
+        Backoff policy: "exponential" (truncated binary exponential), "fixed" (contention window of cw_fixed slots) or
+        "persistent" (p-persistent, also before every new message)
+    cw_min : int
+        Contention window in slots after the first collision with exponential backoff
+    cw_max : int
+        Largest contention window in slots with exponential backoff
+    cw_fixed : int
+        Contention window in slots with fixed backoff
+    persistence : float
+        Probability of sending in an idle slot with p-persistent backoff
+    rate_adaptation : bool
+        Whether data frames carry a rate symbol after their length and unicast frames pick their rate per destination
+    rate_table : list[tuple[float, int]]
+        (symbol duration in seconds, tones per symbol) of every data rate, slowest first; durations are multiples of
+        the receiver frame (Symbol_duration / Ratio_of_Sender_Receiver), 1 tone is FSK and more are subcarrier groups
+    rate_ewma_weight : float
+        Weight of the latest acknowledgement or timeout in a rate's success probability
+    rate_sample_fraction : float
+        Share of the unicast data frames sent at a look-around rate to keep the statistics up to date
     """
 
     def __init__(self) -> None:
@@ -43,14 +162,65 @@ class Config:
         self.node_id = "00"
         self.end_wait_time = 5
         self.collision_wait_time = 3
-        self.num_collisions = 0
+        self.retry_limit : int = 0
+        self.backoff : str = "exponential"
+        self.cw_min : int = 2
+        self.cw_max : int = 16
+        self.cw_fixed : int = 4
+        self.persistence : float = 0.5
         self.Sample_rate : int = 16000
         self.Amplitude : float = 4.0
         self.Bit_duration : float = 0.7
         self.Preamble_duration : float = 0.05
+        self.Symbol_duration : float = 0.6
+        self.Preamble_tone_duration : float = 0.01
+        self.Ending_duration : float = 0.35
+        self.tone_bank_size : int = 128
+        self.detector_backend : str = "fft"
+        self.goertzel_min_ratio : float = 0.2
+        self.ending_detection_duration : float = 0.05
+        self.cca_window : float = 0.004
+        self.cca_energy_factor : float = 4.0
+        self.cca_band = (2800, 7600)
+        self.cca_band_ratio : float = 0.5
+        self.cca_floor_alpha : float = 0.05
+        self.cca_calibration_time : float = 0.5
+        self.turnaround_time : float = 0.3
+        self.outbox_poll_interval : float = 0.05
+        self.decode_thread : bool = True
+        self.event_queue_size : int = 64
+        self.outbox_watch : bool = True
+        self.metrics : str = "off"
+        self.metrics_file : str = ".metrics_{node}"
+        self.metrics_interval : float = 10.0
+        self.metrics_port : int = 0
+        self.capture_file : str = ""
+        self.modulation : str = "fsk"
+        self.subcarrier_groups : int = 3
+        self.subcarrier_start_freq : int = 4300
+        self.subcarrier_gap : int = 50
+        self.multitone_min_ratio : float = 0.5
+        self.max_aggregate : int = 4
+        self.arq : str = "stop_and_wait"
+        self.arq_window : int = 8
+        self.nav_symbols : int = 1
+        self.nav_unit : float = 0.5
+        self.max_frame_bits : int = 15
+        self.fragmentation : bool = False
+        self.burst : bool = False
+        self.reassembly_timeout : float = 120.0
+        self.max_reassemblies : int = 8
+        self.crc : bool = False
+        self.fec_parity_symbols : int = 0
+        self.rate_adaptation : bool = False
+        self.rate_table = [(0.6, 1), (0.4, 1), (0.4, 2), (0.3, 3), (0.3, 4)]
+        self.rate_ewma_weight : float = 0.25
+        self.rate_sample_fraction : float = 0.1
         self.preamble_wait_time : int = 5
         self.message_preamble_freq : int = 3000
         self.broadcast_preamble_freq = 5000
+        self.aggregate_preamble_freq : int = 3800
+        self.block_ack_preamble_freq : int = 3700
         self.cts_preamble_freq : int = 3500
         self.rts_preamble_freq : int = 4000
         self.Threshold : int = 100
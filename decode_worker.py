@@ -0,0 +1,109 @@
+"""Decoding thread between the capture ring buffer and the MAC loop"""
+import queue
+import threading
+import time
+
+
+class DecodeWorker:
+    """
+    A class used to represent the thread that runs the streaming demodulator (spectral analysis and classification)
+    on the samples the audio engine's capture callback stores in its ring buffer.
+    It hands the MAC loop one (frame events, channel busy) item per hunting frame through a bounded queue, so the MAC
+    never does signal processing and the capture never waits for either of them.
+    Items decoded before the latest restart() (e.g. from our own transmission) are never returned.
+
+
+    Attributes
+    ----------
+    engine : AudioEngine
+        Callback-driven audio engine whose capture ring buffer is read (this thread is its only consumer)
+    demodulator : StreamingDemodulator
+        Demodulator run on every captured frame
+    events : queue.Queue
+        Bounded queue of (generation, events, busy, capture index) items waiting for the MAC loop
+    generation : int
+        Number of restarts so far; items tagged with an older one are dropped
+    stalls : int
+        Number of times the queue was full and the thread had to wait for the MAC loop (the ring buffer keeps capturing)
+    max_latency : float
+        Longest time in seconds between the capture of a frame and the MAC loop taking its events
+    frame_cpu : function
+        Called with the CPU time spent demodulating every frame (None to not measure it)
+    """
+
+    def __init__(self, receiver, engine, queue_size : int) -> None:
+        """Initialises the member variables of the class"""
+        self.engine = engine
+        self.demodulator = receiver.demodulator()
+        self.events = queue.Queue(queue_size)
+        self.generation : int = 0
+        self.stalls : int = 0
+        self.max_latency : float = 0.0
+        self.frame_cpu = None
+        self.running : bool = False
+        self.thread = None
+
+    def start(self) -> None:
+        """Starts decoding in a daemon thread"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="decode", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stops the thread once it is done with the current frame"""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+            self.thread = None
+
+    def restart(self) -> None:
+        """Drops what was decoded so far and everything captured up to the end of our latest transmission"""
+        self.generation += 1
+
+    def run(self) -> None:
+        """Decodes captured frames until stopped"""
+        generation = self.generation
+        while self.running:
+            if generation != self.generation:
+                # Only this thread reads the ring buffer, so it is the one that skips our own transmission
+                generation = self.generation
+                self.engine.discard_transmission()
+                self.demodulator.clear()
+            if self.engine.transmitting():
+                # What is captured meanwhile is our own signal, dropped by the next restart
+                self.engine.tx_done.wait(0.01)
+                continue
+            samples = self.engine.read(self.demodulator.hunt_length)
+            if self.frame_cpu is None:
+                events = list(self.demodulator.feed(samples))
+            else:
+                start = time.thread_time()
+                events = list(self.demodulator.feed(samples))
+                self.frame_cpu(time.thread_time() - start)
+            item = (generation, events, self.demodulator.busy, self.engine.capture.read_index)
+            while self.running:
+                try:
+                    self.events.put(item, timeout=0.05)
+                    break
+                except queue.Full:
+                    self.stalls += 1
+
+    def get(self, timeout : float):
+        """
+        Returns the (events, busy) of the next frame decoded since the latest restart, or None if none came within
+        timeout seconds
+        """
+        while True:
+            try:
+                generation, events, busy, index = self.events.get(timeout=timeout)
+            except queue.Empty:
+                return None
+            if generation == self.generation:
+                self.max_latency = max(self.max_latency, (self.engine.capture.write_index - index) / self.engine.Sample_rate)
+                return events, busy
+            # Stale items are dropped without waiting again
+            timeout = 0
+
+    def stats(self) -> dict:
+        """Returns the counters of the decoding queue"""
+        return {"queued_frames": self.events.qsize(), "stalls": self.stalls, "max_latency": round(self.max_latency, 4)}
@@ -0,0 +1,370 @@
+"""Incremental demodulator that turns captured samples into symbols and frame events"""
+from collections import namedtuple
+import numpy as np
+from arq import BLOCK_ACK_GROUPS, decode_block_ack
+from nav import decode_duration
+
+
+# kind is one of "preamble", "symbol", "rts", "cts", "header", "payload", "block_ack", "ending", "timeout" and "error"
+# sample is the absolute index of the sample right after the frame that produced the event
+FrameEvent = namedtuple("FrameEvent", ["kind", "data", "sample"])
+
+PREAMBLE_TYPES = ("rts", "cts", "message", "broadcast", "aggregate", "block_ack")
+
+
+def length_symbols(config) -> int:
+    """Returns the number of 4-bit symbols of the length field (two or more with extended length)"""
+    return max(1, (config.max_frame_bits.bit_length() + 3) // 4)
+
+
+def header_fields(config) -> list:
+    """Returns the name of every symbol before the data of a data frame or subframe"""
+    return (["header"] + ["length"] * length_symbols(config) + (["rate"] if config.rate_adaptation else [])
+            + (["sequence"] if config.arq == "selective_repeat" else []) + (["fragment"] if config.fragmentation else []))
+
+
+def join_symbols(symbols, width : int = 4) -> str:
+    """Joins symbols of width bits into a bitstring, keeping an unknown symbol width characters wide so later fields stay aligned"""
+    return "".join(symbol if symbol != "?" else "?" * width for symbol in symbols)
+
+
+def field_value(bits : str):
+    """Returns the value of a header field, None if it could not be read"""
+    return None if "?" in bits else int(bits, 2)
+
+
+class RunLengthDecoder:
+    """
+    A class used to represent the run-length logic that turns per-frame classifications into symbols.
+    A symbol lasts Ratio_of_Sender_Receiver receiver frames, give or take Ratio_Threshold. Runs too short to be a
+    symbol are dropped, but once they add up to a whole symbol an unknown symbol ("?") is reported in its place, so a
+    symbol broken up by noise is an erasure that error correction can fill in rather than a gap that shifts the frame.
+
+
+    Attributes
+    ----------
+    ratio : int
+        Number of receiver frames per symbol
+    ratio_threshold : int
+        Tolerance on the number of frames of a symbol
+    previous : str
+        Classification of the current run
+    length : int
+        Number of frames in the current run
+    garbled : int
+        Number of frames in the runs dropped since the latest symbol (less the frames that symbol was short of)
+    erasure : bool
+        Whether the latest symbol returned is an unknown symbol standing in for dropped runs
+    """
+
+    def __init__(self, ratio : int, ratio_threshold : int) -> None:
+        """Initialises the member variables of the class"""
+        self.ratio : int = ratio
+        self.ratio_threshold : int = ratio_threshold
+        self.reset()
+
+    def reset(self) -> None:
+        """Forgets the current run"""
+        self.previous : str = "?"
+        self.length : int = 0
+        self.garbled : int = 0
+        self.erasure : bool = False
+
+    def push(self, current : str):
+        """Adds the classification of one frame and returns the symbol it completes, if any"""
+        self.erasure = False
+        if current == self.previous:
+            self.length += 1
+            if self.length >= self.ratio:
+                self.length = 0
+                self.garbled = 0
+                return self.previous
+            return None
+        symbol = None
+        if abs(self.length - self.ratio) <= self.ratio_threshold:
+            symbol = self.previous
+            # The dropped frames that follow a short symbol are most likely the rest of it
+            self.garbled = self.length - self.ratio
+        else:
+            self.garbled += self.length
+            if self.garbled >= self.ratio:
+                self.garbled -= self.ratio
+                self.erasure = True
+                symbol = "?"
+        self.length = 1
+        self.previous = current
+        return symbol
+
+
+class StreamingDemodulator:
+    """
+    A class used to represent a generator-based demodulator over a continuous capture.
+    Samples can be fed in chunks of any size. While hunting it looks at short frames for preambles and ending tones;
+    after a preamble it switches to symbol frames and parses the RTS, CTS, data frame or aggregate announced by the
+    preamble, then goes back to hunting, so several frames can be decoded from one capture.
+    An aggregate starts with a symbol holding its number of subframes, each of which is then parsed like a data frame.
+    With error control, the CRC and parity symbols after the data of a frame correct and check it before it is reported.
+
+
+    Attributes
+    ----------
+    receiver : Receiver
+        The receiver whose frame lengths, thresholds and classifiers are used
+    hunt_length : int
+        Number of samples per frame while hunting for preambles
+    symbol_length : int
+        Number of samples per frame while reading symbols
+    max_symbol_frames : int
+        Number of symbol frames without a new symbol after which an unfinished frame is abandoned
+    ending_frames : int
+        Number of consecutive hunting frames an ending tone must last to be reported
+    busy : bool
+        Whether the channel was busy on the latest frame (clear channel assessment while hunting, always inside a frame)
+    """
+
+    def __init__(self, receiver) -> None:
+        """Initialises the member variables of the class"""
+        self.receiver = receiver
+        config = receiver.config
+        self.hunt_length : int = int(receiver.Sample_rate * receiver.Preamble_duration)
+        self.symbol_length : int = int(receiver.Sample_rate * receiver.Bit_duration)
+        self.max_symbol_frames : int = int(config.preamble_wait_time / receiver.Bit_duration)
+        self.ending_frames : int = max(1, int(round(config.ending_detection_duration / receiver.Preamble_duration)))
+        self.preamble_length : int = config.Preamble_length
+        # Symbols before the data of a data frame or subframe
+        self.header_fields = header_fields(config)
+        self.decoder = RunLengthDecoder(receiver.Ratio_of_Sender_Receiver, receiver.Ratio_Threshold)
+        self.pending = np.empty(0, dtype=np.int16)
+        self.offset : int = 0
+        self.sample : int = 0
+        self.busy : bool = False
+        self.reset()
+
+    def reset(self) -> None:
+        """Goes back to hunting for a preamble"""
+        self.frame_type = None
+        self.subframes : int = 0
+        self.subframe : int = 0
+        self.symbol_frames : int = 0
+        self.preamble_type = None
+        self.preamble_count : int = 0
+        self.gap : int = 0
+        self.ending_label = None
+        self.ending_count : int = 0
+        self.next_subframe()
+        self.decoder.reset()
+
+    def next_subframe(self) -> None:
+        """Gets ready for the header of the next data frame or subframe, in the header's modulation and symbol duration"""
+        self.symbols = []
+        self.expected_symbols : int = 0
+        self.data_end : int = 0
+        self.classify = self.receiver.classify_symbol
+        self.width : int = 4
+        self.rate = None
+        self.decoder.ratio = self.receiver.Ratio_of_Sender_Receiver
+        self.decoder.ratio_threshold = self.receiver.Ratio_Threshold
+
+    def trailer_decoding(self) -> None:
+        """The CRC and parity symbols after the data are 4-bit symbols of the header's symbol duration"""
+        self.classify = self.receiver.classify_symbol
+        self.decoder.ratio = self.receiver.Ratio_of_Sender_Receiver
+        self.decoder.ratio_threshold = self.receiver.Ratio_Threshold
+
+    def expect(self, frame_type : str) -> None:
+        """Skips the preamble: the following symbols are parsed as a frame of the given type"""
+        self.reset()
+        self.frame_type = frame_type
+        if frame_type == "block_ack":
+            self.classify = lambda frame: self.receiver.classify_multitone(frame, BLOCK_ACK_GROUPS)
+
+    def clear(self) -> None:
+        """Drops the buffered samples and goes back to hunting (e.g. after a gap in the capture)"""
+        self.pending = np.empty(0, dtype=np.int16)
+        self.offset = 0
+        self.reset()
+
+    def feed(self, samples):
+        """Adds a chunk of int16 samples and yields the events it completes"""
+        self.pending = np.concatenate((self.pending[self.offset:], np.asarray(samples, dtype=np.int16)))
+        self.offset = 0
+        while True:
+            n = self.symbol_length if self.frame_type is not None else self.hunt_length
+            if len(self.pending) - self.offset < n:
+                return
+            frame = self.pending[self.offset:self.offset + n]
+            self.offset += n
+            self.sample += n
+            if self.frame_type is None:
+                yield from self.hunt(frame)
+            else:
+                yield from self.read_symbol(frame)
+
+    def events(self, stream, chunk_length : int = None):
+        """Reads the stream forever and yields the events decoded from it"""
+        if chunk_length is None:
+            chunk_length = self.hunt_length
+        while True:
+            yield from self.feed(np.frombuffer(stream.read(chunk_length), dtype=np.int16))
+
+    def hunt(self, frame):
+        """Looks for preambles and ending tones in a short frame"""
+        # Only pay for the spectral analysis when the last clear channel assessment window is loud, and then share one
+        # spectrum between the band check and the classification
+        cca = self.receiver.cca
+        label = "?"
+        self.busy = cca.above_floor(cca.window_energy(frame))
+        if self.busy:
+            power = self.receiver.hunt_front_end(len(frame)).power(frame)
+            self.busy = cca.in_band(power, len(frame))
+            if self.busy:
+                label = self.receiver.classify_hunt_frame(frame, power)
+        yield from self.hunt_label(label)
+
+    def hunt_label(self, label : str):
+        """Yields the events completed by the label of a hunting frame (self.busy already set for that frame)"""
+        if label in PREAMBLE_TYPES:
+            if label == self.preamble_type:
+                self.preamble_count += 1
+            else:
+                self.preamble_type = label
+                self.preamble_count = 1
+            self.gap = 0
+            if self.preamble_count >= self.preamble_length:
+                frame_type = self.preamble_type
+                self.expect(frame_type)
+                yield FrameEvent("preamble", {"type": frame_type}, self.sample)
+            return
+        self.gap += 1
+        if self.gap > self.preamble_length:
+            self.preamble_type = None
+            self.preamble_count = 0
+        if label.startswith("ending"):
+            if label == self.ending_label:
+                self.ending_count += 1
+            else:
+                self.ending_label = label
+                self.ending_count = 1
+            if self.ending_count == self.ending_frames:
+                yield FrameEvent("ending", {"label": label}, self.sample)
+        else:
+            self.ending_label = None
+            self.ending_count = 0
+
+    def read_symbol(self, frame):
+        """Classifies a symbol frame and yields the symbol and frame events it completes"""
+        yield from self.read_label(self.classify(frame))
+
+    def read_label(self, label : str):
+        """Yields the symbol and frame events completed by the classification of a symbol frame"""
+        self.symbol_frames += 1
+        self.busy = True
+        symbol = self.decoder.push(label)
+        if symbol is None or (symbol == "?" and not self.symbols and not self.decoder.erasure):
+            # Silence before the first symbol is not part of the frame (a symbol lost to noise is)
+            if self.symbol_frames > self.max_symbol_frames:
+                frame_type = self.frame_type
+                self.reset()
+                yield FrameEvent("timeout", {"type": frame_type}, self.sample)
+            return
+        self.symbols.append(symbol)
+        # Longer frames (slower rates, more symbols) must not run into the timeout
+        self.symbol_frames = 0
+        yield FrameEvent("symbol", {"type": self.frame_type, "bits": symbol}, self.sample)
+        yield from self.parse()
+
+    def header(self, symbols : list) -> dict:
+        """Returns the fields of the header symbols of a data frame or subframe"""
+        fields = self.header_fields
+        symbols = [symbol if symbol != "?" else "????" for symbol in symbols]
+        fragment = symbols[fields.index("fragment")] if "fragment" in fields else None
+        return {
+            "type": self.frame_type,
+            "sender": field_value(symbols[0][:2]),
+            "message_id": field_value(symbols[0][2:4]),
+            "length": field_value("".join(symbols[1:1 + fields.count("length")])),
+            "rate": field_value(symbols[fields.index("rate")]) if "rate" in fields else None,
+            "sequence": field_value(symbols[fields.index("sequence")]) if "sequence" in fields else None,
+            "fragment": field_value(fragment[1:]) if fragment is not None else None,
+            "more_fragments": fragment[0] == "1" if fragment is not None and "?" not in fragment else None,
+        }
+
+    def parse(self):
+        """Yields the frame events that the symbols read so far complete"""
+        config = self.receiver.config
+        frame_type = self.frame_type
+        symbols = self.symbols
+        if frame_type in ("rts", "cts"):
+            # Addresses, then the duration field (None if it could not be read)
+            if "?" in symbols[0]:
+                self.reset()
+                yield FrameEvent("error", {"type": frame_type, "symbols": symbols}, self.sample)
+                return
+            if len(symbols) < 1 + config.nav_symbols:
+                return
+            self.reset()
+            duration = decode_duration("".join(symbols[1:]), config) if config.nav_symbols else None
+            yield FrameEvent(frame_type, {"sender": symbols[0][:2], "receiver": symbols[0][2:4], "duration": duration}, self.sample)
+            return
+        if frame_type == "block_ack":
+            self.reset()
+            if "?" in symbols[0]:
+                yield FrameEvent("error", {"type": frame_type, "symbols": symbols}, self.sample)
+            else:
+                yield FrameEvent("block_ack", decode_block_ack(symbols[0], config.arq_window), self.sample)
+            return
+        if frame_type == "aggregate" and not self.subframes:
+            # The first symbol of an aggregate is its number of subframes
+            if "?" in symbols[0] or int(symbols[0], 2) == 0:
+                self.reset()
+                yield FrameEvent("error", {"type": frame_type, "symbols": symbols}, self.sample)
+                return
+            self.subframes = int(symbols[0], 2)
+            self.symbols = []
+            return
+        # Sender and message id, length (two symbols with extended length), then the rate of the data symbols with rate
+        # adaptation, the sequence number with selective repeat and the fragment symbol with fragmentation
+        fields = self.header_fields
+        coder = self.receiver.coder
+        if len(symbols) == len(fields):
+            # The length and rate give the frame's layout; with error control the other fields can still be corrected
+            needed = symbols if not coder.trailer_symbols else [symbol for symbol, field in zip(symbols, fields) if field in ("length", "rate")]
+            if any("?" in symbol for symbol in needed) or ("rate" in fields and int(symbols[fields.index("rate")], 2) >= len(config.rate_table)):
+                self.reset()
+                yield FrameEvent("error", {"type": frame_type, "symbols": symbols}, self.sample)
+                return
+            header = self.header(symbols)
+            # The data symbols may use another modulation and symbol duration than the header
+            self.rate = header["rate"]
+            self.classify, self.width, self.decoder.ratio, self.decoder.ratio_threshold = self.receiver.data_symbol_decoding(self.rate)
+            self.data_end = len(fields) + (header["length"] + self.width - 1) // self.width
+            self.expected_symbols = self.data_end + coder.trailer_symbols
+            yield FrameEvent("header", header, self.sample)
+        if coder.trailer_symbols and len(symbols) == self.data_end >= len(fields):
+            self.trailer_decoding()
+        if len(symbols) >= len(fields) and len(symbols) == self.expected_symbols:
+            payload = self.header(symbols)
+            length = payload.pop("length")
+            message = join_symbols(symbols[len(fields):self.data_end], self.width)[:length]
+            if coder.trailer_symbols:
+                decoded = coder.decode(join_symbols(symbols[:len(fields)]), message, join_symbols(symbols[self.data_end:]))
+                if decoded is not None:
+                    corrected = self.header([decoded[0][i:i + 4] for i in range(0, len(decoded[0]), 4)])
+                    # A correction of the length or rate means the frame was not read the way it was sent
+                    if corrected.pop("length") != length or corrected["rate"] != self.rate:
+                        decoded = None
+                if decoded is None:
+                    # Dropped like any frame with unreadable symbols
+                    message = "?" * max(length, 1)
+                else:
+                    payload, message = corrected, decoded[1]
+            payload["message"] = message
+            if frame_type == "aggregate":
+                payload["subframe"] = self.subframe
+                payload["subframes"] = self.subframes
+                self.subframe += 1
+            if self.subframe < self.subframes:
+                self.next_subframe()
+            else:
+                self.reset()
+            yield FrameEvent("payload", payload, self.sample)
@@ -0,0 +1,332 @@
+"""Error control of data frames: a table-driven CRC and a Reed-Solomon code over the 4-bit symbols (GF(16))"""
+from demodulator import header_fields
+
+
+class DecodingError(Exception):
+    """Raised when a Reed-Solomon codeword holds more errors than its parity symbols can correct"""
+
+
+# GF(16) built on the primitive polynomial x^4 + x + 1, with alpha = 2. GF_EXP is doubled so products of logs need no
+# modulo
+GF_ORDER = 15
+GF_EXP = [0] * (2 * GF_ORDER)
+GF_LOG = [0] * (GF_ORDER + 1)
+
+
+def build_gf_tables() -> None:
+    """Fills the exponent and logarithm tables of GF(16)"""
+    x = 1
+    for i in range(GF_ORDER):
+        GF_EXP[i] = GF_EXP[i + GF_ORDER] = x
+        GF_LOG[x] = i
+        x <<= 1
+        if x & 0x10:
+            x ^= 0x13
+
+
+build_gf_tables()
+
+
+def gf_mul(a : int, b : int) -> int:
+    """Returns the product of two elements of GF(16)"""
+    if a == 0 or b == 0:
+        return 0
+    return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+
+def gf_div(a : int, b : int) -> int:
+    """Returns a / b in GF(16) (b must not be 0)"""
+    if a == 0:
+        return 0
+    return GF_EXP[(GF_LOG[a] - GF_LOG[b]) % GF_ORDER]
+
+
+def gf_pow(a : int, power : int) -> int:
+    """Returns a to the given (possibly negative) power in GF(16)"""
+    return GF_EXP[(GF_LOG[a] * power) % GF_ORDER]
+
+
+def gf_inverse(a : int) -> int:
+    """Returns the multiplicative inverse of a non-zero element of GF(16)"""
+    return GF_EXP[GF_ORDER - GF_LOG[a]]
+
+
+# Polynomials over GF(16) are lists of coefficients, highest degree first
+
+def poly_scale(p : list, x : int) -> list:
+    """Returns the polynomial p times the scalar x"""
+    return [gf_mul(c, x) for c in p]
+
+
+def poly_add(p : list, q : list) -> list:
+    """Returns the sum of two polynomials"""
+    result = [0] * max(len(p), len(q))
+    for i, c in enumerate(p):
+        result[i + len(result) - len(p)] = c
+    for i, c in enumerate(q):
+        result[i + len(result) - len(q)] ^= c
+    return result
+
+
+def poly_mul(p : list, q : list) -> list:
+    """Returns the product of two polynomials"""
+    result = [0] * (len(p) + len(q) - 1)
+    for j, b in enumerate(q):
+        for i, a in enumerate(p):
+            result[i + j] ^= gf_mul(a, b)
+    return result
+
+
+def poly_eval(p : list, x : int) -> int:
+    """Returns the value of a polynomial at x (Horner's scheme)"""
+    y = p[0]
+    for c in p[1:]:
+        y = gf_mul(y, x) ^ c
+    return y
+
+
+class ReedSolomon:
+    """
+    A class used to represent a systematic Reed-Solomon code over GF(16), shortened to codewords of at most 15 symbols.
+    The parity symbols correct e wrong symbols and f unreadable ones (erasures, whose positions are known) as long as
+    2e + f <= parity.
+
+
+    Attributes
+    ----------
+    parity : int
+        Number of parity symbols appended to every message
+    generator : list[int]
+        Generator polynomial, whose roots are alpha^0 ... alpha^(parity - 1)
+    """
+
+    def __init__(self, parity : int) -> None:
+        """Initialises the member variables of the class"""
+        if not 1 <= parity < GF_ORDER:
+            raise ValueError("A GF(16) Reed-Solomon code needs 1 to 14 parity symbols, not %d" % parity)
+        self.parity : int = parity
+        self.generator = [1]
+        for i in range(parity):
+            self.generator = poly_mul(self.generator, [1, gf_pow(2, i)])
+
+    def encode(self, message : list) -> list:
+        """Returns the parity symbols of a message (a list of 4-bit integers)"""
+        if len(message) + self.parity > GF_ORDER:
+            raise ValueError("A GF(16) Reed-Solomon codeword holds at most %d symbols" % GF_ORDER)
+        # Remainder of message * x^parity divided by the (monic) generator, by synthetic division
+        remainder = list(message) + [0] * self.parity
+        for i in range(len(message)):
+            coefficient = remainder[i]
+            if coefficient:
+                for j in range(1, len(self.generator)):
+                    remainder[i + j] ^= gf_mul(self.generator[j], coefficient)
+        return remainder[len(message):]
+
+    def syndromes(self, codeword : list) -> list:
+        """Returns the values of the codeword at the roots of the generator (all 0 for a valid codeword)"""
+        return [poly_eval(codeword, gf_pow(2, i)) for i in range(self.parity)]
+
+    def decode(self, codeword : list) -> list:
+        """
+        Returns the corrected codeword (message then parity symbols); unreadable symbols are None.
+        Raises DecodingError when there are too many errors.
+        """
+        n = len(codeword)
+        erasures = [i for i, symbol in enumerate(codeword) if symbol is None]
+        if len(erasures) > self.parity:
+            raise DecodingError("%d unreadable symbols, at most %d can be corrected" % (len(erasures), self.parity))
+        received = [0 if symbol is None else symbol for symbol in codeword]
+        syndromes = self.syndromes(received)
+        if not any(syndromes):
+            return received
+        # Remove the known erasures from the syndromes (Forney syndromes), then find the error locator from what is
+        # left with Berlekamp-Massey
+        forney = list(syndromes)
+        for position in erasures:
+            x = gf_pow(2, n - 1 - position)
+            for j in range(len(forney) - 1):
+                forney[j] = gf_mul(forney[j], x) ^ forney[j + 1]
+        locator = self.error_locator(forney[:self.parity - len(erasures)], len(erasures))
+        errors = self.find_errors(locator, n)
+        corrected = self.correct(received, syndromes, erasures + errors)
+        if any(self.syndromes(corrected)):
+            raise DecodingError("The codeword could not be corrected")
+        return corrected
+
+    def error_locator(self, syndromes : list, erasure_count : int) -> list:
+        """Returns the error locator polynomial of the syndromes left once the erasures are accounted for"""
+        locator = [1]
+        previous = [1]
+        for k in range(len(syndromes)):
+            delta = syndromes[k]
+            for j in range(1, len(locator)):
+                delta ^= gf_mul(locator[-(j + 1)], syndromes[k - j])
+            previous = previous + [0]
+            if delta:
+                if len(previous) > len(locator):
+                    scaled = poly_scale(previous, delta)
+                    previous = poly_scale(locator, gf_inverse(delta))
+                    locator = scaled
+                locator = poly_add(locator, poly_scale(previous, delta))
+        while locator and locator[0] == 0:
+            del locator[0]
+        if 2 * (len(locator) - 1) + erasure_count > self.parity:
+            raise DecodingError("Too many errors to correct")
+        return locator
+
+    def find_errors(self, locator : list, n : int) -> list:
+        """Returns the codeword positions whose locator is a root of the error locator polynomial (Chien search)"""
+        # The locator's roots are the inverses of the error locations, so the reversed polynomial has them as roots
+        locator = locator[::-1]
+        positions = [n - 1 - i for i in range(n) if poly_eval(locator, gf_pow(2, i)) == 0]
+        if len(positions) != len(locator) - 1:
+            raise DecodingError("The errors are not all inside the codeword")
+        return positions
+
+    def correct(self, codeword : list, syndromes : list, positions : list) -> list:
+        """Returns the codeword with the errors and erasures at the given positions corrected (Forney algorithm)"""
+        n = len(codeword)
+        locations = [gf_pow(2, n - 1 - position) for position in positions]
+        # Errata locator, lowest degree first: product of (1 - X x) over the errata locations X
+        errata = [1]
+        for x in locations:
+            errata = poly_mul(errata, [x, 1])
+        # Error evaluator: (syndromes * errata locator) mod x^parity, both lowest degree first
+        evaluator = poly_mul(syndromes[::-1], errata)[-self.parity:]
+        corrected = list(codeword)
+        for i, x in enumerate(locations):
+            x_inverse = gf_inverse(x)
+            derivative = 1
+            for j, other in enumerate(locations):
+                if j != i:
+                    derivative = gf_mul(derivative, 1 ^ gf_mul(x_inverse, other))
+            if derivative == 0:
+                raise DecodingError("Two errata share a location")
+            # With the generator's first root at alpha^0, the magnitude is evaluator(1/X) / prod(1 - X'/X)
+            corrected[positions[i]] ^= gf_div(poly_eval(evaluator, x_inverse), derivative)
+        return corrected
+
+
+class CRC:
+    """
+    A class used to represent a table-driven CRC over bit-strings of any length.
+    The bits go through the register a 4-bit symbol at a time with a 16-entry table (any leading bits that do not fill
+    a symbol go through one at a time).
+
+
+    Attributes
+    ----------
+    width : int
+        Number of bits of the checksum (degree of the generator polynomial, at least 4)
+    polynomial : int
+        Generator polynomial without its leading term
+    table : list[int]
+        Register update for every value of the 4 bits shifted out
+    """
+
+    def __init__(self, polynomial : str) -> None:
+        """Initialises the member variables of the class from a polynomial such as Config.CRC_polynomial"""
+        generator = polynomial.lstrip("0")
+        self.width : int = len(generator) - 1
+        if self.width < 4:
+            raise ValueError("The CRC polynomial must be of degree 4 or more")
+        self.mask : int = (1 << self.width) - 1
+        self.polynomial : int = int(generator, 2) & self.mask
+        self.table = []
+        for nibble in range(16):
+            register = nibble << (self.width - 4)
+            for _ in range(4):
+                register = self.shift(register, 0)
+            self.table.append(register)
+
+    def shift(self, register : int, bit : int) -> int:
+        """Returns the register after one more bit"""
+        top = ((register >> (self.width - 1)) & 1) ^ bit
+        register = (register << 1) & self.mask
+        return register ^ self.polynomial if top else register
+
+    def checksum(self, bits : str) -> str:
+        """Returns the width-bit CRC of a bit-string"""
+        register = 0
+        head = len(bits) % 4
+        for bit in bits[:head]:
+            register = self.shift(register, int(bit))
+        for i in range(head, len(bits), 4):
+            index = ((register >> (self.width - 4)) ^ int(bits[i:i + 4], 2)) & 0xF
+            register = ((register << 4) & self.mask) ^ self.table[index]
+        return bin(register)[2:].zfill(self.width)
+
+
+def to_symbols(bits : str) -> list:
+    """Splits a bit-string (a multiple of 4 bits long) into 4-bit integers, None for the ones holding unknown bits"""
+    return [None if "?" in bits[i:i + 4] else int(bits[i:i + 4], 2) for i in range(0, len(bits), 4)]
+
+
+def to_bits(symbols : list) -> str:
+    """Joins 4-bit integers into a bit-string"""
+    return "".join(bin(symbol)[2:].zfill(4) for symbol in symbols)
+
+
+class FrameCoder:
+    """
+    A class used to represent the error control trailer sent after the data of every data frame or subframe: the CRC of
+    the header and data bits (Config.crc) and Reed-Solomon parity symbols over the header, data and CRC
+    (Config.fec_parity_symbols). The trailer is made of 4-bit symbols sent like the header.
+
+
+    Attributes
+    ----------
+    crc : CRC
+        Checksum of the frame, None without Config.crc
+    code : ReedSolomon
+        Forward error correction code, None without parity symbols
+    crc_symbols : int
+        Number of symbols the CRC takes
+    trailer_symbols : int
+        Number of symbols of the trailer (0 when error control is off)
+    """
+
+    def __init__(self, config) -> None:
+        """Initialises the member variables of the class"""
+        self.crc = CRC(config.CRC_polynomial) if config.crc else None
+        self.code = ReedSolomon(config.fec_parity_symbols) if config.fec_parity_symbols else None
+        self.crc_symbols : int = (self.crc.width + 3) // 4 if self.crc else 0
+        self.trailer_symbols : int = self.crc_symbols + config.fec_parity_symbols
+        if self.code is not None:
+            # The header symbols, then at most max_frame_bits of data
+            if len(header_fields(config)) + (config.max_frame_bits + 3) // 4 + self.trailer_symbols > GF_ORDER:
+                raise ValueError("Frames with this header, CRC and %d parity symbols do not fit in a GF(16) codeword" % config.fec_parity_symbols)
+
+    def checksum(self, bits : str) -> str:
+        """Returns the CRC bits of the trailer, zero padded to whole symbols"""
+        return self.crc.checksum(bits).zfill(4 * self.crc_symbols) if self.crc else ""
+
+    def trailer(self, header : str, data : str) -> str:
+        """Returns the trailer bits of a frame from its header bits and its (unpadded) data bits"""
+        trailer = self.checksum(header + data)
+        if self.code is not None:
+            trailer += to_bits(self.code.encode(to_symbols(header + data.ljust(-(-len(data) // 4) * 4, "0") + trailer)))
+        return trailer
+
+    def decode(self, header : str, data : str, trailer : str):
+        """
+        Returns the (header, data) bits of a received frame once its errors are corrected and its CRC checked, or None.
+        Unknown bits are "?"; data holds only the length announced by the header.
+        """
+        if self.code is not None:
+            padding = -len(data) % 4
+            codeword = to_symbols(header + data + "0" * padding + trailer)
+            try:
+                bits = to_bits(self.code.decode(codeword))
+            except DecodingError:
+                return None
+            # The padding was sent as zeros, the correction must not have changed it
+            if "1" in bits[len(header) + len(data):len(header) + len(data) + padding]:
+                return None
+            header, data = bits[:len(header)], bits[len(header):len(header) + len(data)]
+            trailer = bits[len(header) + len(data) + padding:]
+        if "?" in header + data:
+            return None
+        if self.crc is not None and self.checksum(header + data) != trailer[:4 * self.crc_symbols]:
+            return None
+        return header, data
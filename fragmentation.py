@@ -0,0 +1,97 @@
+"""Fragmentation of long .buffer messages into data frames and their reassembly at the receiver"""
+from collections import OrderedDict
+
+
+# The fragment symbol holds a more-fragments bit and a 3-bit fragment number
+MAX_FRAGMENTS = 8
+
+
+def fragment(bits : str, size : int) -> list:
+    """Splits a message into pieces of at most size bits (one empty piece for an empty message)"""
+    return [bits[i:i + size] for i in range(0, len(bits), size)] or [""]
+
+
+def encode_fragment(number : int, more : bool) -> str:
+    """Returns the 4 bits of a fragment symbol"""
+    return ("1" if more else "0") + bin(number)[2:].zfill(3)
+
+
+def decode_fragment(bits : str) -> tuple:
+    """Returns the (fragment number, more fragments) of a fragment symbol"""
+    return int(bits[1:], 2), bits[0] == "1"
+
+
+class PartialMessage:
+    """
+    A class used to represent a message whose fragments are being collected
+
+
+    Attributes
+    ----------
+    started : float
+        Time its first fragment arrived
+    fragments : dict[int -> str]
+        Bits of every fragment received, by fragment number
+    count : int
+        Number of fragments, known once the last one (without the more-fragments bit) arrived
+    """
+
+    def __init__(self, started : float) -> None:
+        """Initialises the member variables of the class"""
+        self.started : float = started
+        self.fragments = {}
+        self.count = None
+
+
+class Reassembler:
+    """
+    A class used to represent the reassembly of fragmented messages, keyed by sender and message id.
+    Memory is bounded: at most capacity messages are collected at once (the oldest is dropped to make room) and a
+    message that is not complete timeout seconds after its first fragment is dropped.
+
+
+    Attributes
+    ----------
+    timeout : float
+        Seconds a message may take to be complete
+    capacity : int
+        Maximum number of messages collected at once
+    partial : OrderedDict[tuple[int, int] -> PartialMessage]
+        Messages being collected, oldest first
+    """
+
+    def __init__(self, timeout : float, capacity : int) -> None:
+        """Initialises the member variables of the class"""
+        self.timeout : float = timeout
+        self.capacity : int = capacity
+        self.partial = OrderedDict()
+
+    def expire(self, now : float) -> None:
+        """Drops the messages that took too long"""
+        while self.partial:
+            key, message = next(iter(self.partial.items()))
+            if now - message.started < self.timeout:
+                break
+            del self.partial[key]
+
+    def add(self, sender : int, message_id : int, number : int, more : bool, bits : str, now : float):
+        """Stores a fragment and returns the whole message once it is complete (None before)"""
+        self.expire(now)
+        if number == 0 and not more:
+            # Not fragmented
+            return bits
+        key = (sender, message_id)
+        # Fragments are sent in order, so a first fragment starts a new message (message ids are only 2 bits)
+        if number == 0 or key not in self.partial:
+            self.partial.pop(key, None)
+            if len(self.partial) >= self.capacity:
+                self.partial.popitem(last=False)
+            self.partial[key] = PartialMessage(now)
+        message = self.partial[key]
+        message.fragments[number] = bits
+        if not more:
+            message.count = number + 1
+        if message.count is None or any(i not in message.fragments for i in range(message.count)):
+            return None
+        del self.partial[key]
+        return "".join(message.fragments[i] for i in range(message.count))
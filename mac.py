@@ -0,0 +1,577 @@
+"""Event-driven MAC: a scheduler of monotonic-clock timers and the RTS/CTS state machine it drives"""
+import heapq
+import itertools
+import math
+from backoff import make_backoff
+from rate_control import RateController
+from arq import SelectiveRepeat, encode_block_ack
+from nav import encode_duration
+from airtime import ack_airtime, control_airtime, data_airtime
+
+
+# States of the MAC
+IDLE = "IDLE"            # Nothing pending, transmits as soon as a message is queued and the channel is clear
+BACKOFF = "BACKOFF"      # A message is pending but the backoff timer has not expired yet
+TX_RTS = "TX_RTS"        # Sending (or about to send) an RTS
+WAIT_CTS = "WAIT_CTS"    # RTS sent, waiting for the CTS
+TX_DATA = "TX_DATA"      # Sending (or about to send) a data frame
+WAIT_ACK = "WAIT_ACK"    # Data frame sent, waiting for the acknowledgement(s)
+RX_RTS = "RX_RTS"        # RTS preamble heard, reading the RTS
+TX_CTS = "TX_CTS"        # Sending (or about to send) a CTS
+RX_DATA = "RX_DATA"      # Waiting for or reading a data frame
+TX_ACK = "TX_ACK"        # Sending (or about to send) an acknowledgement
+DEFER = "DEFER"          # Another exchange is going on, waiting for its acknowledgement
+
+TX_STATES = (TX_RTS, TX_DATA, TX_CTS, TX_ACK)
+
+
+class Timer:
+    """
+    A class used to represent a call scheduled on a Scheduler
+
+
+    Attributes
+    ----------
+    deadline : float
+        Clock time at which the callback runs
+    callback : function
+        Called with args when the timer expires
+    cancelled : bool
+        Whether the timer was cancelled before it expired
+    """
+
+    def __init__(self, deadline : float, callback, args : tuple) -> None:
+        """Initialises the member variables of the class"""
+        self.deadline : float = deadline
+        self.callback = callback
+        self.args : tuple = args
+        self.cancelled : bool = False
+
+    def cancel(self) -> None:
+        """Prevents the callback from running"""
+        self.cancelled = True
+
+    def remaining(self, now : float) -> float:
+        """Returns the seconds left before the timer expires"""
+        return max(0.0, self.deadline - now)
+
+
+class Scheduler:
+    """
+    A class used to represent a set of timers on a monotonic clock.
+    Any number of timers can be pending at once; run_due runs the expired ones in deadline order.
+
+
+    Attributes
+    ----------
+    clock : function
+        Returns the current time in seconds, never going backwards
+    timers : list[tuple[float, int, Timer]]
+        Heap of the pending timers, ordered by deadline then by creation
+    """
+
+    def __init__(self, clock) -> None:
+        """Initialises the member variables of the class"""
+        self.clock = clock
+        self.timers = []
+        self.counter = itertools.count()
+
+    def call_at(self, deadline : float, callback, *args) -> Timer:
+        """Runs callback(*args) once the clock reaches deadline"""
+        timer = Timer(deadline, callback, args)
+        heapq.heappush(self.timers, (deadline, next(self.counter), timer))
+        return timer
+
+    def call_later(self, delay : float, callback, *args) -> Timer:
+        """Runs callback(*args) delay seconds from now"""
+        return self.call_at(self.clock() + delay, callback, *args)
+
+    def next_deadline(self):
+        """Returns the deadline of the earliest pending timer, or None"""
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+        return self.timers[0][0] if self.timers else None
+
+    def run_due(self) -> int:
+        """Runs every expired timer and returns how many ran"""
+        now = self.clock()
+        ran = 0
+        while self.timers and self.timers[0][0] <= now:
+            _, _, timer = heapq.heappop(self.timers)
+            if not timer.cancelled:
+                timer.cancelled = True
+                timer.callback(*timer.args)
+                ran += 1
+        return ran
+
+
+class MacStateMachine:
+    """
+    A class used to represent the RTS/CTS MAC of one node as an explicit state machine.
+    It never blocks: it reacts to frame events from the demodulator, to the clear channel assessment, to the end of
+    its own transmissions and to its timers, and asks the node to transmit frames.
+
+    The node must provide config, notify(kind, **data), next_message(dest), aggregate_messages(limit),
+    is_message_broadcast(message), message_delivered(), requeue_current_message(),
+    message_received(message, sender_id, message_id, sequence, fragment, subframe, subframes) and transmit(kind, data),
+    and call on_transmitted() once a transmission has been played. Delivery and requeueing apply to every message of the
+    current aggregate.
+    RTS and CTS frames advertise how long the rest of their exchange lasts, and the nodes that overhear them defer for
+    exactly that long (virtual carrier sense) instead of waiting for an acknowledgement they might miss.
+    In burst mode the fragments that follow an acknowledged fragment are sent straight away, without a new RTS/CTS.
+
+
+    Attributes
+    ----------
+    node : Node
+        The node whose messages and counters are used (Main, or a simulated node)
+    config : Config
+        The configuration object with the node id, timeouts and backoff parameters
+    scheduler : Scheduler
+        Scheduler holding every timer of the MAC
+    state : str
+        Current state (one of the constants of this module)
+    channel_busy : bool
+        Result of the latest clear channel assessment
+    message : tuple[str, str]
+        Message being sent (bits with header, destination line), None when there is none
+    backoff : BackoffPolicy
+        Contention window policy (Config.backoff)
+    backoff_timer : Timer
+        End of the current backoff slot, None when the node may transmit
+    backoff_slots : int
+        Idle slots left in the current backoff
+    slot_busy : bool
+        Whether the channel was busy, or the node busy with another exchange, during the current backoff slot
+    response_timer : Timer
+        Pending timeout of the current wait state
+    expected_acks : set[str]
+        Ending labels still expected for the broadcast being acknowledged
+    rates : RateController
+        Delivery history of every destination, which picks the rate of unicast data frames with rate adaptation
+    rate : int
+        Rate of the data frame being sent, None without rate adaptation
+    rx_failed : bool
+        Whether a subframe of the data frame or aggregate being received could not be decoded
+    arq : SelectiveRepeat
+        Sequence windows of the selective repeat ARQ, None in stop-and-wait mode
+    rx_sender : int
+        Sender of the subframes decoded so far in the data frame being received (None before the first one)
+    rx_more : bool
+        Whether the data frame being received (or overheard) said that more fragments follow it (burst mode)
+    nav : bool
+        Whether the current defer follows the duration field of an overheard RTS or CTS (network allocation vector)
+    resend : int
+        Number of messages of the unacknowledged data frame that is sent again as it was (stop-and-wait), 0 if none
+    """
+
+    def __init__(self, node, scheduler : Scheduler) -> None:
+        """Initialises the member variables of the class"""
+        self.node = node
+        self.config = node.config
+        self.scheduler = scheduler
+        self.state : str = IDLE
+        self.channel_busy : bool = False
+        self.message = None
+        self.broadcast : bool = False
+        self.backoff = make_backoff(self.config)
+        self.backoff_timer = None
+        self.backoff_slots : int = 0
+        self.slot_busy : bool = False
+        self.response_timer = None
+        self.expected_acks = set()
+        self.peer : str = ""
+        self.rates = RateController(self.config.rate_table, self.config.rate_ewma_weight, self.config.rate_sample_fraction)
+        self.rate = None
+        self.rx_failed : bool = False
+        self.arq = SelectiveRepeat(self.config.arq_window) if self.config.arq == "selective_repeat" else None
+        self.rx_sender = None
+        self.rx_more : bool = False
+        self.nav : bool = False
+        self.resend : int = 0
+
+    def address(self, node) -> str:
+        """Returns the address bits of a node number (as wide as our own address)"""
+        return bin(int(node))[2:].zfill(len(self.config.node_id))
+
+    def set_state(self, state : str) -> None:
+        """Moves to a new state"""
+        if state != self.state:
+            self.state = state
+            self.node.notify("state", state=state)
+
+    def rest(self) -> None:
+        """Goes back to waiting for something to do once an exchange is over"""
+        self.cancel_response_timer()
+        self.set_state(BACKOFF if self.backoff_timer is not None else IDLE)
+
+    def wait_for(self, state : str, timeout : float) -> None:
+        """Moves to a wait state that is abandoned after timeout seconds"""
+        self.cancel_response_timer()
+        self.set_state(state)
+        self.response_timer = self.scheduler.call_later(timeout, self.on_wait_expired, state)
+
+    def cancel_response_timer(self) -> None:
+        """Cancels the timeout of the current wait state"""
+        if self.response_timer is not None:
+            self.response_timer.cancel()
+            self.response_timer = None
+
+    def start_backoff(self, slots : int) -> None:
+        """Starts counting down a backoff of the given number of idle slots (Config.collision_wait_time each)"""
+        if self.backoff_timer is not None:
+            self.backoff_timer.cancel()
+            self.backoff_timer = None
+        self.backoff_slots = slots
+        if slots > 0:
+            self.slot_busy = self.channel_busy
+            self.backoff_timer = self.scheduler.call_later(self.config.collision_wait_time, self.on_backoff_slot)
+
+    def on_backoff_slot(self) -> None:
+        """A backoff slot is over: it only counts if the channel stayed idle, otherwise the countdown is frozen"""
+        if not self.slot_busy and self.state in (IDLE, BACKOFF):
+            self.backoff_slots -= 1
+        if self.backoff_slots > 0:
+            self.slot_busy = self.channel_busy
+            self.backoff_timer = self.scheduler.call_later(self.config.collision_wait_time, self.on_backoff_slot)
+            return
+        # The backoff is over, the pending message can be sent
+        self.backoff_timer = None
+        if self.state == BACKOFF:
+            self.set_state(IDLE)
+
+    def collision(self) -> None:
+        """Counts a failed attempt, backs off and puts the message back in the queue"""
+        self.backoff.on_collision()
+        self.node.notify("collision")
+        self.start_backoff(self.backoff.backoff_slots())
+        self.requeue()
+
+    def requeue(self) -> None:
+        """
+        Puts the current message back in the queue: at its tail, or at its head with selective repeat (to keep the
+        window moving), fragmentation (to keep the fragments of a message in order) or once it was sent without being
+        acknowledged: it is then sent again as it was in the next exchange, which its receivers drop as a retransmission
+        """
+        if self.message is not None:
+            if self.state == WAIT_ACK and self.arq is None:
+                self.resend = len(self.node.current_aggregate)
+            requeued = self.node.requeue_current_message(front=self.arq is not None or self.config.fragmentation or self.resend > 0)
+            if self.resend > 0:
+                self.resend = len(requeued)
+            self.message = None
+
+    def report_rate(self, success : bool) -> None:
+        """Tells the rate controller whether the unicast data frame just sent was acknowledged"""
+        if self.rate is not None and not self.broadcast and self.message is not None:
+            self.rates.report(self.message[1], self.rate, success)
+
+    def delivered(self) -> None:
+        """The current message was acknowledged"""
+        self.backoff.on_success()
+        self.node.message_delivered()
+        self.message = None
+        self.resend = 0
+
+    def burst(self, messages : list) -> bool:
+        """
+        In burst mode, sends the next fragment for the same destination right after the acknowledgement of messages
+        when the last one had more fragments to follow; returns whether it did
+        """
+        if not self.config.burst or not messages or messages[-1][3] is None or not messages[-1][3][1]:
+            return False
+        message = self.node.next_message(messages[-1][1])
+        if message is None:
+            return False
+        self.message = message
+        self.send_data()
+        return True
+
+    def transmit_later(self, state : str, kind : str, delay : float, **data) -> None:
+        """Moves to a transmit state and sends a frame after delay seconds (the turnaround time)"""
+        self.cancel_response_timer()
+        self.set_state(state)
+        if delay > 0:
+            self.scheduler.call_later(delay, self.node.transmit, kind, data)
+        else:
+            self.node.transmit(kind, data)
+
+    def on_channel(self, busy : bool) -> None:
+        """Called after every clear channel assessment; starts a transmission when the node may send"""
+        if busy != self.channel_busy:
+            self.node.notify("channel", busy=busy)
+        self.channel_busy = busy
+        if busy or self.state not in (IDLE, BACKOFF):
+            self.slot_busy = True
+        if self.state != IDLE or busy or self.backoff_timer is not None:
+            return
+        if self.message is None:
+            message = self.node.next_message()
+            if message is None:
+                return
+            self.message = message
+            # The policy may make a new message wait a few idle slots too (p-persistent access), unless it just backed off
+            slots = self.backoff.access_slots() if self.backoff.collisions == 0 else 0
+            if slots > 0:
+                self.start_backoff(slots)
+                self.set_state(BACKOFF)
+                return
+        message = self.message
+        self.broadcast = self.node.is_message_broadcast(message)
+        if self.broadcast:
+            # Every node must decode a broadcast, so it always goes at the slowest rate
+            self.rate = 0 if self.config.rate_adaptation else None
+            self.transmit_later(TX_DATA, "data", 0, messages=[message], broadcast=True, rate=self.rate)
+        else:
+            # The data frame is put together now, so that the RTS can tell how long the whole exchange takes
+            messages = self.prepare_data()
+            # The data bits of every message follow its sender address and 2-bit message id
+            lengths = [len(message[0]) - len(self.config.node_id) - 2 for message in messages]
+            duration = (3 * self.config.turnaround_time + control_airtime(self.config) + data_airtime(self.config, lengths, self.rate)
+                        + ack_airtime(self.config))
+            self.transmit_later(TX_RTS, "rts", 0, dest=self.address(message[1]), duration=encode_duration(duration, self.config))
+
+    def on_transmitted(self) -> None:
+        """Called once the frame sent in a transmit state has been played"""
+        if self.state == TX_RTS:
+            self.wait_for(WAIT_CTS, self.config.preamble_wait_time)
+        elif self.state == TX_DATA:
+            if self.broadcast:
+                # Every other node acknowledges in turn with its own ending tone
+                self.expected_acks = {"ending_" + node for node in self.config.ending_signals_map
+                                      if node != self.config.node_id and int(node, 2) <= self.config.num_nodes}
+                self.wait_for(WAIT_ACK, self.config.end_wait_time * max(1, len(self.expected_acks)))
+            else:
+                self.wait_for(WAIT_ACK, self.config.end_wait_time)
+        elif self.state == TX_CTS:
+            self.wait_for(RX_DATA, self.config.preamble_wait_time)
+        elif self.state == TX_ACK and self.rx_more:
+            # Burst mode: the next fragment follows the acknowledgement without a new RTS/CTS
+            self.rx_more = False
+            self.wait_for(RX_DATA, self.config.preamble_wait_time)
+        elif self.state == TX_ACK:
+            self.rest()
+
+    def on_wait_expired(self, state : str) -> None:
+        """Called when a wait state lasted too long"""
+        self.response_timer = None
+        if state != self.state:
+            return
+        self.node.notify("timeout", state=state)
+        if state == DEFER and self.channel_busy and not self.nav:
+            # The exchange (e.g. an aggregate) outlasts the defer: keep quiet until its acknowledgement
+            self.wait_for(DEFER, self.config.end_wait_time)
+            return
+        if state == WAIT_CTS or (state == WAIT_ACK and self.broadcast):
+            self.collision()
+        elif state == WAIT_ACK:
+            self.report_rate(False)
+            self.requeue()
+        self.rest()
+
+    def on_frame(self, event) -> None:
+        """Called with every FrameEvent decoded from the channel"""
+        if event.kind not in ("symbol", "header"):
+            self.node.notify("frame", frame=event.kind, data=event.data)
+        handler = getattr(self, "on_" + event.kind, None)
+        if handler is not None and self.state not in TX_STATES:
+            handler(event.data)
+
+    def on_preamble(self, data : dict) -> None:
+        """A preamble was heard"""
+        if self.state in (IDLE, BACKOFF):
+            if data["type"] == "rts":
+                self.set_state(RX_RTS)
+            elif data["type"] == "broadcast":
+                self.peer = ""
+                self.rx_failed = False
+                self.set_state(RX_DATA)
+        elif self.state == RX_DATA and data["type"] in ("message", "aggregate"):
+            self.rx_failed = False
+            self.rx_sender = None
+            self.rx_more = False
+            # The data frame has started, the demodulator reports its end (or its timeout) from now on
+            self.cancel_response_timer()
+
+    def on_rts(self, data : dict) -> None:
+        """An RTS was decoded"""
+        if self.state != RX_RTS:
+            return
+        if data["receiver"] == self.config.node_id or data["receiver"] == "00":
+            if self.config.nav_symbols and data["duration"] is None:
+                # The CTS could not tell the others how long to defer, the sender will try again
+                self.rest()
+                return
+            self.peer = data["sender"]
+            duration = ""
+            if self.config.nav_symbols:
+                # What is left of the exchange after the turnaround and the CTS itself
+                duration = encode_duration(data["duration"] - self.config.turnaround_time - control_airtime(self.config), self.config)
+            self.transmit_later(TX_CTS, "cts", self.config.turnaround_time, cts_message=self.config.node_id + data["sender"] + duration)
+        else:
+            # Someone else's exchange: stay quiet until it is over
+            self.defer(data["duration"])
+
+    def defer(self, duration : float) -> None:
+        """
+        Stays quiet during someone else's exchange: for the duration it advertised, or until its acknowledgement (at
+        most end_wait_time) when it advertised none or one too long for the duration field (math.inf)
+        """
+        if duration is None or duration == math.inf:
+            self.nav = False
+            self.wait_for(DEFER, self.config.end_wait_time)
+            return
+        if self.state == DEFER and self.nav and self.response_timer is not None and self.response_timer.remaining(self.scheduler.clock()) >= duration:
+            # An earlier RTS or CTS already reserved the channel for longer
+            return
+        self.nav = True
+        self.wait_for(DEFER, duration)
+
+    def on_cts(self, data : dict) -> None:
+        """A CTS was decoded"""
+        if self.state == WAIT_CTS and data["receiver"] == self.config.node_id:
+            self.backoff.on_success()
+            self.transmit_later(TX_DATA, "data", self.config.turnaround_time, messages=self.node.current_aggregate, broadcast=False, rate=self.rate)
+        elif self.state == WAIT_CTS:
+            self.requeue()
+            self.defer(data["duration"])
+        elif self.state in (IDLE, BACKOFF, DEFER) and data["duration"] is not None:
+            # The CTS of an exchange whose RTS we did not hear (e.g. a hidden node's)
+            self.defer(data["duration"])
+
+    def prepare_data(self) -> list:
+        """Picks the rate and the messages sent with the current message to its destination, and returns the messages"""
+        self.rate = self.rates.choose(self.message[1]) if self.config.rate_adaptation else None
+        # Every message queued for the same destination goes in this exchange, up to max_aggregate
+        # (the number of subframes is sent as one 4-bit symbol), or only the ones of the unacknowledged data frame
+        accept = None
+        if self.arq is not None:
+            accept = lambda message: self.arq.send_window(message[1]).sendable(message[2])
+        return self.node.aggregate_messages(self.resend or min(self.config.max_aggregate, 15), accept)
+
+    def send_data(self) -> None:
+        """Sends the current message, with every message that can go in the same exchange, to its destination"""
+        messages = self.prepare_data()
+        self.transmit_later(TX_DATA, "data", self.config.turnaround_time, messages=messages, broadcast=False, rate=self.rate)
+
+    def on_payload(self, data : dict) -> None:
+        """A data frame was decoded"""
+        if self.state == DEFER:
+            # Someone else's burst goes on after its acknowledgement
+            self.rx_more = bool(data.get("more_fragments"))
+            return
+        if self.state != RX_DATA:
+            return
+        selective = self.arq is not None and data["type"] != "broadcast"
+        fragment = None
+        if self.config.fragmentation:
+            fragment = (data["fragment"], data["more_fragments"])
+        if "?" in data["message"] or (fragment is not None and None in fragment):
+            # The message was not received properly, ignore it
+            self.rx_failed = True
+        elif selective:
+            # Messages are released in order, each one once, as the gaps before them are filled
+            self.rx_sender = data["sender"]
+            self.rx_more = bool(data.get("more_fragments"))
+            window = self.arq.receive_window(data["sender"])
+            for message, message_id, sequence, fragment in window.receive(data["sequence"], (data["message"], data["message_id"], data["sequence"], fragment)):
+                self.node.message_received(message, data["sender"], message_id, sequence, fragment)
+        else:
+            self.rx_more = bool(data.get("more_fragments"))
+            self.node.message_received(data["message"], data["sender"], data["message_id"], None, fragment,
+                                      data.get("subframe", 0), data.get("subframes", 1))
+        if data.get("subframe", 0) + 1 < data.get("subframes", 1):
+            # More subframes of the aggregate follow, it is acknowledged as a whole after the last one
+            return
+        if selective:
+            self.send_block_ack()
+            return
+        if self.rx_failed:
+            self.rx_failed = False
+            self.rx_more = False
+            self.rest()
+            return
+        if data["type"] != "broadcast":
+            self.transmit_later(TX_ACK, "ack", self.config.turnaround_time, freq=self.config.ending_freq)
+            return
+        # Broadcast acknowledgements are staggered so that they do not overlap: one symbol per receiver numbered below us
+        receivers_before = sum(1 for node in range(1, int(self.config.node_id, 2)) if node != data["sender"])
+        delay = self.config.turnaround_time + receivers_before * self.config.Bit_duration
+        self.transmit_later(TX_ACK, "ack", delay, freq=self.config.ending_signals_map[self.config.node_id])
+
+    def send_block_ack(self) -> None:
+        """Acknowledges the subframes received from rx_sender with the state of its receive window"""
+        if self.rx_sender is None:
+            # Nothing could be decoded, the sender will time out and send everything again
+            self.rest()
+            return
+        window = self.arq.receive_window(self.rx_sender)
+        bits = encode_block_ack(self.config.node_id, self.address(self.rx_sender), window.base, window.bitmap())
+        self.rx_failed = False
+        self.rx_sender = None
+        self.transmit_later(TX_ACK, "block_ack", self.config.turnaround_time, bits=bits)
+
+    def on_block_ack(self, data : dict) -> None:
+        """A block acknowledgement was decoded: the acknowledged subframes are delivered and only the others are sent again"""
+        if self.state == DEFER:
+            self.end_defer()
+            return
+        if self.state != WAIT_ACK or self.broadcast or self.arq is None or data["receiver"] != self.config.node_id:
+            return
+        if data["sender"] != self.address(self.message[1]):
+            return
+        messages = self.node.current_aggregate
+        received = self.arq.send_window(self.message[1]).acknowledge(data["start"], data["bitmap"], [message[2] for message in messages])
+        for success in received:
+            self.report_rate(success)
+        if any(received):
+            self.node.message_delivered([message for message, success in zip(messages, received) if success])
+        if not all(received):
+            self.node.requeue_current_message([message for message, success in zip(messages, received) if not success], front=True)
+        self.message = None
+        if all(received) and self.burst(messages):
+            return
+        self.rest()
+
+    def end_defer(self) -> None:
+        """Someone else's exchange was acknowledged; a burst keeps the channel reserved for its next fragment"""
+        if self.rx_more:
+            self.rx_more = False
+            self.nav = False
+            self.wait_for(DEFER, self.config.end_wait_time)
+        else:
+            self.rest()
+
+    def on_ending(self, data : dict) -> None:
+        """An ending (acknowledgement) tone was heard"""
+        if self.state == DEFER and data["label"] == "ending":
+            self.end_defer()
+        elif self.state == WAIT_ACK and not self.broadcast and self.arq is None and data["label"] == "ending":
+            self.report_rate(True)
+            messages = self.node.current_aggregate
+            self.delivered()
+            if not self.burst(messages):
+                self.rest()
+        elif self.state == WAIT_ACK and self.broadcast:
+            self.expected_acks.discard(data["label"])
+            if not self.expected_acks:
+                self.delivered()
+                self.rest()
+
+    def on_error(self, data : dict) -> None:
+        """A frame could not be decoded"""
+        if self.state == WAIT_CTS and data["type"] == "cts":
+            self.requeue()
+            self.rest()
+        elif self.state == RX_DATA and self.rx_sender is not None:
+            # Selective repeat: the subframes decoded before the error are still acknowledged
+            self.send_block_ack()
+        elif self.state in (RX_RTS, RX_DATA):
+            self.rest()
+
+    def on_timeout(self, data : dict) -> None:
+        """The demodulator gave up on a frame whose symbols never came"""
+        if self.state == RX_DATA and self.rx_sender is not None:
+            self.send_block_ack()
+        elif self.state in (RX_RTS, RX_DATA):
+            self.rest()
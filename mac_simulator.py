@@ -0,0 +1,385 @@
+"""
+Discrete-event simulator of the MAC at the frame level: the real MacStateMachine of every node runs on a virtual clock,
+and frames occupy a shared medium for their airtime instead of being played and decoded
+"""
+import heapq
+import itertools
+import math
+import random
+from collections import Counter
+from config import Config
+from node import Node
+from demodulator import FrameEvent
+from arq import decode_block_ack
+from nav import decode_duration
+from airtime import ack_airtime, control_airtime, data_airtime, data_modulation, preamble_airtime, subframe_airtime
+
+
+def address_bits(num_nodes : int) -> int:
+    """Returns the width of the node addresses needed for num_nodes nodes (2 bits for up to 3 nodes, as on air)"""
+    return max(2, num_nodes.bit_length())
+
+
+def make_traffic(params : dict, duration : float, rng, message_bits : int = 15) -> list:
+    """
+    Returns, for every node, the sorted (arrival time, payload, destination) of its messages (Poisson arrivals of 1 to
+    message_bits bits)
+    """
+    traffic = []
+    for node in range(params["nodes"]):
+        arrivals = []
+        t = rng.exponential(1 / params["load"]) if params["load"] > 0 else duration
+        while t < duration:
+            payload = "".join(rng.choice(["0", "1"], size=rng.integers(1, message_bits + 1)))
+            if rng.random() < params["broadcast"]:
+                dest = 0
+            else:
+                dest = int(rng.choice([other for other in range(1, params["nodes"] + 1) if other != node + 1]))
+            arrivals.append((t, payload, dest))
+            t += rng.exponential(1 / params["load"])
+        traffic.append(arrivals)
+    return traffic
+
+
+class Frame:
+    """
+    A class used to represent a frame on the simulated medium
+
+
+    Attributes
+    ----------
+    sender : SimNode
+        Node sending the frame
+    kind : str
+        Preamble type ("rts", "cts", "message", "broadcast", "aggregate" or "block_ack"), or "ending" for a tone
+    start : float
+        Time the frame starts
+    end : float
+        Time the frame ends
+    parts : list[tuple[float, float, str, dict]]
+        (start, end, event kind, event data) of every event a receiver gets at the end of that part of the frame, if
+        nothing else was heard during it
+    """
+
+    def __init__(self, sender, kind : str, start : float, end : float, parts : list) -> None:
+        """Initialises the member variables of the class"""
+        self.sender = sender
+        self.kind : str = kind
+        self.start : float = start
+        self.end : float = end
+        self.parts : list = parts
+
+
+class Reception:
+    """
+    A class used to represent a frame being received by one node
+
+
+    Attributes
+    ----------
+    frame : Frame
+        Frame being received
+    interference : list[tuple[float, float]]
+        Intervals during which something else was on the air (or the node itself was sending)
+    dropped : bool
+        Whether the preamble was missed, so that nothing more of the frame is reported
+    """
+
+    def __init__(self, frame : Frame, interference : list = None) -> None:
+        """Initialises the member variables of the class"""
+        self.frame = frame
+        self.interference : list = interference or []
+        self.dropped : bool = False
+
+    def clean(self, start : float, end : float) -> bool:
+        """Checks that nothing interfered with the frame between start and end"""
+        return all(stop <= start or begin >= end for begin, stop in self.interference)
+
+
+class SimNode(Node):
+    """
+    A class used to represent a node of the simulator: transmit() puts the frame on the simulated medium for its
+    airtime, and the simulator feeds the MAC with the frame events and the clear channel assessment of the medium
+
+    Attributes
+    ----------
+    simulator : MacSimulator
+        Simulator owning the medium and the virtual clock
+    number : int
+        Node number (1 and up)
+    transmitting : bool
+        Whether a frame of the node is on the air
+    receptions : list[Reception]
+        Frames the node is receiving
+    airtime : Counter
+        Seconds spent transmitting, per kind of frame (rts, cts, data, ack, block_ack) and payload (data bits only)
+    phase : float
+        Offset of the node's hunting frames, which do not line up with the other nodes'
+    """
+
+    def __init__(self, simulator, number : int, config : Config) -> None:
+        """Initialises the member variables of the class"""
+        config.node_id = bin(number)[2:].zfill(address_bits(config.num_nodes))
+        super().__init__(config, simulator.clock, buffer_file=None, verbose=False)
+        self.simulator = simulator
+        self.number : int = number
+        self.transmitting : bool = False
+        self.receptions = []
+        self.airtime = Counter()
+        self.phase : float = 0.0
+        # Reproducible runs: every random draw of the MAC comes from the simulator's generator
+        self.mac.backoff.rng = simulator.rng
+        self.mac.rates.rng = simulator.rng
+
+    def transmit(self, kind : str, data : dict) -> None:
+        """Puts a frame of the MAC ("rts", "cts", "data", "ack" or "block_ack") on the medium"""
+        config = self.config
+        width = len(config.node_id)
+        now = self.clock()
+        body = now + preamble_airtime(config)
+        if kind in ("rts", "cts"):
+            bits = config.node_id + data["dest"] + data["duration"] if kind == "rts" else data["cts_message"]
+            duration = decode_duration(bits[2 * width:], config) if config.nav_symbols else None
+            end = now + control_airtime(config)
+            frame = Frame(self, kind, now, end, [(body, end, kind, {"sender": bits[:width], "receiver": bits[width:2 * width], "duration": duration})])
+        elif kind == "data":
+            frame = self.data_frame(data["messages"], data["broadcast"], data["rate"])
+        elif kind == "ack":
+            label = "ending"
+            if data["freq"] != config.ending_freq:
+                label = "ending_" + next(node for node, freq in config.ending_signals_map.items() if freq == data["freq"])
+            end = now + config.Ending_duration
+            frame = Frame(self, "ending", now, end, [(now, now + config.ending_detection_duration, "ending", {"label": label})])
+        else:
+            end = now + ack_airtime(config)
+            frame = Frame(self, kind, now, end, [(body, end, kind, decode_block_ack(data["bits"], config.arq_window, width))])
+        self.airtime[kind] += frame.end - frame.start
+        self.notify("transmit", frame=kind)
+        self.transmitting = True
+        self.simulator.send(frame)
+
+    def data_frame(self, messages : list, broadcast : bool, rate : int) -> Frame:
+        """Returns the data frame (or aggregate) holding messages, with one payload event per subframe"""
+        config = self.config
+        width = len(config.node_id)
+        kind = "broadcast" if broadcast else "message" if len(messages) == 1 else "aggregate"
+        now = self.clock()
+        end = now + data_airtime(config, [len(self.payload(message)) for message in messages], rate)
+        # An aggregate starts with its number of subframes
+        start = now + preamble_airtime(config) + (config.Symbol_duration if kind == "aggregate" else 0)
+        symbol_duration, groups = data_modulation(config, rate)
+        parts = []
+        for index, message in enumerate(messages):
+            bits = self.payload(message)
+            stop = start + subframe_airtime(config, len(bits), rate)
+            payload = {"type": kind, "sender": self.number, "message_id": int(message[0][width:width + 2], 2),
+                       "rate": (rate or 0) if config.rate_adaptation else None, "sequence": message[2],
+                       "fragment": message[3][0] if message[3] is not None else None,
+                       "more_fragments": message[3][1] if message[3] is not None else None, "message": bits}
+            if kind == "aggregate":
+                payload["subframe"] = index
+                payload["subframes"] = len(messages)
+            parts.append((start, stop, "payload", payload))
+            self.airtime["payload"] += math.ceil(len(bits) / (4 * groups)) * symbol_duration
+            self.notify("sent", message=bits, dest=message[1], rate=rate, ticket=message[4])
+            start = stop
+        return Frame(self, kind, now, end, parts)
+
+
+class MacSimulator:
+    """
+    A class used to represent a frame-level discrete-event simulation of nodes sharing one channel.
+    Time jumps from one event (a frame starting, being sensed or ending, a message arriving, a timer of a MAC) to the
+    next, so hours of protocol run in seconds. Every node runs the real MacStateMachine; the medium replaces the
+    audio: a frame is heard by a node that is not sending if no other frame was on the air at its start, and each part
+    of it (addresses, subframes, ending tone) is decoded only if nothing else was on the air meanwhile. Ending tones
+    have their own frequencies, so they only collide with frames.
+    Addresses are widened past 2 bits for more than 3 nodes.
+
+
+    Attributes
+    ----------
+    now : float
+        Virtual time in seconds
+    nodes : list[SimNode]
+        The nodes, node i + 1 at index i
+    on_air : list[Frame]
+        Frames being sent
+    sensed : list[Frame]
+        Frames that the clear channel assessment of the other nodes can still detect (until no hunting frame can hold them any more)
+    events : list
+        Heap of the pending (time, priority, counter, callback, args) events of the medium and the traffic
+    timers : list
+        Heap of the (deadline, node number, node) of the earliest timer of every node (and of outdated ones)
+    awake : set[SimNode]
+        Nodes concerned by the current events, whose timers, then clear channel assessment, are run once they are over
+    rng : random.Random
+        Source of every random draw (backoff, rate sampling, frame errors)
+    frame_error_rate : float
+        Probability that a clean part of a frame is still not decoded (noise)
+    hunt : float
+        Length of a hunting frame: a node assesses the channel once per hunting frame, at its own phase
+    cca_window : float
+        Length of the clear channel assessment window that ends every hunting frame: a frame is busy from the first
+        window it fills to the last one it overlaps
+    hidden : set[frozenset]
+        Pairs of node numbers that cannot hear each other
+    """
+
+    def __init__(self, num_nodes : int, config_factory = Config, seed : int = 0, frame_error_rate : float = 0.0,
+                 hidden : list = ()) -> None:
+        """Initialises the member variables of the class"""
+        self.now : float = 0.0
+        self.events = []
+        self.timers = []
+        self.awake = set()
+        self.counter = itertools.count()
+        self.rng = random.Random(seed)
+        self.frame_error_rate : float = frame_error_rate
+        self.on_air = []
+        self.sensed = []
+        self.hidden = {frozenset(pair) for pair in hidden}
+        self.nodes = []
+        for number in range(1, num_nodes + 1):
+            config = config_factory()
+            config.num_nodes = num_nodes
+            width = address_bits(num_nodes)
+            # Only the labels of the ending tones matter here: nodes past 3 get made-up frequencies
+            config.ending_signals_map = {bin(other)[2:].zfill(width): config.ending_signals_map.get(bin(other)[2:].zfill(2), 10000 + other)
+                                         for other in range(1, num_nodes + 1)}
+            self.nodes.append(SimNode(self, number, config))
+        config = self.nodes[0].config if self.nodes else Config()
+        self.hunt : float = config.Preamble_duration
+        self.cca_window : float = config.cca_window
+        for node in self.nodes:
+            node.phase = self.rng.uniform(0, self.hunt)
+
+    def clock(self) -> float:
+        """Returns the virtual time"""
+        return self.now
+
+    def schedule(self, at : float, callback, *args, priority : int = 1) -> None:
+        """Runs callback(*args) at virtual time at (lower priorities first among events at the same time)"""
+        heapq.heappush(self.events, (at, priority, next(self.counter), callback, args))
+
+    def add_traffic(self, traffic : list) -> None:
+        """Schedules the (arrival time, payload, destination) messages of every node (make_traffic)"""
+        for node, arrivals in zip(self.nodes, traffic):
+            for at, payload, dest in arrivals:
+                self.schedule(at, self.arrive, node, payload, str(dest))
+
+    def arrive(self, node : SimNode, payload : str, dest : str) -> None:
+        """Queues a new message on a node"""
+        node.queue_message(payload, dest, next(node.tickets))
+        self.awake.add(node)
+
+    def hears(self, sender : SimNode, node : SimNode) -> bool:
+        """Checks if node hears what sender sends"""
+        return not self.hidden or frozenset((sender.number, node.number)) not in self.hidden
+
+    def send(self, frame : Frame) -> None:
+        """Puts a frame on the air and schedules what every other node hears of it"""
+        for node in self.nodes:
+            if node is frame.sender:
+                # Half duplex: a node sending hears nothing of what it was receiving
+                for reception in node.receptions:
+                    reception.interference.append((frame.start, frame.end))
+                continue
+            if not self.hears(frame.sender, node):
+                continue
+            for reception in node.receptions:
+                if frame.kind != "ending" or reception.frame.kind != "ending":
+                    reception.interference.append((frame.start, frame.end))
+            if node.transmitting:
+                continue
+            audible = [other for other in self.on_air if self.hears(other.sender, node)]
+            if frame.kind == "ending":
+                reception = Reception(frame, [(other.start, other.end) for other in audible if other.kind != "ending"])
+            elif audible:
+                # The preamble is lost in the frame already on the air
+                continue
+            else:
+                reception = Reception(frame)
+                self.schedule(frame.start + preamble_airtime(node.config), self.deliver, node, reception, None)
+            node.receptions.append(reception)
+            for index in range(len(frame.parts)):
+                self.schedule(frame.parts[index][1], self.deliver, node, reception, index)
+        self.on_air.append(frame)
+        self.sensed.append(frame)
+        # Wakes every other node up at the assessments that notice the start and the end of the frame
+        for node in self.nodes:
+            if node is not frame.sender:
+                self.schedule(self.next_assessment(node, frame.start + self.cca_window), self.awake.add, node)
+                self.schedule(self.next_assessment(node, frame.end + self.cca_window), self.awake.add, node)
+        self.schedule(frame.end, self.finish, frame, priority=0)
+        self.schedule(frame.end + 2 * self.hunt, self.sensed.remove, frame, priority=2)
+
+    def finish(self, frame : Frame) -> None:
+        """Takes a frame off the air and tells its sender (which, unlike the others, knows at once)"""
+        self.on_air.remove(frame)
+        self.awake.add(frame.sender)
+        frame.sender.transmitting = False
+        frame.sender.notify("transmitted")
+        frame.sender.mac.on_transmitted()
+
+    def deliver(self, node : SimNode, reception : Reception, index : int) -> None:
+        """Passes the preamble (index None) or a part of a frame to the MAC of a receiver, if it was heard"""
+        if reception.dropped:
+            return
+        self.awake.add(node)
+        frame = reception.frame
+        if index is None:
+            if not reception.clean(frame.start, frame.start + preamble_airtime(node.config)):
+                reception.dropped = True
+                node.receptions.remove(reception)
+                return
+            node.mac.on_frame(FrameEvent("preamble", {"type": frame.kind}, 0))
+            return
+        start, end, kind, data = frame.parts[index]
+        clean = reception.clean(start, end) and self.rng.random() >= self.frame_error_rate
+        if index + 1 == len(frame.parts):
+            node.receptions.remove(reception)
+        if kind == "payload" and not clean:
+            data = dict(data, message="?" * max(len(data["message"]), 1))
+        elif not clean and kind == "ending":
+            return
+        elif not clean:
+            kind, data = "error", {"type": frame.kind}
+        node.mac.on_frame(FrameEvent(kind, data, 0))
+
+    def busy(self, node : SimNode) -> bool:
+        """Clear channel assessment of a node: whether the window ending its latest hunting frame held a frame of another node"""
+        assessed = self.next_assessment(node, self.now - self.hunt + 1e-9)
+        # With the same tolerance as the assessments the nodes are woken up at
+        return any(frame.sender is not node and frame.start + self.cca_window - 1e-9 <= assessed < frame.end + self.cca_window - 1e-9
+                   and self.hears(frame.sender, node) for frame in self.sensed)
+
+    def next_assessment(self, node : SimNode, at : float) -> float:
+        """Returns the end of the first hunting frame of node that ends at or after at"""
+        return node.phase + math.ceil((at - node.phase) / self.hunt - 1e-9) * self.hunt
+
+    def run(self, until : float) -> None:
+        """Runs the simulation up to virtual time until"""
+        while True:
+            while self.timers and self.timers[0][0] != self.timers[0][2].scheduler.next_deadline():
+                heapq.heappop(self.timers)
+            upcoming = [queue[0][0] for queue in (self.events, self.timers) if queue]
+            if not upcoming or min(upcoming) > until:
+                self.now = until
+                return
+            self.now = max(self.now, min(upcoming))
+            while self.events and self.events[0][0] <= self.now:
+                _, _, _, callback, args = heapq.heappop(self.events)
+                callback(*args)
+            while self.timers and self.timers[0][0] <= self.now:
+                self.awake.add(heapq.heappop(self.timers)[2])
+            # In node order, so that runs are reproducible
+            awake = sorted(self.awake, key=lambda node: node.number)
+            self.awake.clear()
+            for node in awake:
+                node.scheduler.run_due()
+            for node in awake:
+                node.mac.on_channel(self.busy(node))
+                deadline = node.scheduler.next_deadline()
+                if deadline is not None:
+                    heapq.heappush(self.timers, (deadline, node.number, node))
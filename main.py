@@ -4,464 +4,192 @@
 from config import Config
 from sender import Sender
 from receiver import Receiver
-from queue import Queue
-import os
+from audio_engine import AudioEngine
+from decode_worker import DecodeWorker
+from capture import CaptureRecorder
+from audio_formats import paFloat32, paInt16
+from node import Node, get_ntp_timestamp
 import time
-import pyaudio
-import random
-import ntplib
-import socket
-import datetime
+import numpy as np
 import warnings
 warnings.filterwarnings("ignore")
 
 
-def get_ntp_timestamp():
-    """Get the timestamp."""
-    try:
-        socket.setdefaulttimeout(0.5)
-        current_time = datetime.datetime.now()  # Returns current system time
-        return (current_time.strftime('%H:%M:%S'))
-        # client = ntplib.NTPClient()
-        # response = client.request('pool.ntp.org')
-        # time_string = time.strftime('%H:%M:%S', time.localtime(response.tx_time))
-        return time_string
-    except:
-        current_time = datetime.datetime.now()  # Returns current system time
-        return (current_time.strftime('%H:%M:%S'))
-
-
-class Main:
+class Main(Node):
     """
     A class used to represent the main class that sends and receives the message
+    Its message queue, delivery and MAC are those of Node; this class plays its frames and decodes the capture.
 
     Attributes
     ----------
-    config : Config
-        The configuration object that contains the parameters for the sender and receiver
     sender : Sender
         The sender object that sends the message
     receiver : Receiver
         The receiver object that receives the message
+    engine : AudioEngine
+        The persistent duplex audio stream, opened on the given audio backend (pyaudio by default)
+    clock : function
+        Returns the current time in seconds on a monotonic clock (the backend's virtual clock for the simulated channel)
+    demodulator : StreamingDemodulator
+        Decodes frames from the capture, one short frame per iteration of the main loop (without a decode worker)
+    decoder : DecodeWorker
+        Thread that decodes the capture instead, when the engine captures from its own callback thread and
+        Config.decode_thread is set (None otherwise)
+    recorder : CaptureRecorder
+        Records the capture and the MAC states, when Config.capture_file is set (None otherwise)
     """
-    def __init__(self) -> None:
+    def __init__(self, audio = None, node_id : str = None, buffer_file : str = ".buffer", config : Config = None, verbose : bool = True) -> None:
         """Initialises the member variables of the class"""
-        self.config = Config()
-        self.sender = Sender()
-        self.receiver = Receiver()
-        self.all_messages_received = set()
-        self.has_msg_to_send = False
-        self.is_channel_busy = False
-        self.current_wait_time = 0
-        self.buffer_file = ".buffer"
-        self.last_modified_time = os.path.getmtime(self.buffer_file)
-        self.current_message_queue = Queue()
-        self.p = pyaudio.PyAudio() 
-        self.last_line_number = 0
-        self.current_message_id = 0
-        if os.path.exists(self.buffer_file):
-            with open(self.buffer_file, 'r') as file:
-                self.last_line_number = len(file.readlines())
-    def return_stream_pre(self, stream):
-        """Returns the stream to the preamble state"""
-        stream.stop_stream()
-        stream.close()
-        stream = self.p.open(format=pyaudio.paInt16,
+        super().__init__(config, getattr(audio, "time", time.monotonic), buffer_file, verbose)
+        self.sender = Sender(self.config)
+        self.receiver = Receiver(self.config)
+        self.node_id = node_id
+        self.receiver.clock = self.clock
+        self.engine = AudioEngine(self.config, audio)
+        self.demodulator = self.receiver.demodulator()
+        self.decoder = None
+        if self.engine.callback_mode and self.config.decode_thread:
+            self.decoder = DecodeWorker(self.receiver, self.engine, self.config.event_queue_size)
+            if self.metrics is not None:
+                self.decoder.frame_cpu = lambda seconds: self.metrics.observe("dsp_frame_cpu_seconds", seconds)
+        self.recorder = None
+        self.transmitting = False
+
+    def transmit(self, kind : str, data : dict) -> None:
+        """
+        Queues a frame of the MAC ("rts", "cts", "data", "ack" or "block_ack") for playback without waiting for it to be played;
+        the main loop tells the MAC once it has been
+        """
+        stream = self.engine.open(format=paFloat32,
             channels=1,
             rate=self.config.Sample_rate,
-            input=True,
-            frames_per_buffer=int(self.config.Sample_rate * self.config.Preamble_duration))
-        return stream
-    def freq_is_preamble(self, freq: int) -> bool:
-        """Checks if the frequency is a preamble frequency"""
-        return abs(freq - self.config.rts_preamble_freq) < self.config.Threshold
+            output=True)
+        self.notify("transmit", frame=kind)
+        if kind == "rts":
+            self.sender.send_preamble(stream, self.config.rts_preamble_freq)
+            self.sender.send_rts(stream, rts_message=self.config.node_id + data["dest"] + data["duration"])
+        elif kind == "cts":
+            self.sender.send_preamble(stream, self.config.cts_preamble_freq)
+            self.sender.send_cts(stream, cts_message=data["cts_message"])
+        elif kind == "data":
+            messages = data["messages"]
+            if data["broadcast"]:
+                self.sender.send_preamble(stream, self.config.broadcast_preamble_freq)
+                self.sender.send_message(stream, messages[0][0], data["rate"], messages[0][2], messages[0][3])
+            elif len(messages) == 1:
+                self.sender.send_preamble(stream, self.config.message_preamble_freq)
+                self.sender.send_message(stream, messages[0][0], data["rate"], messages[0][2], messages[0][3])
+            else:
+                self.sender.send_preamble(stream, self.config.aggregate_preamble_freq)
+                self.sender.send_aggregate(stream, [message[0] for message in messages], data["rate"],
+                                           [message[2] for message in messages], [message[3] for message in messages])
+            for message in messages:
+                if self.verbose:
+                    print("[SENT]: ", self.payload(message), " ", message[1], " ", get_ntp_timestamp())
+                self.notify("sent", message=self.payload(message), dest=message[1], rate=data["rate"], ticket=message[4])
+        elif kind == "ack":
+            self.sender.send_ending_signal(stream, freq=data["freq"])
+        elif kind == "block_ack":
+            self.sender.send_block_ack(stream, data["bits"])
+        stream.close()
+        self.transmitting = True
 
-    def freq_is_broadcast(self, freq: int) -> bool:
-        """Checks if the frequency is a broadcast frequency"""
-        return abs(freq - self.config.broadcast_preamble_freq) < self.config.Threshold
-    
-    def has_new_message(self) -> bool:
+    def decode(self, stream):
         """
-        Checks if the .buffer file has a new message by comparing
-        its last modified time.
+        Returns the frame events and clear channel assessment of the next short frame of capture: decoded here, or
+        taken from the decode worker (None if it has nothing before the next timer is due)
         """
-        if os.path.exists(self.buffer_file):
-            modified_time = os.path.getmtime(self.buffer_file)
-            if modified_time > self.last_modified_time:
-                self.last_modified_time = modified_time
-                return True
-        return False
-    
-    def wait_random(self):
-        """Returns a random wait time following exponential backoff"""
-        return (random.randint(1,2**self.config.num_collisions))*self.config.collision_wait_time*int(self.config.node_id, 2)
-    
-    def read_message(self) -> str:
-        """Reads the latest message from the .buffer file"""
-        with open(self.buffer_file, 'r') as file:
-            lines = file.readlines()
-            for i in range(self.last_line_number, len(lines)):
-                our_line = lines[i].split(" ")
-                if our_line[1] != "-1\n":
-                    our_line[0] = self.config.node_id + str(bin(self.current_message_id)[2:].zfill(2)) + our_line[0]
-                    self.current_message_queue.put((our_line[0], our_line[1]))
-                    self.current_message_id += 1
-            self.last_line_number = len(lines)
-    
-    def is_message_broadcast(self, message) -> bool:
-        """Checks if the message is a broadcast message"""
-        if message[1] == "0\n":
-            return True
-        return False
-    
-    def __call__(self) -> None:
-        """The main function that sends and receives messages"""
-        # Take node id as input
-        self.config.node_id = str(bin(int(input("Enter the node id: ")))[2:].zfill(2))
-        stream = self.p.open(format=pyaudio.paInt16,
+        if self.decoder is None:
+            data = stream.read(self.demodulator.hunt_length)
+            if self.metrics is None:
+                events = list(self.demodulator.feed(np.frombuffer(data, dtype=np.int16)))
+            else:
+                start = time.thread_time()
+                events = list(self.demodulator.feed(np.frombuffer(data, dtype=np.int16)))
+                self.metrics.observe("dsp_frame_cpu_seconds", time.thread_time() - start)
+            return events, self.demodulator.busy
+        timeout = self.config.Preamble_duration
+        deadline = self.scheduler.next_deadline()
+        if deadline is not None:
+            timeout = max(0.0, min(timeout, deadline - self.clock()))
+        return self.decoder.get(timeout)
+
+    def step(self, stream) -> None:
+        """
+        Runs one iteration of the main loop: the expired timers, then either the end of our own transmission or
+        one short frame of capture, whose frame events and clear channel assessment are passed to the MAC
+        """
+        self.scheduler.run_due()
+        if self.transmitting:
+            if self.engine.transmitting():
+                self.engine.tx_done.wait(0.01)
+                return
+            # Whatever the microphone heard while we were transmitting is our own signal
+            if self.decoder is None:
+                self.engine.discard_transmission()
+                self.demodulator.clear()
+            else:
+                self.decoder.restart()
+            self.transmitting = False
+            self.notify("transmitted")
+            self.mac.on_transmitted()
+            return
+        decoded = self.decode(stream)
+        if decoded is None:
+            return
+        events, busy = decoded
+        for event in events:
+            self.mac.on_frame(event)
+        self.mac.on_channel(busy)
+
+    def open(self):
+        """Sets the node id (asked for if none was given), opens and calibrates the capture and returns its stream"""
+        if self.node_id is None:
+            self.node_id = input("Enter the node id: ")
+        self.config.node_id = str(bin(int(self.node_id))[2:].zfill(2))
+        if self.config.capture_file:
+            self.recorder = CaptureRecorder(self.config.capture_file.format(node=self.config.node_id), self.config.Sample_rate,
+                                            self.clock, node=self.node_id)
+            self.engine.recorder = self.recorder
+            # Nothing captured before the recording is decoded, so that a replay calibrates on the same samples
+            self.engine.capture.discard_until(self.engine.capture.write_index)
+            self.listeners.append(self.recorder.on_event)
+        stream = self.engine.open(format=paInt16,
                     channels=1,
                     rate=self.config.Sample_rate,
                     input=True,
                     frames_per_buffer=int(self.config.Sample_rate * self.config.Preamble_duration))
-        while True:
-            # Run in an infinite loop to keep sending and receiving messages
-            if not self.current_message_queue.empty():
-                self.has_msg_to_send = True
-            if self.has_new_message():
-                # print("New message detected!")
-                self.read_message()
-                if not self.current_message_queue.empty():
-                    self.has_msg_to_send = True
-                else:
-                    self.has_msg_to_send = False
-            current_freq = self.receiver.return_freq(receieve_stream=stream)
-            self.current_wait_time -= self.config.Preamble_duration
-            # If broadcast preamble received:
-            if self.freq_is_broadcast(current_freq):
-                # print("Preamble Started.")
-                timed_out = self.receiver.receive_preamble(self.config.Preamble_length-1, stream, self.config.broadcast_preamble_freq)
-                # print("timed out", timed_out)
-                if timed_out:
-                    continue
-                stream.stop_stream()
-                stream.close()
-                stream = self.p.open(format=pyaudio.paInt16,
-                    channels=1,
-                    rate=self.config.Sample_rate,
-                    input=True,
-                    frames_per_buffer=int(self.config.Sample_rate * self.config.Bit_duration))
-                # print("Starting Broadcast Message")
-                message, sender_id, message_id = self.receiver.receive_message(stream)
-                if "?" in message:
-                    # If the message is not received properly, then ignore it
-                    stream = self.return_stream_pre(stream)
-                    continue
-                if (sender_id, message_id) not in self.all_messages_received:
-                    self.all_messages_received.add((sender_id, message_id))
-                    print("[RECVD]: ", message, " ", sender_id, " ", get_ntp_timestamp())
-                stream.stop_stream()
-                stream.close()
-                stream = self.p.open(format=pyaudio.paFloat32,
-                    channels=1,
-                    rate=self.config.Sample_rate,
-                    output=True)
-                time.sleep(0.3)
-                # Send acknowledgement
-                if self.config.num_nodes == 2:
-                    self.sender.send_ending_signal(stream, freq=self.config.ending_signals_map[self.config.node_id])
-                    stream = self.return_stream_pre(stream)
-                    continue
-                if sender_id == 1:
-                    if self.config.node_id == "10":
-                        self.sender.send_ending_signal(stream, freq=self.config.ending_signals_map[self.config.node_id])
-                    else:
-                        time.sleep(self.config.Bit_duration)
-                        self.sender.send_ending_signal(stream, freq=self.config.ending_signals_map[self.config.node_id])
-                else:
-                    if self.config.node_id == "01":
-                        self.sender.send_ending_signal(stream, freq=self.config.ending_signals_map[self.config.node_id])
-                    else:
-                        time.sleep(self.config.Bit_duration)
-                        self.sender.send_ending_signal(stream, freq=self.config.ending_signals_map[self.config.node_id])
-                stream = self.return_stream_pre(stream)
-            elif self.freq_is_preamble(current_freq):
-                # Preamble frequency detected
-                # print("Preamble Started.")
-                timed_out = self.receiver.receive_preamble(self.config.Preamble_length-1, stream, self.config.rts_preamble_freq)
-                # print("timed out", timed_out)
-                if timed_out:
-                    continue
-                if not timed_out:
-                    # print("Preamble Detected.")
-                    stream.stop_stream()
-                    stream.close()
-                    stream = self.p.open(format=pyaudio.paInt16,
-                        channels=1,
-                        rate=self.config.Sample_rate,
-                        input=True,
-                        frames_per_buffer=int(self.config.Sample_rate * self.config.Bit_duration))
-                    # print("Starting RTS Detection...")
-                    is_message_for_us, sender_id = self.receiver.receive_rts(self.config.node_id, stream)
-                    # print("RTS Found!")
-                    stream.stop_stream()
-                    stream.close()
-                    if is_message_for_us:
-                        stream = self.p.open(format=pyaudio.paFloat32,
-                            channels=1,
-                            rate=self.config.Sample_rate,
-                            output=True)
-                        # print("CTS Preamble")
-                        time.sleep(0.3)
-                        # Send CTS
-                        self.sender.send_preamble(stream, self.config.cts_preamble_freq)
-                        # print("CTS")
-                        self.sender.send_cts(stream, cts_message=self.config.node_id+sender_id)
-                        stream.stop_stream()
-                        stream.close()
-                        stream = self.p.open(format=pyaudio.paInt16,
-                            channels=1,
-                            rate=self.config.Sample_rate,
-                            input=True,
-                            frames_per_buffer=int(self.config.Sample_rate * self.config.Preamble_duration))
-                        # print("Start Receiving Message")
-                        timed_out = self.receiver.receive_preamble(self.config.Preamble_length, stream, self.config.message_preamble_freq)
-                        stream.stop_stream()
-                        stream.close()
-                        if timed_out:
-                            stream = self.return_stream_pre(stream)
-                            continue
-                        # print("timed out", timed_out)
-                        if not timed_out:
-                            stream = self.p.open(format=pyaudio.paInt16,
-                                                channels=1,
-                                                rate=self.config.Sample_rate,
-                                                input=True,
-                                                frames_per_buffer=int(self.config.Sample_rate * self.config.Bit_duration))
-                            # print("Starting Message")
-                            message, sender_id, message_id = self.receiver.receive_message(stream)
-                            if "?" in message:
-                                # Message not received properly
-                                stream = self.return_stream_pre(stream)
-                                continue
-                            if (sender_id, message_id) not in self.all_messages_received:
-                                self.all_messages_received.add((sender_id, message_id))
-                                print("[RECVD]: ", message, " ", sender_id, " ", get_ntp_timestamp())
-                            stream.stop_stream()
-                            stream.close()
-                            stream = self.p.open(format=pyaudio.paFloat32,
-                                channels=1,
-                                rate=self.config.Sample_rate,
-                                output=True)
-                            time.sleep(0.3)
-                            self.sender.send_ending_signal(stream)
-                            stream.stop_stream()
-                            stream.close()
-                            stream = self.p.open(format=pyaudio.paInt16,
-                                channels=1,
-                                rate=self.config.Sample_rate,
-                                input=True,
-                                frames_per_buffer=int(self.config.Sample_rate * self.config.Preamble_duration))
-                    else:
-                        stream.stop_stream()
-                        stream.close()
-                        stream = self.p.open(format=pyaudio.paInt16,
-                            channels=1,
-                            rate=self.config.Sample_rate,
-                            input=True,
-                            frames_per_buffer=int(self.config.Sample_rate * self.config.Bit_duration))
-                        timed_out = self.receiver.wait_for_ending_signal(stream)
-                        stream.stop_stream()
-                        stream.close()
-                        stream = self.p.open(format=pyaudio.paInt16,
-                            channels=1,
-                            rate=self.config.Sample_rate,
-                            input=True,
-                            frames_per_buffer=int(self.config.Sample_rate * self.config.Preamble_duration))
-            else:
-                if self.has_msg_to_send and self.current_wait_time <= 0 and not self.is_channel_busy:
-                    stream.stop_stream()
-                    stream.close()
-                    stream = self.p.open(format=pyaudio.paFloat32,
-                        channels=1,
-                        rate=self.config.Sample_rate,
-                        output=True)
-                    self.current_message = self.current_message_queue.get()
-                    if self.is_message_broadcast(self.current_message):
-                        # print("Sending Broadcast Preamble")
-                        self.sender.send_preamble(stream, self.config.broadcast_preamble_freq)
-                        # print("Sending Broadcast Message")
-                        self.sender.send_message(stream, self.current_message[0])
-                        print("[SENT]: ", self.current_message[0][4:], " ", self.current_message[1].replace("\n", ""), " ", get_ntp_timestamp())
-                        stream.stop_stream()
-                        stream.close()
-                        stream = self.p.open(format=pyaudio.paInt16,
-                            channels=1,
-                            rate=self.config.Sample_rate,
-                            input=True,
-                            frames_per_buffer=int(self.config.Sample_rate * self.config.Bit_duration))
-                        # If we do not receive ackonwledgement, then we will resend the message after waiting for a random time following exponential backoff
-                        if self.config.num_nodes == 2:
-                            if self.config.node_id == "10":
-                                timed_out = self.receiver.wait_for_ending_signal(stream, self.config.ending_signals_map["01"]) 
-                                # print("timed out", timed_out)   
-                                if timed_out:
-                                    self.config.num_collisions += 1
-                                    # print("Num collisions: ", self.config.num_collisions)
-                                    self.current_wait_time = self.wait_random()
-                                    self.current_message_queue.put(self.current_message)
-                                    stream = self.return_stream_pre(stream)
-                                    continue
-                                self.has_msg_to_send = False
-                                self.num_collisions = 0
-                            elif self.config.node_id == "01":
-                                timed_out = self.receiver.wait_for_ending_signal(stream, self.config.ending_signals_map["10"]) 
-                                # print("timed out", timed_out)   
-                                if timed_out:
-                                    self.config.num_collisions += 1
-                                    # print("Num collisions: ", self.config.num_collisions)
-                                    self.current_wait_time = self.wait_random()
-                                    self.current_message_queue.put(self.current_message)
-                                    stream = self.return_stream_pre(stream)
-                                    continue
-                                self.has_msg_to_send = False
-                                self.num_collisions = 0
-                            stream = self.return_stream_pre(stream)
-                            continue
-                        if self.config.node_id == "01":
-                            timed_out = self.receiver.wait_for_ending_signal(stream, self.config.ending_signals_map["10"]) 
-                            if timed_out:
-                                self.current_message_queue.put(self.current_message)
-                                stream = self.return_stream_pre(stream)
-                                self.config.num_collisions += 1
-                                # print("Num collisions: ", self.config.num_collisions)
-                                self.current_wait_time = self.wait_random()
-                                continue
-                            timed_out = self.receiver.wait_for_ending_signal(stream, self.config.ending_signals_map["11"]) 
-                            if timed_out:
-                                self.current_message_queue.put(self.current_message)
-                                stream = self.return_stream_pre(stream)
-                                self.config.num_collisions += 1
-                                # print("Num collisions: ", self.config.num_collisions)
-                                self.current_wait_time = self.wait_random()
-                                continue
-                            self.has_msg_to_send = False
-                            self.num_collisions = 0
-                        elif self.config.node_id == "10":
-                            timed_out = self.receiver.wait_for_ending_signal(stream, self.config.ending_signals_map["01"]) 
-                            if timed_out:
-                                self.config.num_collisions += 1
-                                # print("Num collisions: ", self.config.num_collisions)
-                                self.current_wait_time = self.wait_random()
-                                self.current_message_queue.put(self.current_message)
-                                stream = self.return_stream_pre(stream)
-                                continue
-                            timed_out = self.receiver.wait_for_ending_signal(stream, self.config.ending_signals_map["11"]) 
-                            if timed_out:
-                                self.current_message_queue.put(self.current_message)
-                                stream = self.return_stream_pre(stream)
-                                self.config.num_collisions += 1
-                                # print("Num collisions: ", self.config.num_collisions)
-                                self.current_wait_time = self.wait_random()
-                                continue
-                            self.has_msg_to_send = False
-                            self.num_collisions = 0
-                        else:
-                            timed_out = self.receiver.wait_for_ending_signal(stream, self.config.ending_signals_map["01"]) 
-                            if timed_out:
-                                self.current_message_queue.put(self.current_message)
-                                stream = self.return_stream_pre(stream)
-                                self.config.num_collisions += 1
-                                # print("Num collisions: ", self.config.num_collisions)
-                                self.current_wait_time = self.wait_random()
-                                continue
-                            timed_out = self.receiver.wait_for_ending_signal(stream, self.config.ending_signals_map["10"]) 
-                            if timed_out:
-                                self.current_message_queue.put(self.current_message)
-                                stream = self.return_stream_pre(stream)
-                                self.config.num_collisions += 1
-                                # print("Num collisions: ", self.config.num_collisions)
-                                self.current_wait_time = self.wait_random()
-                                continue
-                            self.has_msg_to_send = False
-                            self.num_collisions = 0
-                        stream = self.return_stream_pre(stream)
-                        continue
-                    # print("Sending Preamble")
-                    # UNICAST message
-                    self.sender.send_preamble(stream, self.config.rts_preamble_freq)
-                    # print("Sending RTS")
-                    self.sender.send_rts(stream, rts_message=self.config.node_id+str(bin(int(self.current_message[1]))[2:].zfill(2)))
-                    stream.stop_stream()
-                    stream.close()
-                    # print("RTS SENT")
-                    stream = self.p.open(format=pyaudio.paInt16,
-                        channels=1,
-                        rate=self.config.Sample_rate,
-                        input=True,
-                        frames_per_buffer=int(self.config.Sample_rate * self.config.Preamble_duration))
-                    # print("Waiting for CTS Preamble")
-                    timed_out = self.receiver.receive_preamble(self.config.Preamble_length, stream, self.config.cts_preamble_freq)
-                    if timed_out:
-                        self.config.num_collisions += 1
-                        # print("Num collisions: ", self.config.num_collisions)
-                        self.current_wait_time = self.wait_random()
-                        # print("Random Wait Time: ", self.current_wait_time)
-                        self.current_message_queue.put(self.current_message)
-                        continue
-                    # print("timed_out", timed_out)
-                    if not timed_out:
-                        self.config.num_collisions = 0
-                        stream.stop_stream()
-                        stream.close()
-                        stream = self.p.open(format=pyaudio.paInt16,
-                            channels=1,
-                            rate=self.config.Sample_rate,
-                            input=True,
-                            frames_per_buffer=int(self.config.Sample_rate * self.config.Bit_duration))
-                        # print("Waiting for CTS")
-                        is_cts_for_us, sender_id = self.receiver.receive_cts(stream, self.config.node_id) 
-                        if not is_cts_for_us:
-                            self.current_message_queue.put(self.current_message) 
-                        if is_cts_for_us:
-                            stream.stop_stream()
-                            stream.close()
-                            stream = self.p.open(format=pyaudio.paFloat32,
-                                channels=1,
-                                rate=self.config.Sample_rate,
-                                output=True)
-                            time.sleep(0.3) # Processing Time
-                            # print("Sending Preamble Message")
-                            self.sender.send_preamble(stream, self.config.message_preamble_freq)
-                            # print("Sending Message")
-                            self.sender.send_message(stream, self.current_message[0])
-                            print("[SENT]: ", self.current_message[0][4:], " ", self.current_message[1].replace("\n", ""), " ", get_ntp_timestamp())
-                            stream.stop_stream()   
-                            stream.close()  
-                            stream = self.p.open(format=pyaudio.paInt16,
-                            channels=1,
-                            rate=self.config.Sample_rate,
-                            input=True,
-                            frames_per_buffer=int(self.config.Sample_rate * self.config.Bit_duration))
-                            timed_out = self.receiver.wait_for_ending_signal(stream)
-                            if not timed_out:
-                                if self.current_message_queue.empty():
-                                    self.has_msg_to_send = False
-                                    self.num_collisions = 0
-                                # print("Ending Signal Received Successfully!")
-                            if timed_out:
-                                self.current_message_queue.put(self.current_message)
-                            stream.stop_stream()   
-                            stream.close()
-                            stream = self.p.open(format=pyaudio.paInt16,
-                                channels=1,
-                                rate=self.config.Sample_rate,
-                                input=True,
-                                frames_per_buffer=int(self.config.Sample_rate * self.config.Preamble_duration))
+        self.receiver.calibrate_noise_floor(stream)
+        if self.decoder is not None:
+            self.decoder.start()
+        self.poll_outbox()
+        self.start_metrics()
+        self.running = True
+        return stream
 
-        stream.stop_stream()
-        stream.close()
+    def run(self, stream) -> None:
+        """Runs the main loop until stop() is called, then releases the audio"""
+        try:
+            while self.running:
+                # Nothing in here blocks for longer than one short frame, so timers and the outbox are always served
+                self.step(stream)
+        finally:
+            if self.decoder is not None:
+                self.decoder.stop()
+            stream.stop_stream()
+            stream.close()
+            if self.outbox is not None:
+                self.outbox.close()
+            self.stop_metrics()
+            self.engine.close()
+            if self.recorder is not None:
+                self.recorder.close()
+
+    def __call__(self) -> None:
+        """The main function that sends and receives messages"""
+        self.run(self.open())
 
 
 if __name__ == "__main__":
     main_instance = Main()
-    main_instance()
\ No newline at end of file
+    main_instance()
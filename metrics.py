@@ -0,0 +1,302 @@
+"""Runtime metrics of a node (counters, histograms, gauges) and their periodic export as JSON lines or Prometheus text"""
+import http.server
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+
+# Upper bounds in seconds of the histogram buckets (the last bucket holds everything above)
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 60, 120, 300)
+CPU_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05)
+
+HISTOGRAMS = {
+    "preamble_detection_seconds": ("Time from the channel turning busy to the detection of the preamble", LATENCY_BUCKETS),
+    "rts_cts_seconds": ("Time from the end of our RTS to the CTS", LATENCY_BUCKETS),
+    "data_airtime_seconds": ("Airtime of our data frames and aggregates", LATENCY_BUCKETS),
+    "ack_wait_seconds": ("Time spent waiting for an acknowledgement, until it came or timed out", LATENCY_BUCKETS),
+    "queueing_delay_seconds": ("Time from queueing a message to its first transmission", LATENCY_BUCKETS),
+    "dsp_frame_cpu_seconds": ("CPU time of the demodulator per captured frame", CPU_BUCKETS),
+}
+
+
+class Histogram:
+    """
+    A class used to represent the distribution of a measured value over fixed buckets
+
+
+    Attributes
+    ----------
+    bounds : tuple[float]
+        Upper bounds of the buckets
+    counts : list[int]
+        Number of values in every bucket (one more than bounds, for the values above the last bound)
+    count : int
+        Number of values observed
+    sum : float
+        Sum of the values observed
+    """
+
+    def __init__(self, bounds : tuple) -> None:
+        """Initialises the member variables of the class"""
+        self.bounds : tuple = bounds
+        self.counts : list = [0] * (len(bounds) + 1)
+        self.count : int = 0
+        self.sum : float = 0.0
+
+    def observe(self, value : float) -> None:
+        """Adds a value"""
+        index = 0
+        while index < len(self.bounds) and value > self.bounds[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self) -> list:
+        """Returns the (upper bound, number of values at most that bound) of every bucket, the last one unbounded"""
+        total = 0
+        buckets = []
+        for bound, count in zip(list(self.bounds) + [float("inf")], self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+
+class NodeMetrics:
+    """
+    A class used to represent the metrics of one node, derived from the events the node notifies its listeners of.
+    Counters and histograms are updated as events come; gauges are read from the node when a snapshot is taken, so
+    nothing is spent on them in between.
+
+
+    Attributes
+    ----------
+    node : Node
+        The node observed
+    counters : Counter
+        Value of every counter, by (name, labels) where labels is a tuple of (label, value) pairs
+    histograms : dict[str -> Histogram]
+        Histograms, by name (the keys of HISTOGRAMS)
+    queued : dict[int -> float]
+        Time every message not sent yet was queued at, by ticket
+    state : str
+        Latest state of the MAC
+    state_since : float
+        Time the MAC entered that state
+    busy_since : float
+        Time the channel turned busy, until the preamble is detected (None otherwise)
+    transmission : tuple[str, float]
+        Kind and start time of the frame being sent
+    """
+
+    def __init__(self, node) -> None:
+        """Initialises the member variables of the class"""
+        self.node = node
+        self.counters = Counter()
+        self.histograms = {name: Histogram(bounds) for name, (_, bounds) in HISTOGRAMS.items()}
+        self.queued = {}
+        self.state : str = node.mac.state
+        self.state_since : float = 0.0
+        self.busy_since = None
+        self.transmission = None
+        self.lock = threading.Lock()
+
+    def inc(self, name : str, amount : float = 1, **labels) -> None:
+        """Adds amount to a counter"""
+        self.counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def observe(self, name : str, value : float) -> None:
+        """Adds a value to a histogram from any thread (e.g. the decode thread)"""
+        with self.lock:
+            self.histograms[name].observe(value)
+
+    def on_event(self, kind : str, at : float, data : dict) -> None:
+        """Node listener: updates the counters and histograms an event concerns"""
+        with self.lock:
+            if kind == "frame":
+                self.on_frame(at, data["frame"], data["data"])
+            elif kind == "channel":
+                self.busy_since = at if data["busy"] else None
+            elif kind == "state":
+                if self.state == "WAIT_ACK":
+                    self.histograms["ack_wait_seconds"].observe(at - self.state_since)
+                self.state, self.state_since = data["state"], at
+            elif kind == "transmit":
+                self.transmission = (data["frame"], at)
+                self.inc("frames_sent_total", kind=data["frame"])
+            elif kind == "transmitted" and self.transmission is not None:
+                frame_kind, start = self.transmission
+                self.inc("airtime_seconds_total", at - start, kind=frame_kind)
+                if frame_kind == "data":
+                    self.histograms["data_airtime_seconds"].observe(at - start)
+                self.transmission = None
+            elif kind == "queued":
+                self.queued[data["ticket"]] = at
+                self.inc("messages_queued_total")
+            elif kind == "sent":
+                # Only the first transmission of a message (or of its first fragment) ends its wait in the queue
+                queued_at = self.queued.pop(data.get("ticket"), None)
+                if queued_at is not None:
+                    self.histograms["queueing_delay_seconds"].observe(at - queued_at)
+            elif kind == "failed":
+                self.queued.pop(data["ticket"], None)
+                self.inc("messages_failed_total", reason=data["reason"])
+            elif kind == "timeout":
+                self.inc("timeouts_total", state=data["state"])
+            elif kind in ("delivered", "received", "collision", "retransmission"):
+                self.inc({"delivered": "messages_delivered_total", "received": "messages_received_total",
+                          "collision": "collisions_total", "retransmission": "retransmissions_total"}[kind])
+
+    def on_frame(self, at : float, kind : str, data : dict) -> None:
+        """Counts a frame event of the demodulator"""
+        if kind in ("error", "timeout"):
+            self.inc("frames_dropped_total", reason=kind, type=data.get("type"))
+            return
+        if kind == "payload" and "?" in data["message"]:
+            # A data frame whose symbols could not all be read (or whose CRC failed)
+            self.inc("frames_dropped_total", reason="unreadable", type=data["type"])
+            return
+        self.inc("frames_received_total", kind=kind)
+        if kind == "preamble" and self.busy_since is not None:
+            self.histograms["preamble_detection_seconds"].observe(at - self.busy_since)
+            self.busy_since = None
+        elif kind == "cts" and self.state == "WAIT_CTS":
+            self.histograms["rts_cts_seconds"].observe(at - self.state_since)
+
+    def gauges(self) -> dict:
+        """Returns the current value of every gauge, by (name, labels)"""
+        mac = self.node.mac
+        gauges = {
+            ("queue_depth", ()): self.node.current_message_queue.qsize(),
+            ("mac_state", (("state", mac.state),)): 1,
+            ("backoff_slots", ()): mac.backoff_slots if mac.backoff_timer is not None else 0,
+            ("backoff_collisions", ()): mac.backoff.collisions,
+            ("reassemblies", ()): len(self.node.reassembler.partial),
+        }
+        decoder = getattr(self.node, "decoder", None)
+        if decoder is not None:
+            for name, value in decoder.stats().items():
+                gauges[("decoder_" + name, ())] = value
+        return gauges
+
+    def snapshot(self) -> dict:
+        """Returns every metric as a JSON-serialisable dict"""
+        def flat(values : dict) -> dict:
+            return {name + ("{%s}" % ",".join("%s=%s" % label for label in labels) if labels else ""): value
+                    for (name, labels), value in sorted(values.items(), key=lambda item: (item[0][0], str(item[0][1])))}
+        with self.lock:
+            return {
+                "time": round(time.time(), 3),
+                "clock": round(self.node.clock(), 3),
+                "node": self.node.config.node_id,
+                "counters": flat({key: round(value, 6) for key, value in self.counters.items()}),
+                "gauges": flat(self.gauges()),
+                "histograms": {name: {"count": histogram.count, "sum": round(histogram.sum, 6),
+                                      "buckets": {str(bound): count for bound, count in histogram.cumulative()}}
+                               for name, histogram in self.histograms.items()},
+            }
+
+    def prometheus(self) -> str:
+        """Returns every metric in the Prometheus text exposition format"""
+        node = self.node.config.node_id
+
+        def series(name : str, labels : tuple, value) -> str:
+            labels = (("node", node),) + tuple(labels)
+            return "mac_%s{%s} %s" % (name, ",".join('%s="%s"' % label for label in labels), value)
+
+        with self.lock:
+            lines = []
+            for kind, values in (("counter", self.counters), ("gauge", self.gauges())):
+                for name in sorted({name for name, _ in values}):
+                    lines.append("# TYPE mac_%s %s" % (name, kind))
+                    lines += [series(name, labels, value) for (other, labels), value in sorted(values.items(), key=str) if other == name]
+            for name, histogram in self.histograms.items():
+                lines.append("# HELP mac_%s %s" % (name, HISTOGRAMS[name][0]))
+                lines.append("# TYPE mac_%s histogram" % name)
+                for bound, count in histogram.cumulative():
+                    lines.append(series(name + "_bucket", (("le", "+Inf" if bound == float("inf") else repr(bound)),), count))
+                lines.append(series(name + "_sum", (), histogram.sum))
+                lines.append(series(name + "_count", (), histogram.count))
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """
+    A class used to represent the periodic export of a node's metrics: a JSON line appended to a file, or the
+    Prometheus text written over a file (for a textfile collector), every Config.metrics_interval seconds, and
+    optionally served on http://127.0.0.1:<Config.metrics_port>/metrics
+
+
+    Attributes
+    ----------
+    metrics : NodeMetrics
+        Metrics exported
+    format : str
+        "jsonl" or "prometheus"
+    path : str
+        File written (None to only serve them)
+    interval : float
+        Seconds between two exports
+    server : http.server.ThreadingHTTPServer
+        Endpoint serving the Prometheus text, None without a port
+    """
+
+    def __init__(self, metrics : NodeMetrics, config) -> None:
+        """Initialises the member variables of the class"""
+        self.metrics = metrics
+        self.format : str = config.metrics
+        self.path = config.metrics_file.format(node=config.node_id) if config.metrics_file else None
+        self.interval : float = config.metrics_interval
+        self.server = None
+        self.timer = None
+        if config.metrics_port:
+            exporter = self
+
+            class Handler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self) -> None:
+                    """Serves the current metrics"""
+                    body = exporter.metrics.prometheus().encode()
+                    self.send_response(200 if self.path.split("?")[0] in ("/", "/metrics") else 404)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args) -> None:
+                    """Keeps requests out of the node's output"""
+
+            self.server = http.server.ThreadingHTTPServer(("127.0.0.1", config.metrics_port), Handler)
+            threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+
+    def start(self, scheduler) -> None:
+        """Exports the metrics every interval seconds on the node's scheduler"""
+        self.timer = scheduler.call_later(self.interval, self.tick, scheduler)
+
+    def tick(self, scheduler) -> None:
+        """Exports the metrics and schedules the next export"""
+        self.export()
+        self.start(scheduler)
+
+    def export(self) -> None:
+        """Writes the metrics to the file"""
+        if self.path is None:
+            return
+        if self.format == "jsonl":
+            with open(self.path, "a") as file:
+                file.write(json.dumps(self.metrics.snapshot()) + "\n")
+        else:
+            # Written to a temporary file first, so that a reader never sees a partial exposition
+            with open(self.path + ".tmp", "w") as file:
+                file.write(self.metrics.prometheus())
+            os.replace(self.path + ".tmp", self.path)
+
+    def close(self) -> None:
+        """Exports the final metrics and stops the endpoint"""
+        if self.timer is not None:
+            self.timer.cancel()
+        self.export()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
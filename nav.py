@@ -0,0 +1,29 @@
+"""Virtual carrier sense: the duration field of RTS and CTS frames and the network allocation vector it sets"""
+import math
+
+
+def encode_duration(seconds : float, config) -> str:
+    """
+    Returns the duration field (config.nav_symbols 4-bit symbols) of an exchange lasting seconds, rounded up to
+    config.nav_unit. The largest value the field holds is saturated: it stands for an exchange too long to advertise
+    (e.g. a long aggregate), which third parties then defer on until its acknowledgement.
+    """
+    if config.nav_symbols == 0:
+        return ""
+    largest = 16 ** config.nav_symbols - 1
+    units = largest
+    if seconds < largest * config.nav_unit:
+        units = max(0, math.ceil(seconds / config.nav_unit - 1e-9))
+    return bin(units)[2:].zfill(4 * config.nav_symbols)
+
+
+def decode_duration(bits : str, config) -> float:
+    """
+    Returns the seconds advertised by a duration field (None if a symbol could not be read, math.inf if the field is
+    saturated)
+    """
+    if "?" in bits:
+        return None
+    if int(bits, 2) == 2 ** len(bits) - 1:
+        return math.inf
+    return int(bits, 2) * config.nav_unit
@@ -0,0 +1,313 @@
+"""The message queue and delivery side of a node, shared by the audio node and the MAC simulator"""
+from config import Config
+from mac import MacStateMachine, Scheduler
+from outbox import OutboxReader
+from arq import SEQUENCE_MODULUS
+from fragmentation import MAX_FRAGMENTS, Reassembler, fragment
+from metrics import MetricsExporter, NodeMetrics
+from queue import Queue, SimpleQueue
+from collections import Counter
+import itertools
+import socket
+import datetime
+
+
+def get_ntp_timestamp():
+    """Get the timestamp."""
+    try:
+        socket.setdefaulttimeout(0.5)
+        current_time = datetime.datetime.now()  # Returns current system time
+        return (current_time.strftime('%H:%M:%S'))
+        # client = ntplib.NTPClient()
+        # response = client.request('pool.ntp.org')
+        # time_string = time.strftime('%H:%M:%S', time.localtime(response.tx_time))
+        return time_string
+    except:
+        current_time = datetime.datetime.now()  # Returns current system time
+        return (current_time.strftime('%H:%M:%S'))
+
+
+def repeats(exchange : list, previous : list) -> bool:
+    """Returns whether the subframes decoded so far of an exchange (None if not) are those of the previous exchange"""
+    return len(exchange) == len(previous) and all(None in (frame, old) or frame == old for frame, old in zip(exchange, previous))
+
+
+class Node:
+    """
+    A class used to represent everything a node does besides sending and receiving signals: its queue of messages,
+    their delivery and retries, the reassembly and deduplication of received messages, its timers and its MAC.
+    Subclasses provide transmit(kind, data) and feed the MAC with frame events and channel assessments.
+
+    Attributes
+    ----------
+    config : Config
+        The configuration object with the node id and the MAC parameters
+    clock : function
+        Returns the current time in seconds on a monotonic clock (a virtual clock in simulations)
+    scheduler : Scheduler
+        Timers of the node (MAC timeouts, backoff, turnaround, outbox polling)
+    mac : MacStateMachine
+        The MAC state machine
+    stats : Counter
+        Number of events of every kind (queued, sent, received, delivered, collision, retransmission, state)
+    listeners : list[function]
+        Called with (kind, time, data) for every event
+    reassembler : Reassembler
+        Collects the fragments of the fragmented messages being received
+    outbox : OutboxReader
+        Reader of the new lines of the .buffer file (None without one: messages are then only given to submit())
+    submitted : queue.SimpleQueue
+        Messages given to submit() from other threads, queued by the main loop
+    attempts : Counter
+        Number of failed attempts of every queued message, by ticket
+    verbose : bool
+        Whether sent, received and rejected messages are printed
+    metrics : NodeMetrics
+        Runtime metrics, collected from the node's events (None unless Config.metrics is set)
+    exporter : MetricsExporter
+        Periodic export of the metrics, once started
+    """
+
+    def __init__(self, config : Config = None, clock = None, buffer_file : str = None, verbose : bool = True) -> None:
+        """Initialises the member variables of the class"""
+        self.config = config if config is not None else Config()
+        self.clock = clock
+        # Per sender, the (message id, fragment, message) of every subframe of its previous and current exchanges
+        # (None if not decoded) and the index of its last subframe
+        self.all_messages_received = {}
+        self.buffer_file = buffer_file
+        # Lines already in the .buffer file are skipped, only new lines are sent
+        self.outbox = OutboxReader(self.buffer_file, watch=self.config.outbox_watch) if self.buffer_file is not None else None
+        self.submitted = SimpleQueue()
+        self.tickets = itertools.count()
+        self.attempts = Counter()
+        self.verbose : bool = verbose
+        self.current_message_queue = Queue()
+        self.current_message = None
+        # Messages sent together with the current one (the current one first)
+        self.current_aggregate = []
+        self.scheduler = Scheduler(self.clock)
+        self.mac = MacStateMachine(self, self.scheduler)
+        self.current_message_id = 0
+        # Next selective repeat sequence number of every destination
+        self.next_sequence = Counter()
+        self.running = False
+        # Event counters, and callbacks called with (kind, time, data) for every event
+        self.stats = Counter()
+        self.listeners = []
+        self.queued_at = {}
+        self.reassembler = Reassembler(self.config.reassembly_timeout, self.config.max_reassemblies)
+        self.metrics = None
+        self.exporter = None
+        if self.config.metrics != "off":
+            self.metrics = NodeMetrics(self)
+            self.listeners.append(self.metrics.on_event)
+
+    def notify(self, kind : str, **data) -> None:
+        """Counts an event and passes it, with the current time, to every listener"""
+        self.stats[kind] += 1
+        for listener in self.listeners:
+            listener(kind, self.clock(), data)
+
+    def payload(self, message) -> str:
+        """Returns the data bits of a queued message (without its sender address and message id)"""
+        return message[0][len(self.config.node_id) + 2:]
+
+    def next_message(self, dest : str = None):
+        """
+        Returns the next queued message (the oldest one for dest, if given) and makes it the current one (None if
+        there is none)
+        """
+        if dest is None:
+            if self.current_message_queue.empty():
+                return None
+            self.current_message = self.current_message_queue.get()
+        else:
+            with self.current_message_queue.mutex:
+                queued = self.current_message_queue.queue
+                message = next((message for message in queued if message[1] == dest), None)
+                if message is None:
+                    return None
+                queued.remove(message)
+            self.current_message = message
+        self.current_aggregate = [self.current_message]
+        return self.current_message
+
+    def aggregate_messages(self, limit : int, accept = None) -> list:
+        """
+        Takes the oldest queued messages for the destination of the current message (that accept, if given, returns
+        True for) out of the queue, so that at most limit messages are sent together, and returns them all (the current
+        one first)
+        """
+        with self.current_message_queue.mutex:
+            queued = self.current_message_queue.queue
+            extra = [message for message in queued if message[1] == self.current_message[1] and (accept is None or accept(message))]
+            extra = extra[:limit - len(self.current_aggregate)]
+            for message in extra:
+                queued.remove(message)
+        self.current_aggregate += extra
+        return self.current_aggregate
+
+    def requeue_current_message(self, messages : list = None, front : bool = False) -> list:
+        """
+        Puts the messages that could not be delivered (the whole current aggregate by default) back at the tail of the
+        queue, or at its head in their order, and returns them (without the ones past the retry limit)
+        """
+        if messages is None:
+            messages = self.current_aggregate
+        if self.config.retry_limit and self.config.arq != "selective_repeat":
+            for message in messages:
+                self.attempts[message[4]] += 1
+            failed = {message[4] for message in messages if self.attempts[message[4]] > self.config.retry_limit}
+            for ticket in failed:
+                self.fail(ticket, "retry limit")
+            messages = [message for message in messages if message[4] not in failed]
+        if front:
+            with self.current_message_queue.mutex:
+                self.current_message_queue.queue.extendleft(reversed(messages))
+        else:
+            for message in messages:
+                self.current_message_queue.put(message)
+        for message in messages:
+            self.notify("retransmission", message=self.payload(message))
+        return messages
+
+    def fail(self, ticket : int, reason : str) -> None:
+        """
+        Gives up on a message: its frames still queued (other fragments) are dropped.
+        Frames with a sequence number (selective repeat) are kept, as the receiver releases nothing past a missing
+        number: the message is then not given up on and is still delivered.
+        """
+        with self.current_message_queue.mutex:
+            queued = self.current_message_queue.queue
+            frames = [message for message in queued if message[4] == ticket]
+            if any(message[2] is not None for message in frames):
+                return
+            for message in frames:
+                queued.remove(message)
+                self.queued_at.pop(message[0], None)
+        self.attempts.pop(ticket, None)
+        self.notify("failed", ticket=ticket, reason=reason)
+
+    def cancel(self, ticket : int) -> None:
+        """
+        Drops the frames of a message that are still queued (one being sent is not stopped, and frames numbered by
+        selective repeat are kept, see fail)
+        """
+        self.submitted.put(("cancel", ticket))
+
+    def message_delivered(self, messages : list = None) -> None:
+        """Records the acknowledgement of the current messages (the whole current aggregate by default)"""
+        if messages is None:
+            messages = self.current_aggregate
+        for message in messages:
+            queued_at = self.queued_at.pop(message[0], None)
+            latency = self.clock() - queued_at if queued_at is not None else None
+            self.attempts.pop(message[4], None)
+            self.notify("delivered", message=self.payload(message), dest=message[1], latency=latency, ticket=message[4])
+
+    def message_received(self, message : str, sender_id : int, message_id : int, sequence : int = None, fragment : tuple = None,
+                         subframe : int = 0, subframes : int = 1) -> None:
+        """
+        Prints a received message, unless it is a retransmission of one already received (messages with a sequence
+        number were already deduplicated by the selective repeat receive window).
+        A retransmission repeats the sender's previous exchange exactly: the frame (subframe of subframes) is dropped if
+        that exchange had the same one at this index and every other subframe decoded so far.
+        A fragment ((fragment number, more fragments), with fragmentation) is only printed with the rest of its message.
+        """
+        if sequence is None:
+            frame = (message_id, fragment, message)
+            previous, current, last_subframe = self.all_messages_received.get(sender_id, ([], [], -1))
+            if subframe <= last_subframe or len(current) != subframes:
+                # A new exchange: if the one before was a retransmission, the subframes decoded in either attempt are known
+                if repeats(current, previous):
+                    current = [new or old for new, old in zip(current, previous)]
+                previous, current = current, [None] * subframes
+            current[subframe] = frame
+            self.all_messages_received[sender_id] = (previous, current, subframe)
+            if repeats(current, previous) and previous[subframe] == frame:
+                return
+        if fragment is not None:
+            message = self.reassembler.add(sender_id, message_id, fragment[0], fragment[1], message, self.clock())
+            if message is None:
+                return
+        if self.verbose:
+            print("[RECVD]: ", message, " ", sender_id, " ", get_ntp_timestamp())
+        self.notify("received", message=message, sender=sender_id, message_id=message_id, sequence=sequence)
+
+    def stop(self) -> None:
+        """Makes the main loop return after its current iteration"""
+        self.running = False
+
+    def submit(self, bits : str, dest : str) -> int:
+        """
+        Hands a message to the main loop from any thread, like a line of the .buffer file, and returns its ticket
+        (given with its "queued", "delivered" and "failed" events)
+        """
+        ticket = next(self.tickets)
+        self.submitted.put(("send", ticket, bits, dest))
+        return ticket
+
+    def read_message(self) -> None:
+        """Queues the messages of the lines appended to the .buffer file and the ones submitted since the previous call"""
+        if self.outbox is not None:
+            for bits, dest in self.outbox.read():
+                self.queue_message(bits, dest, next(self.tickets))
+        while not self.submitted.empty():
+            command, ticket, *message = self.submitted.get()
+            if command == "send":
+                self.queue_message(*message, ticket)
+            else:
+                self.fail(ticket, "cancelled")
+
+    def queue_message(self, bits : str, dest : str, ticket : int) -> None:
+        """Queues a message as one data frame, or as its fragments with fragmentation"""
+        pieces = fragment(bits, self.config.max_frame_bits)
+        if len(pieces) > (MAX_FRAGMENTS if self.config.fragmentation else 1):
+            if self.verbose:
+                print("[TOO LONG]: ", bits, " ", dest)
+            self.notify("failed", ticket=ticket, reason="too long")
+            return
+        for number, piece in enumerate(pieces):
+            # Every fragment of a message carries the message's id
+            message = self.config.node_id + str(bin(self.current_message_id % 4)[2:].zfill(2)) + piece
+            # With selective repeat, unicast frames are numbered per destination in the order they are queued
+            sequence = None
+            if self.config.arq == "selective_repeat" and dest != "0":
+                sequence = self.next_sequence[dest]
+                self.next_sequence[dest] = (sequence + 1) % SEQUENCE_MODULUS
+            fragment_info = (number, number + 1 < len(pieces)) if self.config.fragmentation else None
+            self.current_message_queue.put((message, dest, sequence, fragment_info, ticket))
+            self.queued_at[message] = self.clock()
+        self.notify("queued", message=bits, dest=dest, ticket=ticket, frames=len(pieces))
+        self.current_message_id += 1
+
+    def poll_outbox(self) -> None:
+        """Reads the new messages of the .buffer file, and checks it again outbox_poll_interval later"""
+        self.read_message()
+        self.scheduler.call_later(self.config.outbox_poll_interval, self.poll_outbox)
+
+    def start_metrics(self) -> None:
+        """Starts exporting the metrics, if they are collected (once the node id is known)"""
+        if self.metrics is not None:
+            self.exporter = MetricsExporter(self.metrics, self.config)
+            self.exporter.start(self.scheduler)
+
+    def stop_metrics(self) -> None:
+        """Exports the metrics a last time and stops exporting them"""
+        if self.exporter is not None:
+            self.exporter.close()
+            self.exporter = None
+
+    def is_message_broadcast(self, message) -> bool:
+        """Checks if the message is a broadcast message"""
+        if message[1] == "0":
+            return True
+        return False
+
+    def transmit(self, kind : str, data : dict) -> None:
+        """
+        Starts sending a frame of the MAC ("rts", "cts", "data", "ack" or "block_ack") without waiting for it to end;
+        the MAC's on_transmitted() must be called once it has
+        """
+        raise NotImplementedError
@@ -0,0 +1,181 @@
+"""Incremental reader of the .buffer outbox: only the bytes appended since the last read are parsed"""
+import ctypes
+import ctypes.util
+import os
+import struct
+
+
+def parse_lines(lines) -> list:
+    """
+    Parses complete outbox lines ("<bits> <destination>") into (bits, destination) records in one batch.
+    Lines addressed to -1 and lines without a destination are skipped.
+    """
+    records = []
+    for line in lines:
+        fields = line.decode("utf-8", errors="replace").strip().split(" ")
+        if len(fields) < 2 or fields[1] == "-1":
+            continue
+        records.append((fields[0], fields[1]))
+    return records
+
+
+class InotifyWatcher:
+    """
+    A class used to represent a Linux inotify watch on the directory of a file, so that the file is only looked at
+    after it was written, created, moved or deleted. Raises OSError where inotify is not available.
+
+
+    Attributes
+    ----------
+    name : bytes
+        Name of the watched file inside its directory
+    fd : int
+        Non-blocking inotify file descriptor
+    """
+
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, path : str) -> None:
+        """Initialises the member variables of the class and adds the watch"""
+        name = ctypes.util.find_library("c")
+        if name is None:
+            raise OSError("libc not found")
+        libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        directory, self.name = os.path.split(os.path.abspath(path))
+        self.name = self.name.encode()
+        self.fd : int = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # The directory is watched rather than the file, so that rotation and re-creation are seen too
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        if libc.inotify_add_watch(self.fd, directory.encode(), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed")
+
+    def changed(self) -> bool:
+        """Returns whether the file was touched since the previous call (never blocks)"""
+        changed = False
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                if data[offset:offset + length].rstrip(b"\0") == self.name:
+                    changed = True
+                offset += length
+
+    def close(self) -> None:
+        """Removes the watch"""
+        os.close(self.fd)
+
+
+class OutboxReader:
+    """
+    A class used to represent an incremental reader of the outbox file.
+    It remembers the byte offset it has read up to and only reads what was appended since, so the cost of a read does
+    not depend on how long the outbox is. A partial last line is kept until its newline arrives. A truncated file is
+    read again from its start, and a rotated (replaced) file is read to its end before the new one is followed.
+    With watch=True, inotify tells when the file changed (on Linux); otherwise every read checks the file's size.
+
+
+    Attributes
+    ----------
+    path : str
+        Path of the outbox file
+    offset : int
+        Number of bytes of the current file already read
+    remainder : bytes
+        Partial last line, waiting for its newline
+    watcher : InotifyWatcher
+        The inotify watch, None when polling
+    """
+
+    def __init__(self, path : str, watch : bool = True, from_start : bool = False) -> None:
+        """Initialises the member variables of the class; existing lines are skipped unless from_start is set"""
+        self.path : str = path
+        self.file = None
+        self.identity = None
+        self.offset : int = 0
+        self.remainder : bytes = b""
+        self.watcher = None
+        if watch:
+            try:
+                self.watcher = InotifyWatcher(path)
+            except OSError:
+                self.watcher = None
+        if os.path.exists(path):
+            self.open()
+            if not from_start:
+                self.offset = os.fstat(self.file.fileno()).st_size
+
+    def open(self) -> None:
+        """Starts following the file currently at path from its beginning"""
+        self.file = open(self.path, "rb")
+        stat = os.fstat(self.file.fileno())
+        self.identity = (stat.st_dev, stat.st_ino)
+        self.offset = 0
+        self.remainder = b""
+
+    def read_new_bytes(self, size : int) -> bytes:
+        """Returns the bytes of the current file between the offset and size"""
+        if size <= self.offset:
+            return b""
+        self.file.seek(self.offset)
+        data = self.file.read(size - self.offset)
+        self.offset += len(data)
+        return data
+
+    def split(self, data : bytes) -> list:
+        """Returns the complete lines of the remainder followed by data, and keeps the new partial line"""
+        if not data:
+            return []
+        lines = (self.remainder + data).split(b"\n")
+        self.remainder = lines.pop()
+        return lines
+
+    def read(self) -> list:
+        """Returns the (bits, destination) records of the lines appended since the previous read"""
+        if self.watcher is not None and self.file is not None and not self.watcher.changed():
+            return []
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+        lines = []
+        if self.file is not None and (stat is None or (stat.st_dev, stat.st_ino) != self.identity):
+            # Rotated or removed: finish the old file (a partial last line there will never be completed)
+            lines += self.split(self.read_new_bytes(os.fstat(self.file.fileno()).st_size))
+            self.file.close()
+            self.file = None
+        if stat is None:
+            return parse_lines(lines)
+        if self.file is None:
+            self.open()
+        elif stat.st_size < self.offset:
+            # Truncated: whatever is there now was written after the truncation
+            self.offset = 0
+            self.remainder = b""
+        lines += self.split(self.read_new_bytes(stat.st_size))
+        return parse_lines(lines)
+
+    def close(self) -> None:
+        """Closes the file and the watch"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
@@ -0,0 +1,104 @@
+"""Per-destination rate adaptation in the spirit of Minstrel: the rate of every data frame follows its peer's history"""
+import random
+
+
+def rate_bits_per_second(rate : tuple) -> float:
+    """Returns the nominal data rate of a (symbol duration, tones per symbol) rate table entry"""
+    duration, tones = rate
+    return 4 * tones / duration
+
+
+class PeerRates:
+    """
+    A class used to represent the delivery history of one destination at every rate of the rate table
+
+
+    Attributes
+    ----------
+    attempts : list[int]
+        Number of data frames sent at every rate
+    successes : list[int]
+        Number of them that were acknowledged
+    probability : list[float]
+        Exponentially weighted moving average of the success of every rate (meaningless while attempts is 0)
+    """
+
+    def __init__(self, count : int) -> None:
+        """Initialises the member variables of the class"""
+        self.attempts = [0] * count
+        self.successes = [0] * count
+        self.probability = [0.0] * count
+
+
+class RateController:
+    """
+    A class used to represent Minstrel-like rate selection.
+    Every destination keeps an EWMA of the success probability of each rate, updated from acknowledgements and
+    acknowledgement timeouts. A frame normally goes at the rate with the best expected throughput (success probability
+    times nominal bit rate), falling back to rate 0; a fraction of the frames "look around" at a rate that could do
+    better than the current best, so the statistics keep following the link.
+
+
+    Attributes
+    ----------
+    rate_table : list[tuple[float, int]]
+        (symbol duration in seconds, tones per symbol) of every rate; 1 tone is FSK, more are multitone groups
+    ewma_weight : float
+        Weight of the latest outcome in the success probability
+    sample_fraction : float
+        Share of the frames sent at a look-around rate
+    peers : dict[str -> PeerRates]
+        Delivery history of every destination
+    """
+
+    def __init__(self, rate_table : list, ewma_weight : float, sample_fraction : float, rng = random) -> None:
+        """Initialises the member variables of the class"""
+        self.rate_table = rate_table
+        self.ewma_weight : float = ewma_weight
+        self.sample_fraction : float = sample_fraction
+        self.rng = rng
+        self.bits_per_second = [rate_bits_per_second(rate) for rate in rate_table]
+        self.peers = {}
+
+    def peer(self, peer : str) -> PeerRates:
+        """Returns the history of a destination, creating it on first use"""
+        stats = self.peers.get(peer)
+        if stats is None:
+            stats = PeerRates(len(self.rate_table))
+            self.peers[peer] = stats
+        return stats
+
+    def throughput(self, stats : PeerRates, rate : int) -> float:
+        """Returns the expected throughput of a rate for a destination, in bits per second"""
+        return stats.probability[rate] * self.bits_per_second[rate]
+
+    def best_rate(self, peer : str) -> int:
+        """Returns the tried rate with the best expected throughput (rate 0 until another one has proved better)"""
+        stats = self.peer(peer)
+        best = 0
+        for rate in range(1, len(self.rate_table)):
+            if stats.attempts[rate] and self.throughput(stats, rate) > self.throughput(stats, best):
+                best = rate
+        return best
+
+    def choose(self, peer : str) -> int:
+        """Returns the rate of the next data frame to a destination"""
+        best = self.best_rate(peer)
+        if self.rng.random() < self.sample_fraction:
+            stats = self.peer(peer)
+            # Only rates that could beat the current best are worth an attempt
+            candidates = [rate for rate in range(len(self.rate_table))
+                          if rate != best and self.bits_per_second[rate] > self.throughput(stats, best)]
+            if candidates:
+                return self.rng.choice(candidates)
+        return best
+
+    def report(self, peer : str, rate : int, success : bool) -> None:
+        """Records whether a data frame sent at a rate was acknowledged"""
+        stats = self.peer(peer)
+        stats.attempts[rate] += 1
+        stats.successes[rate] += int(success)
+        if stats.attempts[rate] == 1:
+            stats.probability[rate] = float(success)
+        else:
+            stats.probability[rate] += self.ewma_weight * (float(success) - stats.probability[rate])
@@ -1,8 +1,13 @@
 import numpy as np
-import pyaudio
-from scipy.fft import fft
 import time
+from audio_formats import paInt16, open_pyaudio
 from config import Config
+from goertzel import GoertzelBank, protocol_tones
+from spectral import SpectralFrontEnd, MultiToneFrontEnd, subcarrier_plan
+from cca import ClearChannelAssessor
+from fec import FrameCoder
+from demodulator import RunLengthDecoder, StreamingDemodulator, join_symbols
+from batch_decoder import BatchDecoder
 import signal
 
 timeout_flag = False
@@ -33,9 +38,9 @@ class Receiver:
     Sample_rate : int
         Sample rate in Hz (Number of measurements in a second)
     Bit_duration : float
-        Duration of each bit in seconds
+        Duration of each receiver frame while reading symbols (Ratio_of_Sender_Receiver frames per symbol)
     Preamble_duration : float
-        the duration of preamble
+        Duration of each receiver frame while hunting for preambles
     Preamble_frequency : int
         Frequency of preamble tone
     Threshold : int
@@ -56,28 +61,42 @@ class Receiver:
         Frequency for '0' bit in Hz
     Freq_bin_string : dict[int -> str]
         Mapping frequencies to their respective binary strings
+    coder : FrameCoder
+        Corrects data frames with their Reed-Solomon parity and checks their CRC (Config.crc, Config.fec_parity_symbols)
     """
 
-    def __init__(self) -> None:
+    def __init__(self, config : Config = None) -> None:
         """Initialises the member variables of the class"""
-        self.config = Config()
-        self.Sample_rate : int = 16000
-        self.Bit_duration : int = 0.1
-        self.Preamble_duration : float = 0.01
+        self.config = config if config is not None else Config()
+        self.Sample_rate : int = self.config.Sample_rate
+        # Rounded so that the frame length in samples is exact (0.6 / 6 is 0.09999...)
+        self.Bit_duration : float = round(self.config.Symbol_duration / self.config.Ratio_of_Sender_Receiver, 6)
+        self.Preamble_duration : float = self.config.Preamble_tone_duration
         self.Preamble_frequency : int = 5000
-        self.Threshold : int = 100
-        self.Preamble_length : int = 6
-        self.Frequency_1 = 8200
-        self.Frequency_0 = 7900
-        self.Ratio_of_Sender_Receiver = 6
-        self.Ratio_Threshold = 3
+        self.Threshold : int = self.config.Threshold
+        self.Preamble_length : int = self.config.Preamble_length
+        self.Frequency_1 = self.config.Frequency_1
+        self.Frequency_0 = self.config.Frequency_0
+        self.Ratio_of_Sender_Receiver = self.config.Ratio_of_Sender_Receiver
+        self.Ratio_Threshold = self.config.Ratio_Threshold
         self.freq_bin_string = {
             self.Frequency_0 : "0",
             self.Frequency_1 : "1"
         }
-        self.Frequency_filter = 1000
+        self.Frequency_filter = self.config.Frequency_filter
         for i in range(0,16):
             self.freq_bin_string[self.config.bit_start_freq+ i*self.config.bit_freq_gap] = bin(i)[2:].zfill(4)
+        # Spectral front-ends and Goertzel banks are built lazily, one per frame length
+        self.front_ends = {}
+        self.hunt_front_ends = {}
+        self.multitone_front_ends = {}
+        self.goertzel_banks = {}
+        # Used by the blocking receive_message
+        self.message_demodulator = None
+        self.cca = ClearChannelAssessor(self.config, self.Sample_rate)
+        self.coder = FrameCoder(self.config)
+        # Timeouts use this clock, which Main replaces with the audio backend's clock when it has one
+        self.clock = time.time
 
     def map_freq(self, bit_string : str) -> int:
         """
@@ -87,16 +106,170 @@ class Receiver:
         index = int(bit_string, 2)
         return 4300 + index * 200
     
+    def goertzel_bank(self, frame_length : int) -> GoertzelBank:
+        """Returns the Goertzel bank for frames of the given length"""
+        bank = self.goertzel_banks.get(frame_length)
+        if bank is None:
+            bank = GoertzelBank(protocol_tones(self.config), frame_length, self.Sample_rate, self.config.goertzel_min_ratio)
+            self.goertzel_banks[frame_length] = bank
+        return bank
+
+    def detect_tone(self, frame):
+        """
+        Returns the label of the dominant protocol tone ("?" if there is none) along with the energy of every tone
+        """
+        bank = self.goertzel_bank(len(frame))
+        index, energies = bank.detect(frame)
+        if index < 0:
+            return "?", energies
+        return bank.labels[index], energies
+
+    def detect_frequency(self, frame, filtered : bool = False) -> float:
+        """
+        Returns the peak frequency of a frame using the configured detector backend.
+        With filtered=True, only frequencies above Frequency_filter are considered.
+        """
+        if self.config.detector_backend == "goertzel":
+            # Every protocol tone is above Frequency_filter, so the bank needs no extra filtering
+            return self.goertzel_bank(len(frame)).peak_frequency(frame)
+        return self.front_end(len(frame)).peak_frequency(frame, filtered)
+
+    def front_end(self, frame_length : int) -> SpectralFrontEnd:
+        """Returns the spectral front-end for frames of the given length"""
+        front_end = self.front_ends.get(frame_length)
+        if front_end is None:
+            front_end = SpectralFrontEnd(frame_length, self.Sample_rate, self.freq_bin_string, self.Threshold, self.Frequency_filter)
+            self.front_ends[frame_length] = front_end
+        return front_end
+
+    def classify_frame(self, frame, front_end : SpectralFrontEnd, power = None) -> str:
+        """
+        Returns the label of the frame's peak frequency in the front-end's lookup table, or "?".
+        power is the frame's power spectrum (front_end.power), if it was already computed.
+        """
+        if self.config.detector_backend == "goertzel":
+            return front_end.symbol_for_frequency(self.detect_frequency(frame, filtered=True))
+        if power is not None:
+            return front_end.classify_power(power)
+        return front_end.classify(frame)
+
+    def classify_symbol(self, frame) -> str:
+        """
+        Returns the symbol carried by a frame, or "?" if the peak frequency is not a symbol frequency
+        """
+        return self.classify_frame(frame, self.front_end(len(frame)))
+
+    def classify_multitone(self, frame, groups : int = None) -> str:
+        """
+        Returns the bits carried by a multitone frame (4 per subcarrier group, subcarrier_groups by default), or "?"
+        """
+        if groups is None:
+            groups = self.config.subcarrier_groups
+        front_end = self.multitone_front_ends.get((len(frame), groups))
+        if front_end is None:
+            front_end = MultiToneFrontEnd(len(frame), self.Sample_rate, subcarrier_plan(self.config, groups), self.config.multitone_min_ratio)
+            self.multitone_front_ends[(len(frame), groups)] = front_end
+        return front_end.classify(frame)
+
+    def data_symbol_width(self) -> int:
+        """Returns the number of bits carried by one data symbol in the configured modulation"""
+        return 4 * self.config.subcarrier_groups if self.config.modulation == "multitone" else 4
+
+    def data_symbol_decoding(self, rate : int = None) -> tuple:
+        """
+        Returns how the data symbols of a frame sent at a rate of the rate table are decoded (the configured modulation
+        and Symbol_duration if rate is None): the classifier, the bits per symbol, the receiver frames per symbol and
+        the tolerance on that number
+        """
+        if rate is None:
+            ratio = self.Ratio_of_Sender_Receiver
+            threshold = self.Ratio_Threshold
+            if self.config.modulation != "multitone":
+                return self.classify_symbol, 4, ratio, threshold
+            groups = self.config.subcarrier_groups
+        else:
+            duration, groups = self.config.rate_table[rate]
+            ratio = max(1, int(round(duration / self.Bit_duration)))
+            # Shorter symbols leave less room: a one-frame glitch must not pass for a symbol
+            threshold = min(self.Ratio_Threshold, ratio // 2)
+            if groups == 1:
+                return self.classify_symbol, 4, ratio, threshold
+        return (lambda frame: self.classify_multitone(frame, groups)), 4 * groups, ratio, threshold
+
+    def classify_hunt_frame(self, frame, power = None) -> str:
+        """
+        Returns which preamble ("rts", "cts", "message", "broadcast", "aggregate", "block_ack") or ending tone ("ending", "ending_01", ...)
+        a frame carries, or "?" (power is its power spectrum, if it was already computed)
+        """
+        return self.classify_frame(frame, self.hunt_front_end(len(frame)), power)
+
+    def hunt_front_end(self, frame_length : int) -> SpectralFrontEnd:
+        """Returns the spectral front-end of the preamble and ending tones for frames of the given length"""
+        front_end = self.hunt_front_ends.get(frame_length)
+        if front_end is None:
+            tones = {
+                self.config.rts_preamble_freq: "rts",
+                self.config.cts_preamble_freq: "cts",
+                self.config.message_preamble_freq: "message",
+                self.config.broadcast_preamble_freq: "broadcast",
+                self.config.aggregate_preamble_freq: "aggregate",
+                self.config.block_ack_preamble_freq: "block_ack",
+                self.config.ending_freq: "ending",
+            }
+            for node, freq in self.config.ending_signals_map.items():
+                tones[freq] = "ending_" + node
+            front_end = SpectralFrontEnd(frame_length, self.Sample_rate, tones, self.Threshold, self.Frequency_filter, inclusive=False)
+            self.hunt_front_ends[frame_length] = front_end
+        return front_end
+
+    def read_symbols(self, stream, classify = None, ratio : int = None, ratio_threshold : int = None):
+        """
+        Reads symbol frames from the stream and yields every decoded symbol, skipping silence before the first one.
+        By default symbols are 4-bit FSK lasting Ratio_of_Sender_Receiver frames; data_symbol_decoding gives the
+        classifier and run length of the other data rates.
+        """
+        if classify is None:
+            classify = self.classify_symbol
+        decoder = RunLengthDecoder(ratio or self.Ratio_of_Sender_Receiver, self.Ratio_Threshold if ratio_threshold is None else ratio_threshold)
+        frame_length = int(self.Sample_rate * self.Bit_duration)
+        started = False
+        while True:
+            frame = np.frombuffer(stream.read(frame_length), dtype=np.int16)
+            symbol = decoder.push(classify(frame))
+            if symbol is None or (symbol == "?" and not started):
+                continue
+            started = True
+            yield symbol
+
+    def demodulator(self) -> StreamingDemodulator:
+        """Returns a streaming demodulator that decodes every frame type from a continuous capture"""
+        return StreamingDemodulator(self)
+
+    def batch_decoder(self) -> BatchDecoder:
+        """Returns a decoder of whole recordings, with the same frame events as the streaming demodulator"""
+        return BatchDecoder(self)
+
     def return_freq(self, receieve_stream) -> int:
         data = receieve_stream.read(int(self.Sample_rate * self.Preamble_duration))
         frame = np.frombuffer(data, dtype=np.int16)
-        frame = frame / np.max(np.abs(frame))
-        
-        spectrum = np.abs(fft(frame))
-        freqs = np.fft.fftfreq(len(spectrum), 1 / self.Sample_rate)
-        
-        peak_freq = freqs[np.argmax(spectrum)]
-        return peak_freq
+        # The peak is scale invariant, so the frame is not normalised (that divided silence by zero)
+        return self.detect_frequency(frame)
+
+    def calibrate_noise_floor(self, stream, duration : float = None) -> None:
+        """
+        Calibrates the clear channel assessment noise floor from a stretch of idle channel
+        """
+        if duration is None:
+            duration = self.config.cca_calibration_time
+        data = stream.read(int(self.Sample_rate * duration))
+        self.cca.calibrate(np.frombuffer(data, dtype=np.int16))
+
+    def channel_busy(self, stream) -> bool:
+        """
+        Reads one short clear channel assessment window and returns whether the channel is busy
+        """
+        data = stream.read(self.cca.window_length)
+        return self.cca.is_busy(np.frombuffer(data, dtype=np.int16))
     
     def detect_preamble(self, Preamble_frequency, Sample_rate, Threshold, preamble_stream, start_time):
         """
@@ -111,17 +284,13 @@ class Receiver:
             Threshold for frequency detection
         """
         preamble_found = False
-        while time.time() - start_time < self.config.preamble_wait_time:
+        while self.clock() - start_time < self.config.preamble_wait_time:
             # Read preamble as input
             data = preamble_stream.read(int(Sample_rate * self.Preamble_duration))
             frame = np.frombuffer(data, dtype=np.int16)
-            frame = frame / np.max(np.abs(frame))
-            
-            spectrum = np.abs(fft(frame))
-            freqs = np.fft.fftfreq(len(spectrum), 1 / Sample_rate)
             
             # Detect the peak frequency
-            peak_freq = freqs[np.argmax(spectrum)]
+            peak_freq = self.detect_frequency(frame)
 
             if abs(peak_freq - Preamble_frequency) <  Threshold:
                 preamble_found = True
@@ -132,95 +301,36 @@ class Receiver:
         """
         Start listening for the audio and also do error correction to print the correct output
         """
-        p = pyaudio.PyAudio()
+        p = open_pyaudio()
 
-        preamble_stream = p.open(format=pyaudio.paInt16,
+        stream = p.open(format=paInt16,
                         channels=1,
                         rate=self.Sample_rate,
                         input=True,
                         frames_per_buffer=int(self.Sample_rate * self.Preamble_duration))
 
-        
         # Detect preamble before starting the main signal detection
-        # print("Listening for preamble...")
         for _ in range(self.Preamble_length):
-            self.detect_preamble(self.Preamble_frequency, self.Sample_rate, self.Threshold)
-        # print("Preamble detected")
-        preamble_stream.stop_stream()
-        preamble_stream.close()
+            self.detect_preamble(self.Preamble_frequency, self.Sample_rate, self.Threshold, stream, self.clock())
 
-        # Start main signal detection after preamble
-        stream = p.open(format=pyaudio.paInt16,
-                        channels=1,
-                        rate=self.Sample_rate,
-                        input=True,
-                        frames_per_buffer=int(self.Sample_rate * self.Bit_duration),
-                        )
-        # print("Listening for audio signal...")
-
-        binary_data = ""
-        previous_bit = "?"
-        current_bit = "0"
-        current_bit_length = 0
+        # The first two symbols carry the data length, followed by the zero padded data
+        symbols = []
         data_length = -1
-
-        # Main loop to recieve the main signal
-        while True:
-            data = stream.read(int(self.Sample_rate * self.Bit_duration))
-            frame = np.frombuffer(data, dtype=np.int16)
-            frame = frame / np.max(np.abs(frame))
-            spectrum = np.abs(fft(frame))
-            freqs = np.fft.fftfreq(len(spectrum), 1 / self.Sample_rate)
-
-            # Filter the spectrum and frequencies to consider only those > Frequency_filter
-            valid_indices = freqs > self.Frequency_filter
-            filtered_spectrum = spectrum[valid_indices]
-            filtered_freqs = freqs[valid_indices]
-
-            # Find the peak frequency among the filtered frequencies
-            peak_freq = filtered_freqs[np.argmax(filtered_spectrum)]
-            freq_found = peak_freq
-
-            # Determine the current bit based on detected frequency
-            found = False
-            for freq in self.freq_bin_string:
-                if abs(freq_found - freq) <= self.Threshold:
-                    current_bit = self.freq_bin_string[freq]
-                    found = True
-                    break
-            if not found:
-                current_bit = "?"
-
-            # Process the detected bit
-            if current_bit == previous_bit:
-                current_bit_length += 1
-                if current_bit_length >= self.Ratio_of_Sender_Receiver:
-                    current_bit_length = 0
-                    binary_data += previous_bit
-            else:
-                if abs(current_bit_length - self.Ratio_of_Sender_Receiver) <= self.Ratio_Threshold:
-                    binary_data += previous_bit
-                current_bit_length = 1
-                previous_bit = current_bit
-
-            # Determine the data length from the first 8 bits
-            if data_length == -1 and len(binary_data) > 8:
-                data_length = int(binary_data[:8], 2)
-                binary_data = binary_data[8:]
-
-            # Terminate the loop when full message is recieved
-            if data_length != -1 and len(binary_data) >= data_length:
+        for symbol in self.read_symbols(stream):
+            symbols.append(symbol)
+            if data_length == -1 and len(symbols) == 2:
+                data_length = int(join_symbols(symbols).replace("?", "0"), 2)
+                symbols = []
+            if data_length != -1 and 4 * len(symbols) >= data_length:
                 break
         
-        # Print the received bitsting, along with zero padding
-        # print("The received bitstring along with zero padding: ", binary_data) 
         # Extract the relevant bits of detected data
-        binary_data = binary_data[:data_length]
-        # print("Received data from sender after removing zero padding:", binary_data)
+        binary_data = join_symbols(symbols)[:data_length]
 
         stream.stop_stream()
         stream.close()
         p.terminate()
+        return binary_data
 
     def receive_preamble(self, num_preamble_bits, stream, preamble_freq):
         """
@@ -233,7 +343,7 @@ class Receiver:
             Stream to receive the audio signal
         """
         for _ in range(num_preamble_bits):
-            preamble_found = self.detect_preamble(preamble_freq, self.Sample_rate, self.Threshold, stream, time.time())
+            preamble_found = self.detect_preamble(preamble_freq, self.Sample_rate, self.Threshold, stream, self.clock())
             if not preamble_found:
                 return True
             # print(_)
@@ -241,188 +351,48 @@ class Receiver:
 
     def receive_rts(self, node_id, stream):
         """
-        Start listening for the audio and also do error correction to print the correct output
+        Receives the RTS symbol (sender and receiver address) and its duration field, and checks if it is meant for us
         """
-        # print("Listening for audio signal...")
-
-        binary_data = ""
-        previous_bit = "?"
-        current_bit = "0"
-        current_bit_length = 0
-        data_length = -1
-
-        # Main loop to recieve the main signal
-        while True:
-            data = stream.read(int(self.Sample_rate * self.Bit_duration))
-            frame = np.frombuffer(data, dtype=np.int16)
-            frame = frame / np.max(np.abs(frame))
-            spectrum = np.abs(fft(frame))
-            freqs = np.fft.fftfreq(len(spectrum), 1 / self.Sample_rate)
-
-            # Filter the spectrum and frequencies to consider only those > Frequency_filter
-            valid_indices = freqs > self.Frequency_filter
-            filtered_spectrum = spectrum[valid_indices]
-            filtered_freqs = freqs[valid_indices]
-
-            # Find the peak frequency among the filtered frequencies
-            peak_freq = filtered_freqs[np.argmax(filtered_spectrum)]
-            freq_found = peak_freq
-
-            # Determine the current bit based on detected frequency
-            found = False
-            for freq in self.freq_bin_string:
-                if abs(freq_found - freq) <= self.Threshold:
-                    current_bit = self.freq_bin_string[freq]
-                    found = True
-                    break
-            if not found:
-                current_bit = "?"
-
-            # Process the detected bit
-            if current_bit == previous_bit:
-                current_bit_length += 1
-                if current_bit_length >= self.Ratio_of_Sender_Receiver:
-                    current_bit_length = 0
-                    binary_data += previous_bit
-            else:
-                if abs(current_bit_length - self.Ratio_of_Sender_Receiver) <= self.Ratio_Threshold:
-                    binary_data += previous_bit
-                current_bit_length = 1
-                previous_bit = current_bit
-            if len(binary_data) >= self.config.rts_cts_length:
-                break
-            # print(binary_data)
-        
-        # Print the received bitsting, along with zero padding
-        # print("The received RTS:", binary_data) 
-        # Extract the relevant bits of detected data
-        sender = binary_data[:2]
-        receiver = binary_data[2:4]
+        symbols = self.read_symbols(stream)
+        rts = next(symbols)
+        for _ in range(self.config.nav_symbols):
+            next(symbols)
+        sender = rts[:2]
+        receiver = rts[2:4]
         if receiver == node_id or receiver == "00":
             return True, sender
         return False, ""
 
     def receive_message(self, stream)->None:
-        binary_data = ""
-        previous_bit = "?"
-        current_bit = "0"
-        current_bit_length = 0
-        data_length = -1
-
-        # Main loop to recieve the main signal
+        """
+        Receives a data frame: sender and message id, length, the rate symbol if rate adaptation is on, then the zero
+        padded data in the modulation and symbol duration the frame announced, and the CRC and parity symbols that
+        correct and check it if error control is on
+        """
+        if self.message_demodulator is None:
+            self.message_demodulator = self.demodulator()
+        demodulator = self.message_demodulator
+        demodulator.clear()
+        demodulator.expect("message")
         while True:
-            data = stream.read(int(self.Sample_rate * self.Bit_duration))
-            frame = np.frombuffer(data, dtype=np.int16)
-            frame = frame / np.max(np.abs(frame))
-            spectrum = np.abs(fft(frame))
-            freqs = np.fft.fftfreq(len(spectrum), 1 / self.Sample_rate)
-
-            # Filter the spectrum and frequencies to consider only those > Frequency_filter
-            valid_indices = freqs > self.Frequency_filter
-            filtered_spectrum = spectrum[valid_indices]
-            filtered_freqs = freqs[valid_indices]
-
-            # Find the peak frequency among the filtered frequencies
-            peak_freq = filtered_freqs[np.argmax(filtered_spectrum)]
-            freq_found = peak_freq
-
-            # Determine the current bit based on detected frequency
-            found = False
-            for freq in self.freq_bin_string:
-                if abs(freq_found - freq) <= self.Threshold:
-                    current_bit = self.freq_bin_string[freq]
-                    found = True
-                    break
-            if not found:
-                current_bit = "?"
-
-            # Process the detected bit
-            if current_bit == previous_bit:
-                current_bit_length += 1
-                if current_bit_length >= self.Ratio_of_Sender_Receiver:
-                    current_bit_length = 0
-                    binary_data += previous_bit
-            else:
-                if abs(current_bit_length - self.Ratio_of_Sender_Receiver) <= self.Ratio_Threshold:
-                    binary_data += previous_bit
-                current_bit_length = 1
-                previous_bit = current_bit
-
-            # Determine the data length from the first 8 bits
-            if data_length == -1 and len(binary_data) > 8:
-                data_length = int(binary_data[4:8], 2)
-                sender = int(binary_data[0:2], 2)
-                message_id = int(binary_data[2:4], 2)
-                binary_data = binary_data[8:]
-
-            # Terminate the loop when full message is recieved
-            if data_length != -1 and len(binary_data) >= data_length:
-                break
-        
-        # Print the received bitsting, along with zero padding
-        # print("The received bitstring along with zero padding: ", binary_data) 
-        # Extract the relevant bits of detected data
-        binary_data = binary_data[:data_length]
-        # print("Received data from sender after removing zero padding:", binary_data)
-        return binary_data, sender, message_id
+            frame = np.frombuffer(stream.read(demodulator.symbol_length), dtype=np.int16)
+            for event in demodulator.feed(frame):
+                if event.kind == "payload":
+                    return event.data["message"], event.data["sender"], event.data["message_id"]
+                if event.kind in ("error", "timeout"):
+                    # The frame cannot be parsed, the caller drops messages containing "?"
+                    return "?", -1, -1
     
     def receive_cts(self, stream, node_id):
         """
-        Start listening for the audio and also do error correction to print the correct output
+        Receives the CTS symbol (sender and receiver address) and its duration field, and checks if it is meant for us
         """
-        # print("Listening for audio signal...")
-
-        binary_data = ""
-        previous_bit = "?"
-        current_bit = "0"
-        current_bit_length = 0
-        data_length = -1
-
-        # Main loop to recieve the main signal
-        while True:
-            data = stream.read(int(self.Sample_rate * self.Bit_duration))
-            frame = np.frombuffer(data, dtype=np.int16)
-            frame = frame / np.max(np.abs(frame))
-            spectrum = np.abs(fft(frame))
-            freqs = np.fft.fftfreq(len(spectrum), 1 / self.Sample_rate)
-
-            # Filter the spectrum and frequencies to consider only those > Frequency_filter
-            valid_indices = freqs > self.Frequency_filter
-            filtered_spectrum = spectrum[valid_indices]
-            filtered_freqs = freqs[valid_indices]
-
-            # Find the peak frequency among the filtered frequencies
-            peak_freq = filtered_freqs[np.argmax(filtered_spectrum)]
-            freq_found = peak_freq
-        
-            # Determine the current bit based on detected frequency
-            found = False
-            for freq in self.freq_bin_string:
-                if abs(freq_found - freq) <= self.Threshold:
-                    current_bit = self.freq_bin_string[freq]
-                    found = True
-                    break
-            if not found:
-                current_bit = "?"
-
-            # Process the detected bit
-            if current_bit == previous_bit:
-                current_bit_length += 1
-                if current_bit_length >= self.Ratio_of_Sender_Receiver:
-                    current_bit_length = 0
-                    binary_data += previous_bit
-            else:
-                if abs(current_bit_length - self.Ratio_of_Sender_Receiver) <= self.Ratio_Threshold:
-                    binary_data += previous_bit
-                current_bit_length = 1
-                previous_bit = current_bit
-            if len(binary_data) >= self.config.rts_cts_length:
-                break
-        
-        # Print the received bitsting, along with zero padding
-        # print("Received CTS", binary_data)
-        sender = binary_data[:2]
-        receiver = binary_data[2:4]
+        symbols = self.read_symbols(stream)
+        cts = next(symbols)
+        for _ in range(self.config.nav_symbols):
+            next(symbols)
+        sender = cts[:2]
+        receiver = cts[2:4]
         if receiver == node_id or receiver == "00":
             return True, sender
         return False, ""
@@ -430,18 +400,14 @@ class Receiver:
     def wait_for_ending_signal(self, stream, freq = None):
         if freq is None:
             freq = self.config.ending_freq
-        start_time = time.time() 
-        while time.time() - start_time < self.config.end_wait_time:
+        start_time = self.clock() 
+        while self.clock() - start_time < self.config.end_wait_time:
             # Read preamble as input
             data = stream.read(int(self.config.Sample_rate * self.Bit_duration))
             frame = np.frombuffer(data, dtype=np.int16)
-            frame = frame / np.max(np.abs(frame))
-            
-            spectrum = np.abs(fft(frame))
-            freqs = np.fft.fftfreq(len(spectrum), 1 / self.config.Sample_rate)
             
             # Detect the peak frequency
-            peak_freq = freqs[np.argmax(spectrum)]
+            peak_freq = self.detect_frequency(frame)
             # print("Ending Signal Frequency:", peak_freq, freq)
             if abs(peak_freq - freq) <  self.config.Threshold:
                 return False
@@ -1,9 +1,16 @@
 import numpy as np
-import pyaudio
 from time import sleep, time
 import math
 from config import Config
+from tone_bank import ToneBank, multitone_amplitude
+from spectral import subcarrier_plan
+from arq import BLOCK_ACK_GROUPS
+from fec import FrameCoder
+from demodulator import length_symbols
+from fragmentation import encode_fragment
+from airtime import data_modulation
 import random
+from collections import Counter
 
 class Sender:
     """
@@ -30,24 +37,31 @@ class Sender:
         The data to be sent
     CRC_polynomial : str
         The polynomial CRC to be used (The default one is used by us to ensure that it can correct upto 2 bit errors for input strings of max length 20 bits)
+    coder : FrameCoder
+        Computes the CRC and Reed-Solomon parity trailer of data frames (Config.crc, Config.fec_parity_symbols)
     """
 
-    def __init__(self) -> None:
+    def __init__(self, config : Config = None) -> None:
         """Initialises the member variables of the class"""
-        self.config = Config()  
-        self.Sample_rate : int = 16000
-        self.Bit_duration : float = 0.6
-        self.Preamble_duration : float = 0.01
+        self.config = config if config is not None else Config()
+        self.Sample_rate : int = self.config.Sample_rate
+        self.Bit_duration : float = self.config.Symbol_duration
+        self.Preamble_duration : float = self.config.Preamble_tone_duration
         self.Preamble_frequency : int = 5000
-        self.Amplitude : float = 4.0
-        self.Preamble_length : int = 6
-        self.num_collisions : int = 1
-
-        # The sine wave generating function requires the below values to be multiplied by 4
-        self.Bit_duration *= 4
-        self.Preamble_duration *= 4
+        self.Amplitude : float = self.config.Amplitude
+        self.Preamble_length : int = self.config.Preamble_length
         self.initial_wait_time = 2
 
+        # Tones are precomputed once per Config and shared by every transmit path
+        self.tone_bank = ToneBank.for_config(self.config)
+        # Seconds spent transmitting, per kind of transmission (preamble, rts, cts, header, payload, check, ack, ending)
+        self.airtime = Counter()
+        self.phase : float = 0.0
+        # Multitone mode: frequencies of every subcarrier group and the phase each group ended on
+        self.subcarrier_plan = subcarrier_plan(self.config)
+        self.chord_phases = [0.0] * len(self.subcarrier_plan)
+        self.coder = FrameCoder(self.config)
+
     
     def map_freq(self, bit_string : str) -> int:
         """
@@ -59,11 +73,9 @@ class Sender:
 
     def generate_sine_wave(self, frequency : int, duration : float, amplitude : float, sample_rate : int) -> np.float32:
         """
-        This function generates a sine wave according to the arguments
+        This function returns a sine wave according to the arguments (from the tone bank, do not modify it)
         """
-        t = np.linspace(0, duration, int(sample_rate * duration), False)
-        sine_wave = amplitude * np.sin(2 * np.pi * frequency * t)
-        return sine_wave.astype(np.float32)
+        return self.tone_bank.tone(frequency, duration, amplitude, sample_rate)
     
     def convert_to_binary(self, n : int) -> str:
         """
@@ -71,68 +83,117 @@ class Sender:
         """
         return bin(n)[2:].zfill(4)
 
-    def send_message(self, stream, input_string : str):
+    def play(self, stream, tones, kind : str) -> None:
+        """
+        Writes the given (frequency, duration) tones as one phase-continuous waveform and adds its duration to airtime[kind]
+        """
+        # Carrying the phase over from the previous write keeps consecutive writes continuous too
+        wave, self.phase = self.tone_bank.render(tones, self.Amplitude, self.Sample_rate, self.phase)
+        stream.write(wave, len(wave))
+        self.airtime[kind] += len(wave) / self.Sample_rate
+
+    def send_symbols(self, stream, bit_string : str, kind : str, duration : float = None) -> None:
+        """
+        Sends a bitstring (whose length is a multiple of 4) as consecutive 4-bit symbols of the given duration
+        (Bit_duration by default)
+        """
+        if duration is None:
+            duration = self.Bit_duration
+        self.play(stream, [(self.map_freq(bit_string[i:i+4]), duration) for i in range(0, len(bit_string), 4)], kind)
+
+    def send_multitone_symbols(self, stream, bit_string : str, kind : str, duration : float = None, groups : int = None) -> None:
+        """
+        Sends a bitstring (whose length is a multiple of 4 * groups, subcarrier_groups by default) as multitone symbols:
+        every group of 4 bits keys one tone of its subcarrier group, and the groups sound together
+        """
+        if duration is None:
+            duration = self.Bit_duration
+        plan = self.subcarrier_plan if groups is None else subcarrier_plan(self.config, groups)
+        groups = len(plan)
+        if len(self.chord_phases) != groups:
+            self.chord_phases = [0.0] * groups
+        chords = []
+        for i in range(0, len(bit_string), 4 * groups):
+            frequencies = [int(plan[g][int(bit_string[i + 4 * g:i + 4 * g + 4], 2)]) for g in range(groups)]
+            chords.append((frequencies, duration))
+        wave, self.chord_phases = self.tone_bank.render_chords(chords, multitone_amplitude(self.config, groups), self.Sample_rate, self.chord_phases)
+        stream.write(wave, len(wave))
+        self.airtime[kind] += len(wave) / self.Sample_rate
+
+    def send_message(self, stream, input_string : str, rate : int = None, sequence : int = None, fragment : tuple = None):
         """
-        Sends the message, along with the errors 
+        Sends the message, along with the errors.
+        The length takes two symbols (or more) when Config.max_frame_bits is above 15.
+        With rate adaptation, a rate symbol follows the length and the data uses that entry of the rate table (rate 0
+        if rate is None); otherwise the data uses the configured modulation and Bit_duration.
+        With selective repeat ARQ, a sequence number symbol comes next, then with fragmentation the fragment symbol of
+        the (fragment number, more fragments) pair (a whole message if None).
+        With error control, the CRC and parity symbols of the header and data follow the data, like the header.
         """
-        # This dictionary contains mapping from frequency to array of sound data to be sent
-        tones = {}
-        for freq in range(self.config.bit_start_freq, 8000, self.config.bit_freq_gap):
-            tones[freq] = self.generate_sine_wave(freq, self.Bit_duration, self.Amplitude, self.Sample_rate)
-        stream.write(tones[self.map_freq(input_string[:4])])
+        header = input_string[:4]
         input_string = input_string[4:]
         
         length = len(input_string)
-        length_preamble = self.convert_to_binary(length)
+        length_preamble = bin(length)[2:].zfill(4 * length_symbols(self.config))
         
-        length_mod_4 = length % 4
+        # The header, length and rate are always 4-bit symbols, the data uses the rate's (or configured) modulation
+        duration, groups = data_modulation(self.config, rate)
+        header += length_preamble
+        if self.config.rate_adaptation:
+            header += self.convert_to_binary(rate or 0)
+        if self.config.arq == "selective_repeat":
+            header += self.convert_to_binary(sequence or 0)
+        if self.config.fragmentation:
+            header += encode_fragment(*(fragment or (0, False)))
+        width = 4 * groups
+        length_mod_4 = length % width
         binary_data = input_string
         if length_mod_4 == 0:
-            length_mod_4 = 4
-        binary_data += "0" * (4 - length_mod_4)
-        # print(f"Length of binary data to be sent is {len(binary_data)} bits.")
-
-        # print("To be sent:", binary_data)
-        # print("Starting transmission...")
-        stream.write(tones[self.map_freq(length_preamble[:4])])
-        for i in range(0, len(binary_data), 4):
-            stream.write(tones[self.map_freq(binary_data[i:i+4])])
-        # print("Binary data sent.")
+            length_mod_4 = width
+        binary_data += "0" * (width - length_mod_4)
+        self.send_symbols(stream, header, "header")
+        if groups > 1:
+            self.send_multitone_symbols(stream, binary_data, "payload", duration, groups)
+        else:
+            self.send_symbols(stream, binary_data, "payload", duration)
+        if self.coder.trailer_symbols:
+            self.send_symbols(stream, self.coder.trailer(header, input_string), "check")
 
-    def send_cts(self, stream, cts_message):
+    def send_aggregate(self, stream, messages : list, rate : int = None, sequences : list = None, fragments : list = None):
         """
-        Sends the CTS message
+        Sends several messages (at most 15) as one aggregate: a symbol holding their number, then every message as a
+        subframe with its own sender and message id header (and sequence number with selective repeat, fragment symbol
+        with fragmentation)
         """
-        tones = {}
+        self.send_symbols(stream, self.convert_to_binary(len(messages)), "header")
+        for i, message in enumerate(messages):
+            self.send_message(stream, message, rate, sequences[i] if sequences else None, fragments[i] if fragments else None)
 
-        # Calculating the "tones" dictionary
-        for freq in range(self.config.bit_start_freq, 8000, self.config.bit_freq_gap):
-            tones[freq] = self.generate_sine_wave(freq, self.Bit_duration, self.Amplitude, self.Sample_rate)
+    def send_block_ack(self, stream, bits : str):
+        """
+        Sends a block acknowledgement: its preamble, then its 16 bits as one symbol keying 4 subcarrier groups
+        """
+        self.send_preamble(stream, self.config.block_ack_preamble_freq)
+        self.send_multitone_symbols(stream, bits, "ack", self.Bit_duration, BLOCK_ACK_GROUPS)
 
-        stream.write(tones[self.map_freq(cts_message[:4])])
+    def send_cts(self, stream, cts_message):
+        """
+        Sends the CTS message (addresses, then the duration field)
+        """
+        self.send_symbols(stream, cts_message, "cts")
 
 
     def send_preamble(self, stream, preamble_frequency):
         """
         Sends the preamble
         """
-        # print("Sending preamble...")
-        PREAMBLE = self.generate_sine_wave(preamble_frequency, self.Preamble_duration, self.Amplitude, self.Sample_rate)
-        for _ in range(self.Preamble_length):
-            stream.write(PREAMBLE)
-        # print("Preamble sent.")
+        self.play(stream, [(preamble_frequency, self.Preamble_duration)] * self.Preamble_length, "preamble")
 
     def send_rts(self, stream, rts_message):
         """
-        Sends the CTS message
+        Sends the RTS message (addresses, then the duration field)
         """
-        tones = {}
-
-        # Calculating the "tones" dictionary
-        for freq in range(self.config.bit_start_freq, 8000, self.config.bit_freq_gap):
-            tones[freq] = self.generate_sine_wave(freq, self.Bit_duration, self.Amplitude, self.Sample_rate)
-
-        stream.write(tones[self.map_freq(rts_message[:4])])
+        self.send_symbols(stream, rts_message, "rts")
 
     def send_ending_signal(self, stream, freq = None):
         """
@@ -140,5 +201,4 @@ class Sender:
         """
         if freq is None:
             freq = self.config.ending_freq
-        tone = self.generate_sine_wave(freq, 2*self.config.Bit_duration, self.config.Amplitude, self.config.Sample_rate)
-        stream.write(tone)
+        self.play(stream, [(freq, self.config.Ending_duration)], "ending")
@@ -0,0 +1,250 @@
+"""In-memory acoustic channel that can replace pyaudio for N virtual nodes"""
+import threading
+import numpy as np
+from audio_formats import paFloat32, paInt16, SAMPLE_SIZES
+
+
+class ChannelClosed(Exception):
+    """Raised by reads and writes once the channel has been closed"""
+
+
+def pair_matrix(value, num_nodes : int, diagonal : float) -> np.ndarray:
+    """Returns a num_nodes x num_nodes matrix from a scalar (with the given diagonal) or from a nested list"""
+    if np.isscalar(value):
+        matrix = np.full((num_nodes, num_nodes), float(value))
+        np.fill_diagonal(matrix, diagonal)
+        return matrix
+    return np.array(value, dtype=np.float64)
+
+
+class SimulatedChannel:
+    """
+    A class used to represent a shared acoustic channel between N virtual nodes.
+    Everything a node plays is clipped like a float32 sound card, attenuated, delayed and mixed into what every other
+    node hears, with additive noise and per-node clock skew.
+
+    Time is virtual: every node has its own position on the channel, reads and writes advance it, and a read only
+    returns once no other node can still write into the samples being read. Nodes therefore run as fast as their
+    processing allows (faster than real time) while the result stays the same as on a real shared channel.
+
+
+    Attributes
+    ----------
+    num_nodes : int
+        Number of virtual nodes
+    sample_rate : int
+        Sample rate in Hz
+    gain : np.ndarray
+        gain[i][j] is the amplitude factor from node i's speaker to node j's microphone
+    delay : np.ndarray
+        delay[i][j] is the propagation delay from node i to node j in samples
+    noise : float
+        Standard deviation of the additive noise (1.0 is full scale)
+    skew : np.ndarray
+        Relative clock error of every node (e.g. 50e-6 for a clock running 50 ppm fast)
+    positions : list[float]
+        Position of every node on the channel, in true samples
+    horizons : list[float]
+        Earliest position at which every node could still start writing (inf once a node is closed)
+    """
+
+    def __init__(self, num_nodes : int, sample_rate : int = 16000, attenuation = 1.0, delay = 0.0, noise : float = 0.0, clock_skew = 0.0, self_gain : float = 0.0, seed : int = None) -> None:
+        """Initialises the member variables of the class"""
+        self.num_nodes : int = num_nodes
+        self.sample_rate : int = sample_rate
+        self.gain = pair_matrix(attenuation, num_nodes, self_gain)
+        self.delay = np.rint(pair_matrix(delay, num_nodes, 0.0) * sample_rate).astype(np.int64)
+        self.noise : float = noise
+        self.skew = np.broadcast_to(np.asarray(clock_skew, dtype=np.float64), (num_nodes,)).copy()
+        self.rng = np.random.default_rng(seed)
+        self.air = [np.zeros(sample_rate, dtype=np.float32) for _ in range(num_nodes)]
+        self.air_base = [0] * num_nodes
+        self.positions = [0.0] * num_nodes
+        self.horizons = [float("inf")] * num_nodes
+        self.lock = threading.Condition()
+        self.closed : bool = False
+
+    def close(self) -> None:
+        """Closes the channel: every blocked or later read and write raises ChannelClosed"""
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+
+    def node(self, index : int) -> "SimulatedAudio":
+        """Returns the pyaudio-like backend of one node"""
+        return SimulatedAudio(self, index)
+
+    def activate(self, index : int) -> None:
+        """Marks a node as running, so that others wait for it before reading"""
+        with self.lock:
+            if self.horizons[index] == float("inf"):
+                self.horizons[index] = self.positions[index]
+                self.lock.notify_all()
+
+    def deactivate(self, index : int) -> None:
+        """Marks a node as gone, so that nobody waits for it anymore"""
+        with self.lock:
+            self.horizons[index] = float("inf")
+            self.lock.notify_all()
+
+    def ensure(self, index : int, end : int) -> None:
+        """Grows (and trims) a node's air buffer so that it covers true samples up to end"""
+        keep_from = int(self.positions[index]) - 2
+        if keep_from - self.air_base[index] > self.sample_rate:
+            drop = keep_from - self.air_base[index]
+            self.air[index] = self.air[index][drop:]
+            self.air_base[index] += drop
+        needed = end - self.air_base[index] + 1
+        if needed > len(self.air[index]):
+            grown = np.zeros(max(needed, 2 * len(self.air[index])), dtype=np.float32)
+            grown[:len(self.air[index])] = self.air[index]
+            self.air[index] = grown
+
+    def write(self, index : int, samples : np.ndarray) -> None:
+        """Plays float samples from a node: mixes them into what every other node hears"""
+        samples = np.clip(samples, -1.0, 1.0)
+        n = len(samples)
+        step = 1.0 / (1.0 + self.skew[index])
+        with self.lock:
+            if self.closed:
+                raise ChannelClosed()
+            start = self.positions[index]
+            for j in range(self.num_nodes):
+                if self.gain[index][j] == 0 or n == 0:
+                    continue
+                times = start + self.delay[index][j] + np.arange(n) * step
+                grid = np.arange(int(np.ceil(times[0])), int(np.floor(times[-1])) + 1)
+                if len(grid) == 0:
+                    continue
+                self.ensure(j, grid[-1])
+                values = np.interp(grid, times, samples) if step != 1.0 or start != int(start) else samples[:len(grid)]
+                # While node j was transmitting its position ran ahead of ours, it never hears what is behind it
+                skip = max(0, self.air_base[j] - grid[0])
+                if skip >= len(grid):
+                    continue
+                offset = grid[skip] - self.air_base[j]
+                self.air[j][offset:offset + len(grid) - skip] += self.gain[index][j] * values[skip:]
+            self.positions[index] = start + n * step
+            self.horizons[index] = self.positions[index]
+            self.lock.notify_all()
+
+    def read(self, index : int, n : int) -> np.ndarray:
+        """Returns the next n samples a node hears, waiting until no other node can still write into them"""
+        step = 1.0 / (1.0 + self.skew[index])
+        with self.lock:
+            start = self.positions[index]
+            end = start + n * step + 1
+            # While blocked here, this node cannot write before the end of the read
+            self.horizons[index] = end
+            self.lock.notify_all()
+            while any(self.horizons[i] + self.delay[i][index] < end for i in range(self.num_nodes) if i != index):
+                if self.closed:
+                    raise ChannelClosed()
+                self.lock.wait()
+            if self.closed:
+                raise ChannelClosed()
+            self.ensure(index, int(np.ceil(end)))
+            times = start + np.arange(n) * step
+            base = self.air_base[index]
+            if step == 1.0 and start == int(start):
+                offset = int(start) - base
+                values = self.air[index][offset:offset + n].astype(np.float64)
+            else:
+                grid = np.arange(int(np.floor(times[0])), int(np.ceil(times[-1])) + 1)
+                values = np.interp(times, grid, self.air[index][grid - base])
+            if self.noise > 0:
+                values = values + self.rng.normal(0.0, self.noise, n)
+            self.positions[index] = start + n * step
+            self.horizons[index] = self.positions[index]
+            self.lock.notify_all()
+        return values
+
+
+class SimulatedStream:
+    """
+    A class used to represent a stream opened on a SimulatedAudio, with the blocking pyaudio Stream interface
+    """
+
+    def __init__(self, audio : "SimulatedAudio", format : int, input : bool, output : bool) -> None:
+        """Initialises the member variables of the class"""
+        self.audio = audio
+        self.format : int = format
+        self.input : bool = input
+        self.output : bool = output
+
+    def read(self, num_frames : int, exception_on_overflow : bool = True) -> bytes:
+        """Returns the next num_frames captured samples in the stream's format"""
+        values = self.audio.channel.read(self.audio.index, num_frames)
+        if self.format == paFloat32:
+            return values.astype(np.float32).tobytes()
+        return (np.clip(values, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+
+    def write(self, frames, num_frames : int = None, exception_on_underflow : bool = False) -> None:
+        """Plays num_frames samples (like pyaudio, len(frames) / sample size by default)"""
+        if num_frames is None:
+            num_frames = int(len(frames) / SAMPLE_SIZES[self.format])
+        data = memoryview(frames).cast("B")
+        if self.format == paFloat32:
+            samples = np.frombuffer(data, dtype=np.float32, count=num_frames).astype(np.float64)
+        else:
+            samples = np.frombuffer(data, dtype=np.int16, count=num_frames) / 32767
+        self.audio.channel.write(self.audio.index, samples)
+
+    def get_read_available(self) -> int:
+        """Kept for compatibility with pyaudio streams"""
+        return 0
+
+    def start_stream(self) -> None:
+        """Kept for compatibility with pyaudio streams"""
+
+    def stop_stream(self) -> None:
+        """Kept for compatibility with pyaudio streams"""
+
+    def close(self) -> None:
+        """Kept for compatibility with pyaudio streams (the node stays on the channel until terminate)"""
+
+    def is_active(self) -> bool:
+        """Kept for compatibility with pyaudio streams"""
+        return True
+
+
+class SimulatedAudio:
+    """
+    A class used to represent one node's drop-in replacement for pyaudio.PyAudio.
+    Only blocking streams are supported. time() and sleep() follow the node's virtual clock, so timeouts and
+    turnaround waits take simulated rather than wall-clock time.
+    """
+
+    supports_callback = False
+
+    def __init__(self, channel : SimulatedChannel, index : int) -> None:
+        """Initialises the member variables of the class"""
+        self.channel = channel
+        self.index : int = index
+
+    def open(self, format : int = paInt16, channels : int = 1, rate : int = None, input : bool = False, output : bool = False, frames_per_buffer : int = None, stream_callback = None, **kwargs) -> SimulatedStream:
+        """Opens a blocking stream on the channel"""
+        if stream_callback is not None:
+            raise ValueError("The simulated channel only supports blocking streams")
+        if channels != 1:
+            raise ValueError("The simulated channel only supports mono streams")
+        self.channel.activate(self.index)
+        return SimulatedStream(self, format, input, output)
+
+    def get_sample_size(self, format : int) -> int:
+        """Returns the size in bytes of one sample of the format"""
+        return SAMPLE_SIZES[format]
+
+    def time(self) -> float:
+        """Returns this node's virtual clock in seconds"""
+        return self.channel.positions[self.index] * (1.0 + self.channel.skew[self.index]) / self.channel.sample_rate
+
+    def sleep(self, seconds : float) -> None:
+        """Lets seconds of virtual time pass for this node (whatever it hears meanwhile is discarded)"""
+        n = int(seconds * self.channel.sample_rate)
+        if n > 0:
+            self.channel.read(self.index, n)
+
+    def terminate(self) -> None:
+        """Removes the node from the channel"""
+        self.channel.deactivate(self.index)
@@ -0,0 +1,135 @@
+"""Precomputed spectral front-end used by the Receiver to classify frames"""
+import numpy as np
+from scipy.fft import rfft
+from config import Config
+
+
+def subcarrier_plan(config : Config, groups : int = None) -> np.ndarray:
+    """
+    Returns the subcarrier plan of the multitone mode: plan[g][i] is the frequency group g uses for the 4-bit value i.
+    The groups are interleaved, so every group spreads over the whole band. groups defaults to subcarrier_groups.
+    """
+    if groups is None:
+        groups = config.subcarrier_groups
+    index = np.arange(16)[None, :] * groups + np.arange(groups)[:, None]
+    return config.subcarrier_start_freq + index * config.subcarrier_gap
+
+
+class SpectralFrontEnd:
+    """
+    A class used to represent everything that only depends on the frame length, computed once:
+    the real-FFT frequency axis, the Frequency_filter cut-off and a bin-index -> symbol lookup table,
+    so classifying a frame is one real FFT, one argmax and one index operation.
+
+
+    Attributes
+    ----------
+    frame_length : int
+        Number of samples in each frame
+    sample_rate : int
+        Sample rate in Hz
+    freqs : np.ndarray
+        Frequency of every real-FFT bin
+    first_bin : int
+        Index of the first bin above Frequency_filter
+    labels : list[str]
+        The symbols, in the order they are looked up
+    lut : np.ndarray
+        Index into labels for every bin, or -1 if the bin is not within Threshold of any symbol frequency
+        (inclusive=False makes the Threshold comparison strict, as the preamble checks do)
+    """
+
+    def __init__(self, frame_length : int, sample_rate : int, freq_bin_string : dict, threshold : int, frequency_filter : int, inclusive : bool = True) -> None:
+        """Initialises the member variables of the class"""
+        self.frame_length : int = frame_length
+        self.sample_rate : int = sample_rate
+        self.freqs = np.fft.rfftfreq(frame_length, 1 / sample_rate)
+        self.first_bin : int = int(np.searchsorted(self.freqs, frequency_filter, side="right"))
+        symbol_freqs = list(freq_bin_string.keys())
+        self.labels = list(freq_bin_string.values())
+        self.lut = np.full(len(self.freqs), -1, dtype=np.int64)
+        # Walk the symbols in reverse so that, like the old dict scan, the first matching symbol wins
+        for index in reversed(range(len(symbol_freqs))):
+            distance = np.abs(self.freqs - symbol_freqs[index])
+            self.lut[(distance <= threshold) if inclusive else (distance < threshold)] = index
+        self.labels.append("?")
+
+    def power(self, frame : np.ndarray) -> np.ndarray:
+        """Returns the power spectrum of a frame"""
+        spectrum = rfft(frame)
+        return spectrum.real ** 2 + spectrum.imag ** 2
+
+    def peak_bin(self, frame : np.ndarray, filtered : bool = False) -> int:
+        """Returns the bin with the most power (only bins above Frequency_filter if filtered)"""
+        power = self.power(frame)
+        if filtered:
+            return self.first_bin + int(np.argmax(power[self.first_bin:]))
+        return int(np.argmax(power))
+
+    def peak_frequency(self, frame : np.ndarray, filtered : bool = False) -> float:
+        """Returns the frequency with the most power"""
+        return self.freqs[self.peak_bin(frame, filtered)]
+
+    def symbol_for_bin(self, index : int) -> str:
+        """Returns the symbol of a bin, or "?" if it does not belong to any"""
+        return self.labels[self.lut[index]]
+
+    def symbol_for_frequency(self, freq : float) -> str:
+        """Returns the symbol of a frequency, or "?" if it does not belong to any"""
+        index = int(round(freq * self.frame_length / self.sample_rate))
+        if index < 0 or index >= len(self.lut):
+            return "?"
+        return self.labels[self.lut[index]]
+
+    def classify(self, frame : np.ndarray) -> str:
+        """Returns the symbol of the strongest bin above Frequency_filter, or "?" """
+        return self.labels[self.lut[self.peak_bin(frame, filtered=True)]]
+
+    def classify_power(self, power : np.ndarray) -> str:
+        """Returns the symbol of the strongest bin above Frequency_filter of a frame's power spectrum, or "?" """
+        return self.labels[self.lut[self.first_bin + int(np.argmax(power[self.first_bin:]))]]
+
+
+class MultiToneFrontEnd:
+    """
+    A class used to represent the multitone counterpart of SpectralFrontEnd: the FFT bin of every subcarrier is
+    computed once, so decoding a frame is one real FFT, one gather and one argmax per subcarrier group.
+
+
+    Attributes
+    ----------
+    frame_length : int
+        Number of samples in each frame
+    sample_rate : int
+        Sample rate in Hz
+    bins : np.ndarray
+        bins[g][i] is the FFT bin of the tone group g uses for the value i
+    min_ratio : float
+        Minimum share of a group's subcarrier power its strongest tone needs for the frame to be decoded
+    labels : list[str]
+        The 4-bit string of every tone index
+    """
+
+    def __init__(self, frame_length : int, sample_rate : int, plan : np.ndarray, min_ratio : float) -> None:
+        """Initialises the member variables of the class"""
+        self.frame_length : int = frame_length
+        self.sample_rate : int = sample_rate
+        self.bins = np.rint(np.asarray(plan) * frame_length / sample_rate).astype(np.int64)
+        if len(np.unique(self.bins)) != self.bins.size or self.bins.max() > frame_length // 2:
+            raise ValueError("The subcarriers do not fall on distinct FFT bins below Nyquist for %d-sample frames" % frame_length)
+        self.min_ratio : float = min_ratio
+        self.labels = [bin(i)[2:].zfill(4) for i in range(16)]
+        self.rows = np.arange(len(self.bins))
+
+    def power(self, frame : np.ndarray) -> np.ndarray:
+        """Returns the power of every subcarrier, one row per group"""
+        spectrum = rfft(frame)
+        return (spectrum.real ** 2 + spectrum.imag ** 2)[self.bins]
+
+    def classify(self, frame : np.ndarray) -> str:
+        """Returns the bits carried by a frame (4 per group), or "?" if any group has no clear tone"""
+        power = self.power(frame)
+        best = np.argmax(power, axis=1)
+        if np.any(power[self.rows, best] < self.min_ratio * np.sum(power, axis=1)):
+            return "?"
+        return "".join(self.labels[i] for i in best)
@@ -0,0 +1,157 @@
+"""Cache of precomputed tones shared by every transmit path of the Sender"""
+import weakref
+from collections import OrderedDict
+import numpy as np
+from arq import BLOCK_ACK_GROUPS
+from config import Config
+from spectral import subcarrier_plan
+
+
+# One bank per Config object, so that every Sender built from the same configuration shares it
+_banks = weakref.WeakKeyDictionary()
+
+
+def multitone_amplitude(config : Config, groups : int = None) -> float:
+    """Returns the amplitude of every subcarrier, chosen so that the sum of the groups' tones never clips"""
+    if groups is None:
+        groups = config.subcarrier_groups
+    return min(config.Amplitude, 1.0) / groups
+
+
+def data_tones(config : Config, duration : float, groups : int) -> list:
+    """Returns the (frequency, duration, amplitude) of every tone of data symbols with that duration and number of groups"""
+    if groups == 1:
+        return [(config.bit_start_freq + i * config.bit_freq_gap, duration, config.Amplitude) for i in range(16)]
+    amplitude = multitone_amplitude(config, groups)
+    return [(int(frequency), duration, amplitude) for frequency in subcarrier_plan(config, groups).flatten()]
+
+
+def sender_tones(config : Config) -> list:
+    """Returns the (frequency, duration, amplitude) of every tone the Sender plays at the configured rate"""
+    tones = data_tones(config, config.Symbol_duration, 1)
+    preambles = (config.rts_preamble_freq, config.cts_preamble_freq, config.message_preamble_freq,
+                 config.broadcast_preamble_freq, config.aggregate_preamble_freq, config.block_ack_preamble_freq)
+    tones += [(frequency, config.Preamble_tone_duration, config.Amplitude) for frequency in preambles]
+    endings = [config.ending_freq] + list(config.ending_signals_map.values())
+    tones += [(frequency, config.Ending_duration, config.Amplitude) for frequency in endings]
+    if config.modulation == "multitone":
+        tones += data_tones(config, config.Symbol_duration, config.subcarrier_groups)
+    if config.arq == "selective_repeat":
+        tones += data_tones(config, config.Symbol_duration, BLOCK_ACK_GROUPS)
+    return tones
+
+
+class ToneBank:
+    """
+    A class used to represent a bounded LRU cache of precomputed tones.
+    For every key it stores the quadrature pair sin(2*pi*f*t), cos(2*pi*f*t), which lets a symbol start at any phase
+    with just two scaled additions, so concatenated symbols are phase-continuous and do not click.
+
+
+    Attributes
+    ----------
+    max_entries : int
+        Maximum number of (frequency, duration, amplitude, sample rate) keys kept in the cache
+    entries : OrderedDict[tuple -> tuple[np.ndarray, np.ndarray]]
+        The cached quadrature pairs, least recently used first
+    hits : int
+        Number of lookups served from the cache
+    misses : int
+        Number of lookups that had to generate the tone
+    pinned : set[tuple]
+        Keys warmed for the Sender's configured rate, which are never evicted
+    """
+
+    def __init__(self, max_entries : int = 64) -> None:
+        """Initialises the member variables of the class"""
+        self.max_entries : int = max_entries
+        self.entries = OrderedDict()
+        self.hits : int = 0
+        self.misses : int = 0
+        self.pinned = set()
+
+    @staticmethod
+    def for_config(config : Config) -> "ToneBank":
+        """
+        Returns the bank shared by everything built from this configuration, creating and warming it once (it is made
+        large enough for every tone the Sender plays at the configured rate, and these are never evicted)
+        """
+        bank = _banks.get(config)
+        if bank is None:
+            bank = ToneBank(max(config.tone_bank_size, len(sender_tones(config))))
+            bank.warm(config)
+            _banks[config] = bank
+        return bank
+
+    def warm(self, config : Config) -> None:
+        """
+        Precomputes the tones the Sender looks up: the 4-bit symbols, preambles and ending tones, the data tones and, with
+        selective repeat, the block acknowledgement subcarriers. With rate adaptation the other rates' tones follow while
+        the bank has room for them.
+        """
+        for frequency, duration, amplitude in sender_tones(config):
+            self.get(frequency, duration, amplitude, config.Sample_rate)
+            self.pinned.add((frequency, duration, amplitude, config.Sample_rate))
+        if config.rate_adaptation:
+            for duration, groups in config.rate_table:
+                keys = data_tones(config, duration, groups)
+                if len(self.entries) + len(keys) > self.max_entries:
+                    break
+                for frequency, duration, amplitude in keys:
+                    self.get(frequency, duration, amplitude, config.Sample_rate)
+
+    def get(self, frequency : float, duration : float, amplitude : float, sample_rate : int):
+        """Returns the (sin, cos) pair for the key, generating it and evicting the oldest unpinned entry if needed"""
+        key = (frequency, duration, amplitude, sample_rate)
+        pair = self.entries.get(key)
+        if pair is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return pair
+        self.misses += 1
+        t = np.arange(int(sample_rate * duration)) / sample_rate
+        angle = 2 * np.pi * frequency * t
+        pair = ((amplitude * np.sin(angle)).astype(np.float32), (amplitude * np.cos(angle)).astype(np.float32))
+        self.entries[key] = pair
+        if len(self.entries) > self.max_entries:
+            del self.entries[next(key for key in self.entries if key not in self.pinned)]
+        return pair
+
+    def tone(self, frequency : float, duration : float, amplitude : float, sample_rate : int) -> np.ndarray:
+        """Returns the tone starting at phase 0 (the returned array is shared, do not modify it)"""
+        return self.get(frequency, duration, amplitude, sample_rate)[0]
+
+    def render(self, tones, amplitude : float, sample_rate : int, phase : float = 0.0):
+        """
+        Concatenates the given (frequency, duration) tones into one phase-continuous waveform.
+        Returns the waveform and the phase at its end, so a later call can carry on from it.
+        """
+        pairs = [(frequency, self.get(frequency, duration, amplitude, sample_rate)) for frequency, duration in tones]
+        out = np.empty(sum(len(pair[0]) for _, pair in pairs), dtype=np.float32)
+        start = 0
+        for frequency, (sin_wave, cos_wave) in pairs:
+            n = len(sin_wave)
+            # sin(phase + wt) = cos(phase) sin(wt) + sin(phase) cos(wt)
+            np.multiply(sin_wave, np.float32(np.cos(phase)), out=out[start:start + n])
+            out[start:start + n] += np.float32(np.sin(phase)) * cos_wave
+            phase = (phase + 2 * np.pi * frequency * n / sample_rate) % (2 * np.pi)
+            start += n
+        return out, phase
+
+    def render_chords(self, chords, amplitude : float, sample_rate : int, phases):
+        """
+        Concatenates (frequencies, duration) chords, one frequency per subcarrier group, into one waveform in which
+        every group is phase-continuous. Returns the waveform and the phase of every group at its end.
+        """
+        phases = list(phases)
+        out = np.zeros(sum(int(sample_rate * duration) for _, duration in chords), dtype=np.float32)
+        start = 0
+        for frequencies, duration in chords:
+            n = int(sample_rate * duration)
+            for group, frequency in enumerate(frequencies):
+                sin_wave, cos_wave = self.get(frequency, duration, amplitude, sample_rate)
+                out[start:start + n] += np.float32(np.cos(phases[group])) * sin_wave
+                out[start:start + n] += np.float32(np.sin(phases[group])) * cos_wave
+                phases[group] = (phases[group] + 2 * np.pi * frequency * n / sample_rate) % (2 * np.pi)
+            start += n
+        return out, phases